@@ -0,0 +1,237 @@
+# Copyright (C) 2023 Martin Pretz
+
+import os
+import gzip
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime
+import config
+from helper import Helper
+from replay import get_sessions
+
+CREATE_ARCHIVE_TABLES_QUERY = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS fetches (
+    run_id INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    fetched_at TEXT NOT NULL,
+    digest TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fetches_run_url ON fetches (run_id, url, fetched_at);
+CREATE INDEX IF NOT EXISTS fetches_digest ON fetches (digest);
+"""
+
+class PageArchive():
+    """
+    Compressed, content-addressed archive of every page fetched by the crawlers.
+
+    Each body is gzip compressed and stored once under its SHA-256 digest, no matter how often it is fetched.
+    A SQLite index records every fetch with its URL, fetch time and digest, grouped into runs
+    (one run per crawler process). A run can later be replayed through ArchiveStore, so extraction and
+    database loading can be repeated without any network access. Only the most recent runs are kept, the
+    archive does not grow without bounds.
+    """
+    def __init__(self, helper: Helper, path=config.ARCHIVE_PATH, keep_runs=config.ARCHIVE_KEEP_RUNS):
+        """
+        Args:
+            helper (Helper): The logger
+            path (str, optional): The archive directory. Defaults to config.ARCHIVE_PATH.
+            keep_runs (int, optional): Most recent runs kept when a new run starts, None keeps all.
+                Defaults to config.ARCHIVE_KEEP_RUNS.
+        """
+        self.log = helper.log
+        self.path = path
+        self.keep_runs = keep_runs
+        self.run_id = None
+        self.lock = threading.Lock()
+        self.fetch_count = 0
+        self.new_count = 0
+        self.stored_bytes = 0
+        os.makedirs(os.path.join(path, "blobs"), exist_ok=True)
+        # Responses are archived from the worker threads of the crawlers
+        self.connection = sqlite3.connect(os.path.join(path, "index.sqlite"), check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.executescript(CREATE_ARCHIVE_TABLES_QUERY)
+
+    def attach(self, transport):
+        """
+        Archives every successful response of a transport, captcha pages are left out.
+        The first attached transport starts a new run, runs beyond the most recent keep_runs are deleted then.
+
+        Args:
+            transport (Transport or CircuitPool): The transport whose responses are archived.
+        """
+        if self.run_id is None:
+            with self.lock, self.connection:
+                cursor = self.connection.execute("INSERT INTO runs (started) VALUES (?)",
+                                                 (datetime.now().strftime("%Y-%m-%d %H:%M:%S"),))
+                self.run_id = cursor.lastrowid
+            self.log.info("Archiving fetched pages to '{}' as run {}".format(self.path, self.run_id))
+            if self.keep_runs:
+                self.prune(self.keep_runs)
+        for session in get_sessions(transport):
+            session.hooks["response"].append(self.__archive)
+
+    def store(self, url, content, fetched_at=None):
+        """
+        Stores a fetched page of the current run, the body is only written if its digest is new.
+
+        Args:
+            url (str): The requested URL.
+            content (bytes): The body of the response.
+            fetched_at (str, optional): The fetch time. Defaults to now.
+
+        Returns:
+            str: The digest of the body.
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        blob_path = self.__blob_path(digest)
+        fetched_at = fetched_at or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # The fetch is recorded before its body is looked up, within the write lock of the index,
+        # so prune() never deletes a body between the two
+        with self.lock, self.connection:
+            self.connection.execute("INSERT INTO fetches (run_id, url, fetched_at, digest) VALUES (?, ?, ?, ?)",
+                                    (self.run_id, url, fetched_at, digest))
+            exists = os.path.exists(blob_path)
+        written = 0
+        if not exists:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            # Written under a temporary name first, a crash must not leave a truncated blob behind
+            temp_path = "{}.{}.tmp".format(blob_path, threading.get_ident())
+            with gzip.open(temp_path, "wb", compresslevel=6) as blob_file:
+                blob_file.write(content)
+            os.replace(temp_path, blob_path)
+            written = os.path.getsize(blob_path)
+        with self.lock:
+            self.fetch_count += 1
+            self.new_count += int(written > 0)
+            self.stored_bytes += written
+        return digest
+
+    def prune(self, keep_runs):
+        """
+        Deletes all but the most recent runs, and the bodies that no remaining run fetched.
+
+        Args:
+            keep_runs (int): The number of runs kept.
+
+        Returns:
+            int: The number of deleted runs.
+        """
+        with self.lock, self.connection:
+            # Taken right away, no other crawler may record a fetch of a body while it is deleted
+            self.connection.execute("BEGIN IMMEDIATE")
+            run_ids = [row[0] for row in self.connection.execute(
+                "SELECT run_id FROM runs ORDER BY run_id DESC LIMIT -1 OFFSET ?", (keep_runs,))]
+            if not run_ids:
+                return 0
+            marks = ",".join("?" * len(run_ids))
+            digests = [row[0] for row in self.connection.execute(
+                "SELECT DISTINCT digest FROM fetches WHERE run_id IN ({})".format(marks), run_ids)]
+            self.connection.execute("DELETE FROM fetches WHERE run_id IN ({})".format(marks), run_ids)
+            self.connection.execute("DELETE FROM runs WHERE run_id IN ({})".format(marks), run_ids)
+            freed = 0
+            for digest in digests:
+                if self.connection.execute("SELECT 1 FROM fetches WHERE digest = ? LIMIT 1", (digest,)).fetchone():
+                    continue
+                blob_path = self.__blob_path(digest)
+                if os.path.exists(blob_path):
+                    freed += os.path.getsize(blob_path)
+                    os.remove(blob_path)
+        self.log.info("Deleted {} archived runs ({:.1f} KB compressed)".format(len(run_ids), freed / 1024))
+        return len(run_ids)
+
+    def load(self, digest):
+        """
+        Args:
+            digest (str): The digest of an archived body.
+
+        Returns:
+            bytes: The uncompressed body.
+        """
+        with gzip.open(self.__blob_path(digest), "rb") as blob_file:
+            return blob_file.read()
+
+    def get_runs(self):
+        """
+        Returns:
+            list: Tuples of run id, start time and number of fetched pages, oldest run first.
+        """
+        with self.lock:
+            return self.connection.execute(
+                "SELECT runs.run_id, runs.started, COUNT(fetches.url) FROM runs "
+                "LEFT JOIN fetches ON fetches.run_id = runs.run_id GROUP BY runs.run_id ORDER BY runs.run_id"
+            ).fetchall()
+
+    def get_fetches(self, run_id):
+        """
+        Args:
+            run_id (int): The run.
+
+        Returns:
+            dict: URL to (fetch time, digest) of the last fetch of every URL in the run.
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT url, fetched_at, digest FROM fetches WHERE run_id = ? ORDER BY fetched_at", (run_id,)
+            ).fetchall()
+        return {url: (fetched_at, digest) for url, fetched_at, digest in rows}
+
+    def log_stats(self):
+        self.log.info("Archive: {} pages fetched, {} new bodies stored ({:.1f} KB compressed)"
+                      .format(self.fetch_count, self.new_count, self.stored_bytes / 1024))
+
+    def __archive(self, response, *args, **kwargs):
+        if response.status_code == 200 and b'name="captcha"' not in response.content:
+            try:
+                self.store(response.url, response.content)
+            except Exception as err:
+                # Archiving must never break the crawl itself
+                self.log.error("Failed to archive {}".format(response.url))
+                self.log.debug("Error details: ", exc_info=err)
+        return response
+
+    def __blob_path(self, digest):
+        return os.path.join(self.path, "blobs", digest[:2], digest + ".html.gz")
+
+class ArchiveStore():
+    """
+    The pages of one archived run, served to a ReplayAdapter in place of a FixtureStore.
+    """
+    def __init__(self, archive: PageArchive, run_id):
+        """
+        Args:
+            archive (PageArchive): The archive.
+            run_id (int): The run to replay.
+        """
+        self.archive = archive
+        self.fetches = archive.get_fetches(run_id)
+
+    def get(self, url):
+        """
+        Args:
+            url (str): The requested URL.
+
+        Returns:
+            bytes or None: The page as fetched in the run, None if the run did not fetch the URL.
+        """
+        fetch = self.fetches.get(url)
+        return self.archive.load(fetch[1]) if fetch else None
+
+    def get_fetch_time(self, url):
+        """
+        Args:
+            url (str): The requested URL.
+
+        Returns:
+            str or None: When the page was fetched in the run.
+        """
+        fetch = self.fetches.get(url)
+        return fetch[0] if fetch else None
+
+    def urls(self):
+        return list(self.fetches)
@@ -0,0 +1,232 @@
+# Copyright (C) 2023 Martin Pretz, Xian Chen
+
+"""
+Offline benchmark of the crawler stages on recorded pages, no Tor or operator needed.
+
+Record the pages once by running main.py with config.CRAWLER_FIXTURE_PATH set, then replay them, e.g.:
+
+    python benchmark.py ./fixtures --latency 0.5 --captcha-every 40
+
+The 'parse' stage times the parser of every recorded page. The crawl stages ('forums', 'users', 'detailed')
+run the crawlers against a ReplayAdapter and report pages/s, with --db also the rows/s of the database loaders.
+--db writes into config.MYSQL_DATABASE, point it to a scratch database first.
+
+With --trace the stages are profiled, see profiler.py:
+
+    python benchmark.py ./fixtures --stages parse,forums --trace trace.json --cprofile ./cprofile
+"""
+
+import os
+import time
+import logging
+import hashlib
+import argparse
+import tempfile
+from datetime import datetime
+from lxml import html
+import config
+import profiler
+from helper import Helper
+from database import MySQLConnector
+from transport import Transport, CircuitPool
+from rate_limiter import RateLimiter
+from replay import FixtureStore, ReplayAdapter, install
+from forums import Forums, SUBFORUM_ROWS
+from user_crawler import User_Profiles, User_Detailed_Profiles, parse_userlist_page
+from profile_parser import ProfileParser, parse_profile_page
+
+STAGES = ["parse", "forums", "users", "detailed"]
+
+class TimedDatabase():
+    """
+    Wraps a MySQLConnector and measures the rows written by its loaders and the time spent in them.
+    All other attributes are passed through to the connector.
+    """
+    def __init__(self, db: MySQLConnector):
+        self.db = db
+        self.rows = 0
+        self.seconds = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    def load_forums(self, data, finish=True):
+        rows = 0
+        for forum in data:
+            rows += 1 + len(forum.get("posts", []))
+            for subforum in forum.get("subforums", []):
+                rows += 1 + len(subforum.get("posts", []))
+        return self.__timed(lambda data: self.db.load_forums(data, finish), data, rows)
+
+    def bulk_load_user_general(self, user_list):
+        return self.__timed(self.db.bulk_load_user_general, user_list, len(user_list))
+
+    def bulk_load_user_detailed(self, user_list):
+        rows = len(user_list) + sum(len(user["feedback_reviews"] or []) for user in user_list)
+        return self.__timed(self.db.bulk_load_user_detailed, user_list, rows)
+
+    def reset(self):
+        """
+        Returns:
+            tuple: Rows written and seconds spent since the last reset.
+        """
+        measured = (self.rows, self.seconds)
+        self.rows, self.seconds = 0, 0.0
+        return measured
+
+    def __timed(self, loader, data, rows):
+        start = time.perf_counter()
+        result = loader(data)
+        self.seconds += time.perf_counter() - start
+        self.rows += rows
+        return result
+
+class BenchmarkDetailedProfiles(User_Detailed_Profiles):
+    """
+    Detailed crawl that answers injected captchas with a fresh cookie instead of asking the operator.
+    """
+    def solve_captcha(self):
+        # Slows down like the real crawl, so --rate-limit measures the rate after captchas too
+        if self.transport.limiter:
+            self.transport.limiter.backoff("captcha")
+        cookie = self.transport.get_cookie() or ""
+        self.transport.set_cookie(hashlib.sha1(cookie.encode("utf-8")).hexdigest())
+        return True
+
+def benchmark_parsers(helper: Helper, store: FixtureStore, repeat):
+    """
+    Parses every recorded page with the parser of its crawler stage.
+
+    Args:
+        helper (Helper): The logger
+        store (FixtureStore): The recorded pages.
+        repeat (int): Number of times each page is parsed.
+
+    Returns:
+        dict: Number of pages and average parse time in ms per page, by page type.
+    """
+    forums = Forums(config.CRAWLER_BASE_LINK, None, helper, None)
+    profile_parser = ProfileParser(helper)
+    crawling_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    results = {}
+    for url in store.urls():
+        content = store.get(url)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            with profiler.span("parse", url=url, page_type=profiler.page_type(url)):
+                if "profile.php" in url:
+                    page_type = "profile"
+                    profile_parser.parse(parse_profile_page(content))
+                elif "userlist.php" in url:
+                    page_type = "userlist"
+                    parse_userlist_page(content, crawling_date)
+                else:
+                    tree = html.fromstring(content.decode("utf-8", errors="replace"))
+                    if "viewforum.php" not in url:
+                        page_type = "index"
+                        forums.get_forum_info(crawling_date, tree=tree)
+                    elif SUBFORUM_ROWS.rows(tree):
+                        page_type = "subforums"
+                        forums.get_subforum_info(crawling_date, tree=tree)
+                    else:
+                        page_type = "topics"
+                        forums.get_posts_info(crawling_date, tree=tree)
+        pages, seconds = results.get(page_type, (0, 0.0))
+        results[page_type] = (pages + 1, seconds + (time.perf_counter() - start) / repeat)
+    return {page_type: (pages, seconds / pages * 1000) for page_type, (pages, seconds) in results.items()}
+
+def benchmark_crawl(stage, helper: Helper, store: FixtureStore, db: TimedDatabase, latency, captcha_every,
+                    captcha_above=0.0, rate_limit=False):
+    """
+    Runs one crawler stage against the recorded pages.
+
+    Args:
+        stage (str): 'forums', 'users' or 'detailed'
+        helper (Helper): The logger
+        store (FixtureStore): The recorded pages.
+        db (TimedDatabase): The database the crawler loads into, None to skip loading.
+        latency (float): Seconds every response is delayed.
+        captcha_every (int): Profile requests per cookie before captchas are injected, 0 disables them.
+        captcha_above (float, optional): Profile requests per second of a cookie that trigger captchas. Defaults to 0.0.
+        rate_limit (bool, optional): Send all requests through an adaptive RateLimiter. Defaults to False.
+
+    Returns:
+        dict: Requests, injected captchas, seconds, pages/s, rows written and rows/s of the stage.
+    """
+    adapter = ReplayAdapter(store, latency=latency, captcha_every=captcha_every, captcha_above=captcha_above)
+    limiter = RateLimiter(helper) if rate_limit else None
+    start = time.perf_counter()
+    if stage == "forums":
+        transport = Transport(helper, cookie=config.CRAWLER_COOKIE, limiter=limiter)
+        install(transport, adapter)
+        Forums(config.CRAWLER_BASE_LINK, config.CRAWLER_COOKIE, helper, db, transport) \
+            .crawl_forums(auto_push_db=db is not None)
+    else:
+        circuits = CircuitPool(helper, cookie=config.CRAWLER_COOKIE, limiter=limiter)
+        install(circuits, adapter)
+        if stage == "users":
+            User_Profiles(0, helper, db, circuits, parallel=config.CRAWLER_PARALLEL_USERLIST)
+        else:
+            BenchmarkDetailedProfiles(0, helper, db, circuits)
+    seconds = time.perf_counter() - start
+    rows, db_seconds = db.reset() if db else (0, 0.0)
+    return {
+        "requests": adapter.request_count,
+        "captchas": adapter.captcha_count,
+        "seconds": seconds,
+        "pages_per_second": adapter.request_count / seconds if seconds else 0,
+        "rows": rows,
+        "rows_per_second": rows / db_seconds if db_seconds else 0
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the crawler stages on recorded pages.")
+    parser.add_argument("fixtures", help="Directory of the recorded pages (config.CRAWLER_FIXTURE_PATH)")
+    parser.add_argument("--stages", default=",".join(STAGES), help="Comma separated stages out of " + ", ".join(STAGES))
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds every replayed response is delayed")
+    parser.add_argument("--captcha-every", type=int, default=0, help="Profile requests per cookie before a captcha is injected")
+    parser.add_argument("--captcha-above", type=float, default=0.0, help="Profile requests per second of a cookie that trigger captchas")
+    parser.add_argument("--rate-limit", action="store_true", help="Send all requests through the adaptive rate limiter")
+    parser.add_argument("--repeat", type=int, default=5, help="Times each page is parsed in the 'parse' stage")
+    parser.add_argument("--db", action="store_true", help="Load the crawled data into config.MYSQL_DATABASE and measure rows/s")
+    parser.add_argument("--trace", help="Profile the stages and write their spans to this trace file")
+    parser.add_argument("--cprofile", help="With --trace, also write one cProfile dump per span stage to this directory")
+    args = parser.parse_args()
+
+    store = FixtureStore(os.path.abspath(args.fixtures))
+    # Relative to the current directory, not the scratch directory
+    trace_path = os.path.abspath(args.trace) if args.trace else None
+    cprofile_path = os.path.abspath(args.cprofile) if args.cprofile else None
+    # Crawl output, checkpoints and log go to a scratch directory, only the report is printed
+    workdir = tempfile.mkdtemp(prefix="crawler-benchmark-")
+    os.chdir(workdir)
+    config.LOGGING_VERBOSITY = 0
+    helper = Helper(os.path.join(workdir, "benchmark.log"))
+    # Per-row debug messages would dominate the measured parse times
+    helper.log.setLevel(logging.INFO)
+    db = TimedDatabase(MySQLConnector(helper=helper)) if args.db else None
+    print("Replaying {} recorded pages, output in {}".format(len(store.urls()), workdir))
+    if trace_path:
+        profiler.enable(helper, trace_path, cprofile_path)
+
+    for stage in args.stages.split(","):
+        if stage == "parse":
+            for page_type, (pages, ms_per_page) in sorted(benchmark_parsers(helper, store, args.repeat).items()):
+                print("parse    {:<10} {:>6} pages {:>10.2f} ms/page".format(page_type, pages, ms_per_page))
+        elif stage in STAGES:
+            result = benchmark_crawl(stage, helper, store, db, args.latency, args.captcha_every,
+                                     args.captcha_above, args.rate_limit)
+            print("{:<8} {:>6} requests {:>4} captchas {:>8.2f}s {:>8.1f} pages/s {:>8} rows {:>10.0f} rows/s".format(
+                stage, result["requests"], result["captchas"], result["seconds"], result["pages_per_second"],
+                result["rows"], result["rows_per_second"]
+            ))
+        else:
+            print("Unknown stage '{}'".format(stage))
+    if trace_path:
+        for name, (count, seconds) in sorted(profiler.tracer.get_stats().items()):
+            print("profile  {:<10} {:>6} spans {:>10.2f}s".format(name, count, seconds))
+        profiler.disable()
+        print("Trace written to {}".format(trace_path))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+# Copyright (C) 2023 Martin Pretz
+
+"""
+Benchmark of the database loaders, against a MySQL stand-in or config.MYSQL_DATABASE.
+
+The stand-in needs no MySQL server: every statement costs a network round trip plus a cost per row,
+every commit additionally the flush of the redo log. Like MySQL in strict mode it rejects a statement with a
+string longer than its VARCHAR(255) column. It keeps the AUTO_INCREMENT counter of every table,
+and SELECT ... FOR UPDATE locks the end of a table for other connections until the transaction ends,
+like InnoDB's next-key lock. This is enough to compare how many round trips and how much waiting
+the loaders need, e.g.:
+
+    python benchmark_db.py --users 20000 --loaders 2 --round-trip-ms 0.5
+
+With --mysql the loaders write into config.MYSQL_DATABASE instead, point it to a scratch database first.
+"""
+
+import re
+import os
+import time
+import logging
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timedelta
+import config
+from helper import Helper
+from database import MySQLConnector
+from mysql.connector.errors import DataError
+
+# Text columns, all other string columns are VARCHAR(255)
+TEXT_COLUMNS = {"body", "public_key"}
+# The AUTO_INCREMENT key of every table the loaders write
+PRIMARY_KEYS = {"forums": "forum_id", "subforums": "subforum_id", "posts": "post_id", "users_general": "user_id",
+                "users_detailed": "user_id", "users_feedback": "feedback_id", "post_messages": "message_id",
+                "crawl_runs": "run_id", "crawl_metrics": "metric_id"}
+
+class StandInRow(dict):
+    """
+    A result row of the stand-in, every column not set explicitly reads as 1 (e.g. 'found', 'filled', 'run_id').
+    """
+    def __missing__(self, key):
+        return 1
+
+class StandInServer():
+    """
+    The state shared by all connections to the stand-in: AUTO_INCREMENT counters, table locks and the
+    costs of a statement.
+    """
+    def __init__(self, round_trip=0.0005, row_cost=0.00001, commit_cost=0.002):
+        """
+        Args:
+            round_trip (float, optional): Seconds of the network round trip of every statement. Defaults to 0.0005.
+            row_cost (float, optional): Seconds per row written or read. Defaults to 0.00001.
+            commit_cost (float, optional): Seconds a commit takes in addition to its round trip. Defaults to 0.002.
+        """
+        self.round_trip = round_trip
+        self.row_cost = row_cost
+        self.commit_cost = commit_cost
+        self.lock = threading.Lock()
+        self.auto_increment = {}
+        # The committed rows of every table, as dictionaries including their AUTO_INCREMENT key
+        self.tables = {}
+        self.table_locks = {}
+        self.statements = 0
+        self.lock_wait = 0.0
+
+    def connect(self):
+        return StandInConnection(self)
+
+    def get_table_lock(self, table):
+        with self.lock:
+            return self.table_locks.setdefault(table, threading.Lock())
+
+class StandInConnection():
+    """
+    A connection to the StandInServer, offering the parts of a mysql.connector connection the loaders use.
+    """
+    def __init__(self, server: StandInServer):
+        self.server = server
+        self.database = None
+        # Table locks taken by SELECT ... FOR UPDATE in the running transaction
+        self.held = []
+        # Rows inserted by the running transaction, by table
+        self.pending = {}
+
+    def cursor(self, dictionary=False):
+        return StandInCursor(self)
+
+    def commit(self):
+        time.sleep(self.server.round_trip + self.server.commit_cost)
+        with self.server.lock:
+            for table, rows in self.pending.items():
+                self.server.tables.setdefault(table, []).extend(rows)
+        self.__release()
+
+    def rollback(self):
+        time.sleep(self.server.round_trip)
+        self.__release()
+
+    def __release(self):
+        for lock in self.held:
+            lock.release()
+        self.held = []
+        self.pending = {}
+
+class StandInCursor():
+    """
+    A dictionary cursor of a StandInConnection. Understands the statements that decide the cost of the loaders,
+    every other statement only costs its round trip.
+    """
+    NEXT_ID = re.compile(r"MAX\((\w+)\).*FROM (\w+) FOR UPDATE", re.S)
+    INSERT = re.compile(r"INSERT (?:IGNORE )?INTO (\w+) \(([^)]*)\)", re.S)
+
+    def __init__(self, connection: StandInConnection):
+        self.connection = connection
+        self.server = connection.server
+        self.rows = []
+        self.lastrowid = None
+        self.rowcount = 0
+
+    def execute(self, query, params=None):
+        self.__run(query, [params] if params is not None else [])
+
+    def executemany(self, query, rows):
+        self.__run(query, rows)
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def __run(self, query, rows):
+        with self.server.lock:
+            self.server.statements += 1
+        self.rows = []
+        self.rowcount = len(rows)
+        next_id = self.NEXT_ID.search(query)
+        insert = self.INSERT.search(query)
+        if next_id:
+            table = next_id.group(2)
+            self.__lock(table, hold=True)
+            with self.server.lock:
+                self.rows = [StandInRow(next_id=self.server.auto_increment.get(table, 0) + 1)]
+        elif insert and rows:
+            table = insert.group(1)
+            columns = [column.strip() for column in insert.group(2).split(",")]
+            key = PRIMARY_KEYS.get(table)
+            for row in rows:
+                for column, value in zip(columns, row):
+                    if isinstance(value, str) and len(value) > 255 and column not in TEXT_COLUMNS:
+                        raise DataError("1406 (22001): Data too long for column '{}'".format(column))
+            # Inserts wait for the lock on the end of the table, if another transaction holds it
+            self.__lock(table, hold=False)
+            with self.server.lock:
+                counter = self.server.auto_increment.get(table, 0)
+                if key is None:
+                    # No AUTO_INCREMENT key, e.g. topic_progress
+                    inserted = [dict(zip(columns, row)) for row in rows]
+                elif key in columns:
+                    position = columns.index(key)
+                    self.server.auto_increment[table] = max([counter] + [row[position] for row in rows])
+                    self.lastrowid = rows[0][position]
+                    inserted = [dict(zip(columns, row)) for row in rows]
+                else:
+                    self.server.auto_increment[table] = counter + len(rows)
+                    self.lastrowid = counter + 1
+                    inserted = [dict(zip(columns, row), **{key: counter + 1 + idx}) for idx, row in enumerate(rows)]
+            self.connection.pending.setdefault(table, []).extend(inserted)
+        elif query.lstrip().upper().startswith("SELECT") and "INFORMATION_SCHEMA.STATISTICS" not in query:
+            self.rows = [StandInRow(SCHEMA_NAME=config.MYSQL_DATABASE)]
+        time.sleep(self.server.round_trip + len(rows) * self.server.row_cost)
+
+    def __lock(self, table, hold):
+        lock = self.server.get_table_lock(table)
+        if lock in self.connection.held:
+            return
+        start = time.perf_counter()
+        lock.acquire()
+        with self.server.lock:
+            self.server.lock_wait += time.perf_counter() - start
+        if hold:
+            self.connection.held.append(lock)
+        else:
+            lock.release()
+
+def make_forum_data(forums, subforums, posts, crawling_date):
+    """
+    Returns:
+        list: Forum dictionaries like Forums.crawl_forums() returns them, every forum with the given number of
+        subforums and every subforum with the given number of posts.
+    """
+    def element(element_type, name):
+        return {"element_type": element_type, "crawling_date": crawling_date, "title": name, "link": "http://germania.test/" + name,
+                "topics_count": posts, "posts_count": posts * 10, "last_post_time": crawling_date[:10], "last_post_author": "author"}
+    def post(name):
+        return {"element_type": "post", "crawling_date": crawling_date, "title": name, "link": "http://germania.test/" + name,
+                "author": "author", "replies_count": 10, "views_count": 100, "last_post_time": crawling_date[:10],
+                "last_post_author": "author"}
+    data = []
+    for forum_idx in range(forums):
+        forum = element("forum", f"forum{forum_idx}")
+        forum["subforums"] = []
+        for subforum_idx in range(subforums):
+            subforum = element("subforum", f"subforum{forum_idx}_{subforum_idx}")
+            subforum["posts"] = [post(f"topic{forum_idx}_{subforum_idx}_{idx}") for idx in range(posts)]
+            forum["subforums"].append(subforum)
+        data.append(forum)
+    return data
+
+def make_detailed_users(users, feedback, crawling_date):
+    """
+    Returns:
+        list: Detailed user dictionaries like User_Detailed_Profiles crawls them, each with the given number of reviews.
+    """
+    return [{
+        "name": f"user{idx}", "crawled_datetime": crawling_date, "title": "Member", "link": f"http://germania.test/profile.php?id={idx}",
+        "number_of_posts": idx % 100, "points": idx % 50, "registration_date": "2022-01-01", "badge": None,
+        "trade_activity": {"Handelspunkte": 10, "Positive Feedbacks": feedback, "Neutrale Feedbacks": 0, "Negative Feedbacks": 0},
+        "feedback_statistic": {"Produktverpackung": "4.5", "Kontakt & Lieferung": "4.8", "Produkt/Dienstleistung": "5"},
+        "feedback_reviews": [{"date": "2023-09-01", "mark": "Positiv, gut", "comment": f"great stuff {review}",
+                              "author": f"buyer{review}"} for review in range(feedback)],
+        "fingerprint": f"FP{idx}", "public_key": "-----BEGIN PGP PUBLIC KEY BLOCK-----"
+    } for idx in range(users)]
+
+def run_loaders(connectors, load):
+    """
+    Runs a loader in several threads at the same time, each with its own connection.
+
+    Args:
+        connectors (list): One MySQLConnector per loader.
+        load (callable): Called with the MySQLConnector and the number of the loader, returns the rows it wrote.
+
+    Returns:
+        tuple: Rows written and seconds until all loaders finished.
+    """
+    rows = [0] * len(connectors)
+    def run(idx):
+        rows[idx] = load(connectors[idx], idx)
+    threads = [threading.Thread(target=run, args=(idx,)) for idx in range(len(connectors))]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(rows), time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the database loaders against a MySQL stand-in.")
+    parser.add_argument("--users", type=int, default=10000, help="Detailed users written by every loader")
+    parser.add_argument("--feedback", type=int, default=5, help="Feedback entries per detailed user")
+    parser.add_argument("--forums", type=int, default=20, help="Forums of every forum crawl")
+    parser.add_argument("--subforums", type=int, default=5, help="Subforums per forum")
+    parser.add_argument("--posts", type=int, default=200, help="Posts per subforum")
+    parser.add_argument("--loaders", type=int, default=1, help="Loaders writing into the same tables at the same time")
+    parser.add_argument("--round-trip-ms", type=float, default=0.5, help="Round trip of a statement to the stand-in")
+    parser.add_argument("--row-us", type=float, default=10.0, help="Cost of a written row in the stand-in")
+    parser.add_argument("--commit-ms", type=float, default=2.0, help="Cost of a commit in the stand-in")
+    parser.add_argument("--mysql", action="store_true", help="Write into config.MYSQL_DATABASE instead of the stand-in")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="crawler-benchmark-db-")
+    config.LOGGING_VERBOSITY = 0
+    helper = Helper(os.path.join(workdir, "benchmark.log"))
+    helper.log.setLevel(logging.INFO)
+    server = StandInServer(args.round_trip_ms / 1000, args.row_us / 1e6, args.commit_ms / 1000)
+    connectors = [MySQLConnector(helper, None if args.mysql else server.connect()) for _ in range(args.loaders)]
+    start_date = datetime.now().replace(microsecond=0)
+    # Every loader writes its own crawl, with its own crawling date
+    def crawling_date(stage, idx):
+        return (start_date + timedelta(seconds=stage * args.loaders + idx)).strftime("%Y-%m-%d %H:%M:%S")
+
+    forum_data = [make_forum_data(args.forums, args.subforums, args.posts, crawling_date(0, idx)) for idx in range(args.loaders)]
+    users = [make_detailed_users(args.users, args.feedback, crawling_date(1, idx)) for idx in range(args.loaders)]
+    def load_forums(db, idx):
+        db.load_forums(forum_data[idx])
+        return sum(1 + len(subforum["posts"]) for forum in forum_data[idx] for subforum in forum["subforums"]) + len(forum_data[idx])
+    def load_users(db, idx):
+        db.bulk_load_user_detailed(users[idx])
+        return sum(1 + len(user["feedback_reviews"]) for user in users[idx])
+
+    print("{} loaders, {}".format(args.loaders, "config.MYSQL_DATABASE" if args.mysql else
+          "stand-in with {} ms round trip, {} us per row, {} ms per commit".format(args.round_trip_ms, args.row_us, args.commit_ms)))
+    for name, load in (("forums", load_forums), ("detailed", load_users)):
+        statements, lock_wait = server.statements, server.lock_wait
+        rows, seconds = run_loaders(connectors, load)
+        line = "{:<8} {:>8} rows {:>8.2f}s {:>10.0f} rows/s".format(name, rows, seconds, rows / seconds if seconds else 0)
+        if not args.mysql:
+            line += " {:>6} statements {:>8.2f}s waiting for locks".format(server.statements - statements, server.lock_wait - lock_wait)
+        print(line)
+
+if __name__ == "__main__":
+    main()
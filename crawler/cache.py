@@ -0,0 +1,255 @@
+# Copyright (C) 2023 Martin Pretz
+
+import os
+import gzip
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from datetime import date
+from requests.models import PreparedRequest
+import config
+from helper import Helper
+
+CREATE_CACHE_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS entries (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    digest TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    parsed TEXT,
+    parsed_on TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+"""
+
+def normalize_url(url):
+    """
+    Args:
+        url (str): A URL as passed to the session.
+
+    Returns:
+        str: The URL as sent by requests, e.g. with the trailing slash of a bare host.
+    """
+    request = PreparedRequest()
+    request.prepare_url(url, None)
+    return request.url
+
+class ResponseCache():
+    """
+    On-disk HTTP cache underneath the crawler sessions.
+
+    For every URL the cache keeps the ETag and Last-Modified validators and the SHA-256 digest of the last body,
+    the gzip compressed body itself is stored once per digest. Requests carry If-None-Match/If-Modified-Since
+    where validators are known, a 304 answer is completed with the cached body. Servers without validators are
+    covered by the digest: a body equal to the last fetch is flagged as unchanged, so crawlers can reuse the
+    records parsed from it (see get_parsed). Least recently used entries are evicted once the cached bodies
+    exceed the size limit.
+    """
+    def __init__(self, helper: Helper, path=config.CACHE_PATH, max_bytes=config.CACHE_MAX_BYTES):
+        """
+        Args:
+            helper (Helper): The logger
+            path (str, optional): The cache directory. Defaults to config.CACHE_PATH.
+            max_bytes (int, optional): Size limit of the compressed bodies on disk. Defaults to config.CACHE_MAX_BYTES.
+        """
+        self.log = helper.log
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.stats = {"revalidated": 0, "unchanged": 0, "changed": 0, "parses_skipped": 0, "evicted": 0}
+        os.makedirs(os.path.join(path, "bodies"), exist_ok=True)
+        # Responses are processed in the worker threads of the crawlers
+        self.connection = sqlite3.connect(os.path.join(path, "index.sqlite"), check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.executescript(CREATE_CACHE_TABLE_QUERY)
+            self.total_size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def get_validators(self, link):
+        """
+        Args:
+            link (str): The URL about to be requested.
+
+        Returns:
+            dict: The conditional request headers for the URL, empty if nothing usable is cached.
+        """
+        with self.lock:
+            entry = self.connection.execute("SELECT etag, last_modified, digest FROM entries WHERE url = ?",
+                                            (normalize_url(link),)).fetchone()
+        if not entry or not os.path.exists(self.__body_path(entry[2])):
+            return {}
+        headers = {}
+        if entry[0]:
+            headers["If-None-Match"] = entry[0]
+        if entry[1]:
+            headers["If-Modified-Since"] = entry[1]
+        return headers
+
+    def revalidate(self, response, *args, **kwargs):
+        """
+        Response hook of the sessions: completes 304 answers with the cached body and updates the cache.
+        Sets response.from_cache and response.unchanged for the crawlers.
+
+        Args:
+            response (requests.Response): The response as received.
+
+        Returns:
+            requests.Response: The response, with the cached body if the server answered 304.
+        """
+        response.from_cache = False
+        response.unchanged = False
+        url = response.request.url
+        if response.status_code == 304:
+            # Reading the (empty) body releases the connection back to the pool before the body is replaced
+            response.content
+            with self.lock:
+                entry = self.connection.execute("SELECT digest FROM entries WHERE url = ?", (url,)).fetchone()
+            body = self.__load(entry[0]) if entry else None
+            if body is not None:
+                response._content = body
+                response.status_code = 200
+                response.from_cache = True
+                response.unchanged = True
+                self.__touch(url)
+                self.__count("revalidated")
+            return response
+        if response.status_code != 200 or b'name="captcha"' in response.content:
+            return response
+        digest = hashlib.sha256(response.content).hexdigest()
+        response.unchanged = self.__store(url, response, digest)
+        self.__count("unchanged" if response.unchanged else "changed")
+        return response
+
+    def get_parsed(self, link, response):
+        """
+        Returns the records parsed from the same body earlier today.
+        Relative dates like 'Heute' are resolved while parsing, therefore records of other days are not reused.
+
+        Args:
+            link (str): The requested URL.
+            response (requests.Response): The response of the request.
+
+        Returns:
+            The value passed to set_parsed() for this body, None if the body has to be parsed.
+        """
+        if not getattr(response, "unchanged", False):
+            return None
+        with self.lock:
+            entry = self.connection.execute("SELECT parsed, parsed_on FROM entries WHERE url = ?",
+                                            (normalize_url(link),)).fetchone()
+        if not entry or not entry[0] or entry[1] != date.today().isoformat():
+            return None
+        self.__count("parses_skipped")
+        return json.loads(entry[0])
+
+    def set_parsed(self, link, response, value):
+        """
+        Remembers the records parsed from a body.
+
+        Args:
+            link (str): The requested URL.
+            response (requests.Response): The response the records were parsed from.
+            value: The JSON serializable records.
+        """
+        digest = hashlib.sha256(response.content).hexdigest()
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE entries SET parsed = ?, parsed_on = ? WHERE url = ? AND digest = ?",
+                                    (json.dumps(value), date.today().isoformat(), normalize_url(link), digest))
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: The counters of this cache since it was opened.
+        """
+        with self.lock:
+            return dict(self.stats)
+
+    def log_stats(self):
+        stats = self.get_stats()
+        hits = stats["revalidated"] + stats["unchanged"]
+        total = hits + stats["changed"]
+        self.log.info("Cache: {} revalidated (304), {} unchanged, {} new or changed bodies, {:.0%} hit ratio, "
+                      "{} parses skipped, {} entries evicted"
+                      .format(stats["revalidated"], stats["unchanged"], stats["changed"], hits / total if total else 0,
+                              stats["parses_skipped"], stats["evicted"]))
+
+    def __store(self, url, response, digest):
+        """
+        Stores the validators and body of a response.
+
+        Returns:
+            bool: True if the body equals the one cached for the URL.
+        """
+        body_path = self.__body_path(digest)
+        if not os.path.exists(body_path):
+            os.makedirs(os.path.dirname(body_path), exist_ok=True)
+            temp_path = "{}.{}.tmp".format(body_path, threading.get_ident())
+            with gzip.open(temp_path, "wb", compresslevel=6) as body_file:
+                body_file.write(response.content)
+            os.replace(temp_path, body_path)
+        size = os.path.getsize(body_path)
+        with self.lock, self.connection:
+            entry = self.connection.execute("SELECT digest, size, parsed, parsed_on FROM entries WHERE url = ?",
+                                            (url,)).fetchone()
+            unchanged = bool(entry) and entry[0] == digest
+            # Records parsed from an unchanged body stay valid
+            parsed, parsed_on = (entry[2], entry[3]) if unchanged else (None, None)
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries (url, etag, last_modified, digest, size, last_used, parsed, parsed_on) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, response.headers.get("ETag"), response.headers.get("Last-Modified"), digest, size, time.time(),
+                 parsed, parsed_on)
+            )
+            self.total_size += size - (entry[1] if entry else 0)
+            if entry and not unchanged:
+                self.__delete_unused_body(entry[0])
+            if self.total_size > self.max_bytes:
+                self.__evict()
+        return unchanged
+
+    def __evict(self):
+        """
+        Deletes the least recently used entries until the bodies take up at most 90% of the size limit.
+        Must be called holding the lock, within a transaction.
+        """
+        target = self.max_bytes * 0.9
+        for url, digest, size in self.connection.execute(
+            "SELECT url, digest, size FROM entries ORDER BY last_used"
+        ).fetchall():
+            if self.total_size <= target:
+                break
+            self.connection.execute("DELETE FROM entries WHERE url = ?", (url,))
+            self.__delete_unused_body(digest)
+            self.total_size -= size
+            self.stats["evicted"] += 1
+        self.log.debug("Cache evicted down to {} bytes".format(self.total_size))
+
+    def __delete_unused_body(self, digest):
+        # Bodies are shared by all URLs with the same content
+        if not self.connection.execute("SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (digest,)).fetchone():
+            try:
+                os.remove(self.__body_path(digest))
+            except FileNotFoundError:
+                pass
+
+    def __touch(self, url):
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE entries SET last_used = ? WHERE url = ?", (time.time(), url))
+
+    def __count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def __load(self, digest):
+        try:
+            with gzip.open(self.__body_path(digest), "rb") as body_file:
+                return body_file.read()
+        except FileNotFoundError:
+            # Evicted meanwhile, the 304 is passed on as a failed request
+            return None
+
+    def __body_path(self, digest):
+        return os.path.join(self.path, "bodies", digest[:2], digest + ".gz")
@@ -0,0 +1,62 @@
+# Copyright (C) 2023 Xian Chen
+
+import threading
+
+class CaptchaGate():
+    """
+    Gate shared by all workers of a crawl, keeping the interactive captcha handling in one place.
+
+    Every worker passes the gate before sending a request. When a worker detects a captcha, the gate
+    closes, the operator is prompted exactly once, and all workers resume with the new cookie afterwards.
+    Workers that ran into the same captcha meanwhile do not prompt again, they simply retry.
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.is_open = True
+        # Increased with every handled captcha, identifies the cookie a request was sent with
+        self.generation = 0
+        # Set once the operator asked to stop crawling
+        self.stopped = False
+
+    def wait(self):
+        """
+        Blocks while a captcha is being solved.
+
+        Returns:
+            int: The current generation, to be handed to solve() if the following request hits a captcha.
+        """
+        with self.condition:
+            while not self.is_open:
+                self.condition.wait()
+            return self.generation
+
+    def solve(self, generation, prompt):
+        """
+        Handles a captcha detected on a request sent in the given generation.
+
+        The first worker to report a captcha of the current generation closes the gate and runs the prompt,
+        all other workers wait for it to finish. A captcha of an older generation was already handled.
+
+        Args:
+            generation (int): The generation returned by wait() before the request was sent.
+            prompt (callable): Asks the operator for a new cookie, returns False if crawling should stop.
+
+        Returns:
+            bool: True if the request should be retried, False if crawling should stop.
+        """
+        with self.condition:
+            if generation != self.generation or not self.is_open:
+                while not self.is_open:
+                    self.condition.wait()
+                return not self.stopped
+            self.is_open = False
+        keep_going = False
+        try:
+            keep_going = prompt()
+        finally:
+            with self.condition:
+                self.generation += 1
+                self.stopped = self.stopped or not keep_going
+                self.is_open = True
+                self.condition.notify_all()
+        return keep_going
@@ -8,16 +8,164 @@ MYSQL_USER = "user"
 MYSQL_PASSWORD = "User1234"
 MYSQL_ROOT_PASSWORD = "User1234"
 MYSQL_HOST = "127.0.0.1"
+# Maximum number of rows sent in one multi-row INSERT statement. Forums, subforums and detailed users are only
+# inserted this way under innodb_autoinc_lock_mode 0 or 1, otherwise one by one, since their IDs are needed
+MYSQL_BATCH_SIZE = 1000
+# Number of users written per transaction by the bulk user loaders
+MYSQL_COMMIT_BATCH_SIZE = 250
 
 CRAWLER_USERLIST_LINKS = ["http://germania7zs27fu3gi76wlr5rd64cc2yjexyzvrbm4jufk7pibrpizad.onion/userlist.php?show_group=-1&sort_by=karma&sort_dir=DESC&username=-"] + [f"http://germania7zs27fu3gi76wlr5rd64cc2yjexyzvrbm4jufk7pibrpizad.onion/userlist.php?show_group=-1&sort_by=karma&sort_dir=DESC&username=-&p={i}" for i in range(2,26)]
 CRAWLER_BASE_LINK = "http://germania7zs27fu3gi76wlr5rd64cc2yjexyzvrbm4jufk7pibrpizad.onion"
 CRAWLER_COOKIE = "5rccd78prsqqgn8p0ufngob5g7mpiop330ka3op3u9dke8qj"
+# Maximum number of requests kept in flight at the same time
+CRAWLER_MAX_WORKERS = 8
+# Only re-fetch forums and subforums whose statistics changed since the latest stored crawl
+CRAWLER_INCREMENTAL = False
+# Fetch all known userlist pages at once in the general user crawl
+CRAWLER_PARALLEL_USERLIST = True
+# Number of processes parsing userlist pages in the parallel general user crawl
+CRAWLER_PARSE_WORKERS = 4
+# Run the forum crawl and the general user crawl at the same time, each with its own sessions and database connection.
+# The interactive detailed user crawl always runs after the forum crawl
+CRAWLER_CONCURRENT_STAGES = True
+# Seconds between two progress reports of the concurrently running crawls
+CRAWLER_PROGRESS_INTERVAL = 30
+# Follow the pagination of forum and subforum topic lists
+CRAWLER_TOPIC_PAGINATION = True
+# Pages of a single topic list fetched concurrently per round
+CRAWLER_TOPIC_PAGE_WINDOW = 4
+# Crawl the messages of the topics into the post_messages table after the forum crawl of main.py (see topics.py),
+# the daemon runs them as the 'topics' job
+CRAWLER_TOPIC_MESSAGES = True
+# Topics crawled at the same time, the pages of one topic are fetched one after another
+CRAWLER_TOPIC_WORKERS = CRAWLER_MAX_WORKERS
+# Messages per topic page, decides the page an incremental topic crawl continues on
+CRAWLER_TOPIC_MESSAGES_PER_PAGE = 25
+# Tor SOCKS proxy all crawler traffic is routed through
+CRAWLER_PROXY = "socks5h://127.0.0.1:9050"
+# Number of per-host connection pools kept alive by the shared transport
+CRAWLER_POOL_SIZE = 10
+# Maximum number of open (keep-alive) connections per host
+CRAWLER_CONNECTIONS_PER_HOST = CRAWLER_MAX_WORKERS
+# SOCKS endpoints the user crawlers spread their requests over, one circuit each
+CRAWLER_PROXY_LIST = [CRAWLER_PROXY]
+# Circuits forced per endpoint through Tor's SOCKS username isolation (1 disables isolation)
+CRAWLER_CIRCUITS_PER_PROXY = 1
 
-MYSQL_TABLE_NAME_LIST = ["posts", "subforums", "forums", "users_feedback", "users_general", "users_detailed"]
+# Seconds to wait for a connection through Tor and for the response of the onion service
+CRAWLER_CONNECT_TIMEOUT = 30
+CRAWLER_READ_TIMEOUT = 60
+# Retries of a request failing with a timeout, connection error or 5xx status (0 disables retrying)
+CRAWLER_RETRIES = 3
+# Upper bounds in seconds of the first and of any jittered exponential backoff between attempts
+CRAWLER_RETRY_BASE_DELAY = 1.0
+CRAWLER_RETRY_MAX_DELAY = 30.0
+# Retries a single URL may use over the whole crawl, including the final dead-letter pass
+CRAWLER_RETRY_BUDGET = 6
+# Adapt the request rate of all crawlers to captchas, errors and latency
+CRAWLER_RATE_LIMIT = True
+# Requests per second at the start of a crawl
+CRAWLER_RATE_INITIAL = 2.0
+# Lowest and highest requests per second the rate adapts within
+CRAWLER_RATE_MIN = 0.2
+CRAWLER_RATE_MAX = 20.0
+# Requests that may be sent at once after an idle phase
+CRAWLER_RATE_BURST = CRAWLER_MAX_WORKERS
+# Requests per second added after every window of clean responses
+CRAWLER_RATE_STEP = 0.25
+# Clean responses in a row before the rate is increased
+CRAWLER_RATE_WINDOW = 20
+
+# Records per micro-batch written by the streaming pipeline of the user and topic crawlers
+PIPELINE_BATCH_SIZE = 50
+# Records buffered in the pipeline before the crawler blocks
+PIPELINE_QUEUE_SIZE = 1000
+# Seconds after which an incomplete micro-batch is written anyway
+PIPELINE_FLUSH_INTERVAL = 5.0
+
+# SQLite file holding the resumable state of the detailed user crawl
+CRAWL_STATE_PATH = "./data/crawl_state.sqlite"
+# Directory every fetched page is recorded to for offline replay (see benchmark.py), None disables recording
+CRAWLER_FIXTURE_PATH = None
+# Archive every fetched page, so extraction can be repeated offline (see reparse.py)
+CRAWLER_ARCHIVE = True
+# Directory of the compressed, content-addressed page archive
+ARCHIVE_PATH = "./data/archive"
+# Number of most recent runs kept in the archive, older runs and the bodies only they fetched are deleted
+# whenever a new run starts. None keeps every run
+ARCHIVE_KEEP_RUNS = 10
+# Send conditional requests and skip parsing of unchanged pages through an on-disk HTTP cache
+CRAWLER_CACHE = True
+# Directory of the HTTP cache
+CACHE_PATH = "./data/cache"
+# Size limit of the cached bodies on disk, least recently used entries are evicted beyond it
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+# Profiling mode: trace file of the fetch, parse, normalise, insert and commit spans (Chrome trace format, opens in
+# Perfetto or speedscope), None disables profiling
+PROFILE_TRACE_PATH = None
+# Directory of one cProfile dump per stage ('<stage>.prof', read with pstats or snakeviz) while profiling, None disables cProfile
+PROFILE_CPROFILE_PATH = None
+# Daemon mode (daemon.py): file and environment variable the PHPSESSID cookie is read from, the variable wins
+DAEMON_COOKIE_FILE = "./data/cookie.txt"
+DAEMON_COOKIE_ENV = "GERMANIA_COOKIE"
+# Seconds between the starts of two runs of each crawl job, 0 disables the job
+DAEMON_INTERVALS = {"forums": 6 * 60 * 60, "topics": 24 * 60 * 60, "users_general": 24 * 60 * 60, "users_detailed": 0}
+# Seconds a detailed crawl waits for a new cookie after a captcha, it stops and is resumed at its next run afterwards
+DAEMON_CAPTCHA_TIMEOUT = 15 * 60
+# Directory of the lock files that keep runs of the same job from overlapping, also across processes
+DAEMON_LOCK_PATH = "./data/locks"
+
+MYSQL_TABLE_NAME_LIST = ["topic_progress", "post_messages", "posts", "subforums", "forums", "users_feedback", "users_general", "users_detailed",
+                         "posts_latest", "subforums_latest", "forums_latest", "users_general_latest", "crawl_metrics",
+                         "crawl_runs"]
+
+# Indexes of the time series queries (one title or name over time) and of the queries on one crawl run,
+# created by init_tables on new and existing tables
+MYSQL_INDEXES = {
+    "forums": {"forums_run_title": "run_id, title", "forums_title_date": "title, crawling_date"},
+    "subforums": {"subforums_run_title": "run_id, title", "subforums_title_date": "title, crawling_date"},
+    "posts": {"posts_run_title": "run_id, title", "posts_title_date": "title, crawling_date"},
+    "users_general": {"users_general_run_title": "run_id, title", "users_general_title_date": "title, crawled_datetime",
+                      "users_general_name_date": "name, crawled_datetime"},
+    "users_detailed": {"users_detailed_run_name": "run_id, name", "users_detailed_name_date": "name, crawling_date"},
+    "users_feedback": {"users_feedback_run": "run_id"},
+    "post_messages": {"post_messages_author_date": "author, posted_at"}
+}
+
+CREATE_CRAWL_RUNS_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS crawl_runs (
+    run_id INT AUTO_INCREMENT PRIMARY KEY,
+    crawler VARCHAR(32) NOT NULL,
+    crawling_date DATETIME NOT NULL,
+    finished_at DATETIME,
+    UNIQUE KEY crawl_runs_crawler_date (crawler, crawling_date)
+)
+"""
+
+# One row per stage (crawl, fetch, parse, db) and crawler process of a crawl run, see metrics.py
+CREATE_CRAWL_METRICS_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS crawl_metrics (
+    metric_id INT AUTO_INCREMENT PRIMARY KEY,
+    run_id INT NOT NULL,
+    recorded_at DATETIME NOT NULL,
+    stage VARCHAR(16) NOT NULL,
+    operations INT NOT NULL,
+    errors INT NOT NULL,
+    captchas INT NOT NULL,
+    bytes BIGINT NOT NULL,
+    seconds DOUBLE NOT NULL,
+    avg_ms DOUBLE,
+    p95_ms DOUBLE,
+    max_ms DOUBLE,
+    INDEX crawl_metrics_run_stage (run_id, stage),
+    FOREIGN KEY (run_id) REFERENCES crawl_runs(run_id)
+)
+"""
 
 CREATE_FORUMS_TABLE_QUERY = """
 CREATE TABLE IF NOT EXISTS forums (
     forum_id INT AUTO_INCREMENT PRIMARY KEY,
+    run_id INT,
     element_type VARCHAR(255) NOT NULL,
     crawling_date DATETIME NOT NULL,
     title VARCHAR(255) NOT NULL,
@@ -25,13 +173,15 @@ CREATE TABLE IF NOT EXISTS forums (
     topics_count INT NOT NULL,
     posts_count INT NOT NULL,
     last_post_time DATE NOT NULL,
-    last_post_author VARCHAR(255) NOT NULL
+    last_post_author VARCHAR(255) NOT NULL,
+    FOREIGN KEY (run_id) REFERENCES crawl_runs(run_id)
 )
 """
 
 CREATE_SUBFORUMS_TABLE_QUERY = """
 CREATE TABLE IF NOT EXISTS subforums (
     subforum_id INT AUTO_INCREMENT PRIMARY KEY,
+    run_id INT,
     forum_id INT,
     element_type VARCHAR(255) NOT NULL,
     crawling_date DATETIME NOT NULL,
@@ -41,13 +191,15 @@ CREATE TABLE IF NOT EXISTS subforums (
     posts_count INT NOT NULL,
     last_post_time DATE NOT NULL,
     last_post_author VARCHAR(255) NOT NULL,
-    FOREIGN KEY (forum_id) REFERENCES forums(forum_id)
+    FOREIGN KEY (forum_id) REFERENCES forums(forum_id),
+    FOREIGN KEY (run_id) REFERENCES crawl_runs(run_id)
 )
 """
 
 CREATE_POSTS_TABLE_QUERY = """
 CREATE TABLE IF NOT EXISTS posts (
     post_id INT AUTO_INCREMENT PRIMARY KEY,
+    run_id INT,
     forum_id INT,
     subforum_id INT,
     element_type VARCHAR(255) NOT NULL,
@@ -60,13 +212,40 @@ CREATE TABLE IF NOT EXISTS posts (
     last_post_time DATE NOT NULL,
     last_post_author VARCHAR(255) NOT NULL,
     FOREIGN KEY (forum_id) REFERENCES forums(forum_id),
-    FOREIGN KEY (subforum_id) REFERENCES subforums(subforum_id)
+    FOREIGN KEY (subforum_id) REFERENCES subforums(subforum_id),
+    FOREIGN KEY (run_id) REFERENCES crawl_runs(run_id)
+)
+"""
+
+# Every message of a topic, stored once. The run_id is the crawl run that first stored the message.
+CREATE_POST_MESSAGES_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS post_messages (
+    message_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    run_id INT,
+    topic_link VARCHAR(255) NOT NULL,
+    position INT NOT NULL,
+    post_link VARCHAR(255),
+    author VARCHAR(255) NOT NULL,
+    posted_at DATETIME,
+    body MEDIUMTEXT NOT NULL,
+    crawling_date DATETIME NOT NULL,
+    UNIQUE KEY post_messages_topic_position (topic_link, position),
+    FOREIGN KEY (run_id) REFERENCES crawl_runs(run_id)
+)
+"""
+
+# The messages of every topic up to which all pages are stored, the topic crawl continues after them
+CREATE_TOPIC_PROGRESS_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS topic_progress (
+    topic_link VARCHAR(255) PRIMARY KEY,
+    messages INT NOT NULL
 )
 """
 
 CREATE_USERS_DETAILED_TABLE_QUERY = """
 CREATE TABLE IF NOT EXISTS users_detailed (
     user_id INT AUTO_INCREMENT PRIMARY KEY,
+    run_id INT,
     name VARCHAR(255) NOT NULL,
     crawling_date DATETIME NOT NULL,
     title VARCHAR(255) NOT NULL,
@@ -82,65 +261,84 @@ CREATE TABLE IF NOT EXISTS users_detailed (
     feedback_statistic_kontakt_lieferung VARCHAR(255),
     feedback_statistic_produkt_dienstleistung VARCHAR(255),
     fingerprint VARCHAR(255),
-    public_key TEXT
+    public_key TEXT,
+    FOREIGN KEY (run_id) REFERENCES crawl_runs(run_id)
 )
 """
 
 CREATE_USERS_GENERAL_TABLE_QUERY = """
 CREATE TABLE IF NOT EXISTS users_general (
     user_id INT AUTO_INCREMENT PRIMARY KEY,
+    run_id INT,
     name VARCHAR(255) NOT NULL,
     title VARCHAR(255),
     link VARCHAR(255),
     number_of_posts INT,
     points INT,
     registration_date DATE,
-    crawled_datetime DATETIME
+    crawled_datetime DATETIME,
+    FOREIGN KEY (run_id) REFERENCES crawl_runs(run_id)
 )
 """
 
 CREATE_FEEDBACK_REVIEW_TABLE = """
 CREATE TABLE IF NOT EXISTS users_feedback (
     feedback_id INT AUTO_INCREMENT PRIMARY KEY,
+    run_id INT,
     user_id INT NOT NULL,
     crawling_date DATETIME NOT NULL,
     date VARCHAR(255) NOT NULL,
     mark VARCHAR(255) NOT NULL,
     comment VARCHAR(255) NOT NULL,
     author VARCHAR(255) NOT NULL,
-    FOREIGN KEY (user_id) REFERENCES users_detailed(user_id)
+    FOREIGN KEY (user_id) REFERENCES users_detailed(user_id),
+    FOREIGN KEY (run_id) REFERENCES crawl_runs(run_id)
 )
 """
 
 INSERT_FORUMS_QUERY = """
-    INSERT INTO forums (element_type, crawling_date, title, link, topics_count, posts_count, last_post_time, last_post_author)
-    VALUES (%s, %s, %s, %s, %s, %s, %s, %s);
+    INSERT INTO forums (run_id, element_type, crawling_date, title, link, topics_count, posts_count, last_post_time, last_post_author)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s);
     """
 INSERT_SUBFORUMS_QUERY = """
-    INSERT INTO subforums (element_type, crawling_date, title, link, topics_count, posts_count, last_post_time, last_post_author, forum_id)
-    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s);
+    INSERT INTO subforums (run_id, element_type, crawling_date, title, link, topics_count, posts_count, last_post_time, last_post_author, forum_id)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
     """
 INSERT_POSTS_WITH_SUBFORUM_QUERY = """
-    INSERT INTO posts (element_type, crawling_date, title, link, author, replies_count, views_count, last_post_time, last_post_author, subforum_id)
-    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
+    INSERT INTO posts (run_id, element_type, crawling_date, title, link, author, replies_count, views_count, last_post_time, last_post_author, subforum_id)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
     """
 INSERT_POSTS_WITH_FORUM_QUERY = """
-    INSERT INTO posts (element_type, crawling_date, title, link, author, replies_count, views_count, last_post_time, last_post_author, forum_id)
-    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
+    INSERT INTO posts (run_id, element_type, crawling_date, title, link, author, replies_count, views_count, last_post_time, last_post_author, forum_id)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
     """
 INSERT_USER_FEEDBACK_QUERY = """
-    INSERT INTO users_feedback (user_id, crawling_date, date, mark, comment, author)
-    VALUES (%s, %s, %s, %s, %s, %s);
+    INSERT INTO users_feedback (run_id, user_id, crawling_date, date, mark, comment, author)
+    VALUES (%s, %s, %s, %s, %s, %s, %s);
     """
 INSERT_USER_DETAILED_DATA = """
-    INSERT INTO users_detailed (name, crawling_date, title, number_of_points, points, registration_date, badge,
+    INSERT INTO users_detailed (run_id, name, crawling_date, title, number_of_points, points, registration_date, badge,
                    trade_activity_handelspunkte, trade_activity_positive, trade_activity_neutral,
                    trade_activity_negative, feedback_statistic_produktverpackung,
                    feedback_statistic_kontakt_lieferung, feedback_statistic_produkt_dienstleistung,
                    fingerprint, public_key)
-    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
     """
 INSERT_USER_GENERAL_DATA = """
-    INSERT INTO users_general (name, title, link, number_of_posts, points, registration_date, crawled_datetime)
-    VALUES (%s, %s, %s, %s, %s, %s, %s);
-    """
\ No newline at end of file
+    INSERT INTO users_general (run_id, name, title, link, number_of_posts, points, registration_date, crawled_datetime)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s);
+    """
+INSERT_CRAWL_METRICS_QUERY = """
+    INSERT INTO crawl_metrics (run_id, recorded_at, stage, operations, errors, captchas, bytes, seconds, avg_ms, p95_ms, max_ms)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
+    """
+INSERT_POST_MESSAGES_QUERY = """
+    INSERT IGNORE INTO post_messages (run_id, topic_link, position, post_link, author, posted_at, body, crawling_date)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s);
+    """
+# Moves the progress of a topic to the last position of a stored page, if the page follows the stored messages.
+# Executed once per page, mysql.connector can not batch parameters of the ON DUPLICATE KEY UPDATE part
+UPSERT_TOPIC_PROGRESS_QUERY = """
+    INSERT INTO topic_progress (topic_link, messages) VALUES (%s, IF(%s <= 1, %s, 0))
+    ON DUPLICATE KEY UPDATE messages = IF(messages + 1 >= %s, GREATEST(messages, %s), messages);
+    """
@@ -0,0 +1,153 @@
+# Copyright (C) 2023 Xian Chen
+
+import os
+import sqlite3
+import threading
+import config
+from helper import Helper
+
+CREATE_STATE_TABLES_QUERY = """
+CREATE TABLE IF NOT EXISTS runs (
+    name TEXT PRIMARY KEY,
+    start_page TEXT NOT NULL,
+    crawled_datetime TEXT NOT NULL,
+    finished INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS pages (
+    name TEXT NOT NULL,
+    url TEXT NOT NULL,
+    next_page TEXT,
+    PRIMARY KEY (name, url)
+);
+CREATE TABLE IF NOT EXISTS profiles (
+    name TEXT NOT NULL,
+    url TEXT NOT NULL,
+    page TEXT NOT NULL,
+    status TEXT NOT NULL,
+    PRIMARY KEY (name, url)
+);
+CREATE INDEX IF NOT EXISTS profiles_page ON profiles (name, page, status);
+"""
+
+class CrawlState():
+    """
+    Persistent state of a long running crawl, stored in a local SQLite file.
+
+    For every userlist page the state records the link to the next page and the profiles listed on it.
+    A profile is 'pending' until its record has been written by the pipeline, then it is 'done'.
+    A page is complete once all of its profiles are done. As long as a run is not finished,
+    a restarted crawl continues with the first incomplete page and skips all completed profiles.
+    """
+    def __init__(self, helper: Helper, name, path=config.CRAWL_STATE_PATH):
+        """
+        Args:
+            helper (Helper): The logger
+            name (str): Name of the crawl, e.g. 'users_detailed'. Each name holds at most one run.
+            path (str, optional): The SQLite file. Defaults to config.CRAWL_STATE_PATH.
+        """
+        self.log = helper.log
+        self.name = name
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Profiles are marked done from the pipeline's writer thread
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.executescript(CREATE_STATE_TABLES_QUERY)
+
+    def start(self, start_page, crawled_datetime):
+        """
+        Continues the unfinished run of this crawl, or starts a new run if there is none.
+
+        Args:
+            start_page (str): The first userlist page of a new run.
+            crawled_datetime (str): The crawling date of a new run.
+
+        Returns:
+            tuple: Start page and crawling date of the run, and whether an unfinished run is resumed.
+        """
+        with self.lock, self.connection:
+            run = self.connection.execute(
+                "SELECT start_page, crawled_datetime FROM runs WHERE name = ? AND finished = 0", (self.name,)
+            ).fetchone()
+            if run:
+                self.log.info("Resuming unfinished {} crawl of {} at {}".format(self.name, run[1], run[0]))
+                return run[0], run[1], True
+            for table in ("runs", "pages", "profiles"):
+                self.connection.execute(f"DELETE FROM {table} WHERE name = ?", (self.name,))
+            self.connection.execute(
+                "INSERT INTO runs (name, start_page, crawled_datetime) VALUES (?, ?, ?)",
+                (self.name, start_page, crawled_datetime)
+            )
+        return start_page, crawled_datetime, False
+
+    def next_open_page(self, page):
+        """
+        Follows the recorded next links from the given page to the first page that is not complete yet.
+
+        Args:
+            page (str): The page to start from.
+
+        Returns:
+            str or None: The first incomplete page, None if all pages are complete.
+        """
+        with self.lock:
+            while page:
+                recorded = self.connection.execute("SELECT next_page FROM pages WHERE name = ? AND url = ?",
+                                                   (self.name, page)).fetchone()
+                pending = self.connection.execute(
+                    "SELECT 1 FROM profiles WHERE name = ? AND page = ? AND status = 'pending' LIMIT 1", (self.name, page)
+                ).fetchone()
+                if not recorded or pending:
+                    return page
+                page = recorded[0]
+        return None
+
+    def add_page(self, page, next_page, profiles):
+        """
+        Records a userlist page together with its next link and the profiles listed on it.
+
+        Args:
+            page (str): The userlist page.
+            next_page (str or None): The link to the next userlist page.
+            profiles (list): The profile links listed on the page.
+        """
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO pages (name, url, next_page) VALUES (?, ?, ?)",
+                                    (self.name, page, next_page))
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO profiles (name, url, page, status) VALUES (?, ?, ?, 'pending')",
+                [(self.name, profile, page) for profile in profiles]
+            )
+
+    def get_done_profiles(self, page):
+        """
+        Args:
+            page (str): The userlist page.
+
+        Returns:
+            set: The profile links of the page that are already stored.
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT url FROM profiles WHERE name = ? AND page = ? AND status = 'done'", (self.name, page)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def mark_profiles_done(self, profiles):
+        """
+        Marks profiles as stored, used as on_flush callback of the WriteThroughPipeline.
+
+        Args:
+            profiles (list): The profile links whose records were written.
+        """
+        with self.lock, self.connection:
+            self.connection.executemany("UPDATE profiles SET status = 'done' WHERE name = ? AND url = ?",
+                                        [(self.name, profile) for profile in profiles if profile])
+
+    def finish(self):
+        """
+        Marks the current run as finished, the next crawl starts a new run.
+        """
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE runs SET finished = 1 WHERE name = ?", (self.name,))
+        self.log.debug("Finished {} crawl".format(self.name))
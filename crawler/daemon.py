@@ -0,0 +1,314 @@
+# Copyright (C) 2023 Martin Pretz, Xian Chen
+
+"""
+Headless entry point: runs the forum, topic, general user and detailed user crawls as scheduled jobs, no operator needed.
+
+    python daemon.py
+    python daemon.py --jobs forums,users_general --once
+
+Every job starts at a fixed interval (config.DAEMON_INTERVALS), so the snapshots are evenly spaced.
+Independent jobs run concurrently, each with its own sessions and database connection; a job never overlaps
+with its own previous run, neither in this process nor in another one. The PHPSESSID cookie is read from the
+environment variable config.DAEMON_COOKIE_ENV or the file config.DAEMON_COOKIE_FILE before every run.
+When the detailed crawl hits a captcha, it waits for a new cookie to be written to the file.
+"""
+
+import os
+import math
+import time
+import fcntl
+import signal
+import argparse
+import threading
+import config
+import profiler
+from helper import Helper
+from database import MySQLConnector
+from transport import Transport, CircuitPool
+from replay import FixtureStore, FixtureRecorder
+from archive import PageArchive
+from cache import ResponseCache
+from rate_limiter import RateLimiter
+from retry import RetryPolicy
+from forums import Forums
+from topics import Topics
+from user_crawler import User_Profiles, User_Detailed_Profiles
+
+JOBS = ["forums", "topics", "users_general", "users_detailed"]
+# Seconds between two checks of the cookie file while a captcha is pending
+COOKIE_POLL_INTERVAL = 10
+
+def read_cookie():
+    """
+    Returns:
+        str or None: The PHPSESSID cookie from the environment variable or else the cookie file, None if neither is set.
+    """
+    return os.environ.get(config.DAEMON_COOKIE_ENV, "").strip() or read_cookie_file()
+
+def read_cookie_file():
+    """
+    Returns:
+        str or None: The PHPSESSID cookie from the cookie file, None if it is missing or empty.
+    """
+    if not os.path.exists(config.DAEMON_COOKIE_FILE):
+        return None
+    with open(config.DAEMON_COOKIE_FILE, encoding="utf-8") as cookie_file:
+        return cookie_file.read().strip() or None
+
+class JobLock():
+    """
+    Exclusive lock file of a job, held for the duration of a run.
+    The lock is released by the operating system if the process dies, so a crashed run never blocks the job.
+    """
+    def __init__(self, name, path=config.DAEMON_LOCK_PATH):
+        os.makedirs(path, exist_ok=True)
+        self.path = os.path.join(path, name + ".lock")
+        self.lock_file = None
+
+    def acquire(self):
+        """
+        Returns:
+            bool: True if the lock was acquired, False if another run of the job holds it.
+        """
+        self.lock_file = open(self.path, "w")
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.lock_file.close()
+            self.lock_file = None
+            return False
+        self.lock_file.write(str(os.getpid()))
+        self.lock_file.flush()
+        return True
+
+    def release(self):
+        if self.lock_file:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            self.lock_file.close()
+            self.lock_file = None
+
+class HeadlessDetailedProfiles(User_Detailed_Profiles):
+    """
+    Detailed crawl without an operator at the terminal. On a captcha it waits for a new cookie in the
+    cookie file for config.DAEMON_CAPTCHA_TIMEOUT seconds, then stops. The progress is checkpointed,
+    so the next scheduled run continues where this one stopped.
+    """
+    def solve_captcha(self):
+        if self.transport.limiter:
+            self.transport.limiter.backoff("captcha")
+        stale_cookie = self.transport.get_cookie()
+        self.log.warning("Captcha detected! Waiting up to {}s for a new cookie in '{}'"
+                         .format(config.DAEMON_CAPTCHA_TIMEOUT, config.DAEMON_COOKIE_FILE))
+        deadline = time.monotonic() + config.DAEMON_CAPTCHA_TIMEOUT
+        while time.monotonic() < deadline:
+            # The environment of a running process cannot change, only the file can bring a new cookie
+            cookie = read_cookie_file()
+            if cookie and cookie != stale_cookie:
+                self.log.info("Continuing with the new cookie")
+                self.transport.set_cookie(cookie)
+                return True
+            time.sleep(COOKIE_POLL_INTERVAL)
+        self.log.error("No new cookie received, saving the crawled users. The crawl is resumed at its next run.")
+        return False
+
+class CrawlJob():
+    """
+    A crawl that runs in its own thread, started every interval seconds.
+
+    Runs start on a fixed grid from the first run on. A run that takes longer than the interval skips the
+    start times it missed instead of being followed by a burst of catch-up runs.
+    """
+    def __init__(self, helper: Helper, name, interval, run):
+        """
+        Args:
+            helper (Helper): The logger
+            name (str): The job name, also the name of its lock file.
+            interval (float): Seconds between the starts of two runs.
+            run (callable): Performs one run of the crawl.
+        """
+        self.log = helper.log
+        self.name = name
+        self.interval = interval
+        self.run = run
+        self.lock = JobLock(name)
+        self.thread = None
+
+    def start(self, stopped: threading.Event, once=False):
+        """
+        Starts the job thread.
+
+        Args:
+            stopped (threading.Event): Set to stop scheduling further runs, a running crawl is completed.
+            once (bool, optional): Run only once. Defaults to False.
+        """
+        self.thread = threading.Thread(target=self.__loop, args=(stopped, once), name=self.name)
+        self.thread.start()
+
+    def join(self):
+        self.thread.join()
+
+    def run_once(self):
+        """
+        Performs one run, unless a run of this job is still going on in another process.
+        Errors are logged, they must not end the daemon.
+        """
+        if not self.lock.acquire():
+            self.log.warning("Job '{}' is still running elsewhere, skipping this run".format(self.name))
+            return
+        start = time.perf_counter()
+        try:
+            self.log.info("Job '{}' started".format(self.name))
+            self.run()
+            self.log.info("Job '{}' finished in {:.0f}s".format(self.name, time.perf_counter() - start))
+        # MySQLConnector exits if the database is unreachable, that must only end this run
+        except (Exception, SystemExit) as err:
+            self.log.error("Job '{}' failed after {:.0f}s".format(self.name, time.perf_counter() - start))
+            self.log.debug("Error details: ", exc_info=err)
+        finally:
+            self.lock.release()
+
+    def __loop(self, stopped, once):
+        next_start = time.monotonic()
+        while not stopped.is_set():
+            self.run_once()
+            if once:
+                return
+            missed = math.ceil((time.monotonic() - next_start) / self.interval)
+            next_start += self.interval * max(missed, 1)
+            self.log.info("Job '{}' runs next in {:.0f}s".format(self.name, next_start - time.monotonic()))
+            if stopped.wait(max(next_start - time.monotonic(), 0)):
+                return
+
+class CrawlDaemon():
+    """
+    Builds the sessions of every run and schedules the crawl jobs.
+
+    The HTTP cache and the rate limiter are shared by all jobs, since they all talk to the same onion service.
+    Sessions, cookie jars, the retry budgets and database connections belong to a single run, a URL that
+    used up its retries in one run is retried again in the next.
+    """
+    def __init__(self, helper: Helper):
+        self.helper = helper
+        self.log = helper.log
+        self.cache = ResponseCache(helper) if config.CRAWLER_CACHE else None
+        self.limiter = RateLimiter(helper) if config.CRAWLER_RATE_LIMIT else None
+        self.stopped = threading.Event()
+
+    def crawl_forums(self):
+        cookie = self.__get_cookie()
+        transport = self.__attach(Transport(self.helper, cookie=cookie, cache=self.cache, limiter=self.limiter,
+                                            retry=RetryPolicy(self.helper)))
+        try:
+            Forums(config.CRAWLER_BASE_LINK, cookie, self.helper, MySQLConnector(helper=self.helper), transport) \
+                .crawl_forums(auto_push_db=True, incremental=config.CRAWLER_INCREMENTAL)
+        finally:
+            transport.retry.log_stats()
+
+    def crawl_topics(self):
+        circuits = self.__circuits(self.__get_cookie())
+        try:
+            # The topics of the latest finished forum crawl, continued after their last stored message
+            Topics(self.helper, MySQLConnector(helper=self.helper), circuits).crawl_topics()
+        finally:
+            circuits.retry.log_stats()
+
+    def crawl_users_general(self):
+        circuits = self.__circuits(self.__get_cookie())
+        try:
+            User_Profiles(0, self.helper, MySQLConnector(helper=self.helper), circuits,
+                          parallel=config.CRAWLER_PARALLEL_USERLIST)
+        finally:
+            circuits.retry.log_stats()
+
+    def crawl_users_detailed(self):
+        circuits = self.__circuits(self.__get_cookie())
+        try:
+            # Continues an unfinished crawl on its checkpointed page, otherwise starts on the first page
+            HeadlessDetailedProfiles(0, self.helper, MySQLConnector(helper=self.helper), circuits)
+        finally:
+            circuits.retry.log_stats()
+
+    def run(self, jobs, once=False):
+        """
+        Runs the given jobs until SIGINT/SIGTERM, or each one once.
+
+        Args:
+            jobs (list): Job names out of JOBS.
+            once (bool, optional): Run every job once and return. Defaults to False.
+        """
+        scheduled = []
+        for name in jobs:
+            interval = config.DAEMON_INTERVALS.get(name, 0)
+            if not interval and not once:
+                self.log.info("Job '{}' is disabled".format(name))
+                continue
+            scheduled.append(CrawlJob(self.helper, name, interval, getattr(self, "crawl_" + name)))
+        if not scheduled:
+            self.log.error("No crawl job enabled, see config.DAEMON_INTERVALS")
+            return
+        signal.signal(signal.SIGINT, self.__stop)
+        signal.signal(signal.SIGTERM, self.__stop)
+        self.log.info("Running jobs: {}".format(", ".join(
+            job.name if once else "{} every {}s".format(job.name, job.interval) for job in scheduled
+        )))
+        for job in scheduled:
+            job.start(self.stopped, once)
+        for job in scheduled:
+            job.join()
+        for stats in filter(None, (self.cache, self.limiter)):
+            stats.log_stats()
+
+    def __stop(self, signum, frame):
+        self.log.info("Stopping, waiting for the running crawls to finish")
+        self.stopped.set()
+
+    def __get_cookie(self):
+        cookie = read_cookie()
+        if not cookie:
+            raise RuntimeError("No cookie in ${} or '{}'".format(config.DAEMON_COOKIE_ENV, config.DAEMON_COOKIE_FILE))
+        # The crawlers take their initial cookie from the config
+        config.CRAWLER_COOKIE = cookie
+        return cookie
+
+    def __circuits(self, cookie):
+        return self.__attach(CircuitPool(self.helper, cookie=cookie, cache=self.cache, limiter=self.limiter,
+                                         retry=RetryPolicy(self.helper)))
+
+    def __attach(self, transport):
+        """
+        Attaches the fixture recorder and a page archive of its own to the sessions of a run.
+        """
+        if config.CRAWLER_FIXTURE_PATH:
+            FixtureRecorder(self.helper, FixtureStore(config.CRAWLER_FIXTURE_PATH)).attach(transport)
+        if config.CRAWLER_ARCHIVE:
+            # A new archive run per crawl, so each crawl can be re-parsed on its own
+            PageArchive(self.helper).attach(transport)
+        return transport
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the crawlers as scheduled jobs without interaction.")
+    parser.add_argument("--jobs", default=",".join(JOBS), help="Comma separated jobs out of " + ", ".join(JOBS))
+    parser.add_argument("--once", action="store_true", help="Run every job once, concurrently, and exit")
+    parser.add_argument("--trace", default=config.PROFILE_TRACE_PATH,
+                        help="With --once, profile the jobs and write their spans to this trace file")
+    parser.add_argument("--cprofile", default=config.PROFILE_CPROFILE_PATH,
+                        help="With --trace, also write one cProfile dump per span stage to this directory")
+    args = parser.parse_args()
+
+    helper = Helper(config.LOGGING_FILE_PATH)
+    jobs = args.jobs.split(",")
+    unknown = [name for name in jobs if name not in JOBS]
+    if unknown:
+        parser.error("Unknown jobs: {}".format(", ".join(unknown)))
+    # The spans are kept in memory until the end, so only single runs are profiled
+    if args.trace and not args.once:
+        helper.log.warning("Profiling is only available with --once, running without it")
+    elif args.trace:
+        profiler.enable(helper, args.trace, args.cprofile)
+    try:
+        CrawlDaemon(helper).run(jobs, once=args.once)
+    finally:
+        profiler.disable()
+
+if __name__ == "__main__":
+    main()
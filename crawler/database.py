@@ -1,19 +1,43 @@
 # Copyright (C) 2023 Martin Pretz
 
 import sys
+import time
 import config
+import profiler
 import mysql.connector
 from helper import Helper
-from tqdm import tqdm
-from mysql.connector.errors import ProgrammingError, DatabaseError
-  
+from mysql.connector.errors import ProgrammingError, DatabaseError, DataError, IntegrityError
+
+# Order of the forum/subforum, feedback, general user and post values in the INSERT queries of config.py
+FORUM_COLUMNS = ("element_type", "crawling_date", "title", "link", "topics_count", "posts_count", "last_post_time", "last_post_author")
+FEEDBACK_COLUMNS = ("date", "mark", "comment", "author")
+USER_GENERAL_COLUMNS = ("name", "title", "link", "number_of_posts", "points", "registration_date", "crawled_datetime")
+POST_COLUMNS = ("element_type", "crawling_date", "title", "link", "author", "replies_count", "views_count", "last_post_time", "last_post_author")
+# Order of the message values in INSERT_POST_MESSAGES_QUERY
+MESSAGE_COLUMNS = ("topic_link", "position", "post_link", "author", "posted_at", "body", "crawling_date")
+# Order of the per-stage values of CrawlMetrics.get_stats() in INSERT_CRAWL_METRICS_QUERY
+METRIC_COLUMNS = ("operations", "errors", "captchas", "bytes", "seconds", "avg_ms", "p95_ms", "max_ms")
+# Crawler and crawl date column of every table whose rows reference a crawl run
+RUN_TABLES = {"forums": ("forums", "crawling_date"), "subforums": ("forums", "crawling_date"),
+              "posts": ("forums", "crawling_date"), "users_general": ("users_general", "crawled_datetime"),
+              "users_detailed": ("users_detailed", "crawling_date"), "users_feedback": ("users_detailed", "crawling_date"),
+              "post_messages": ("topics", "crawling_date")}
+# Tables of which a copy of the latest finished crawl run is kept in <table>_latest for the dashboards
+LATEST_TABLES = ["forums", "subforums", "posts", "users_general"]
+
 class MySQLConnector():
 
-    def __init__(self, helper: Helper):
+    def __init__(self, helper: Helper, connection=None):
+        """
+        Args:
+            helper (Helper): The logger
+            connection (optional): An open connection to use instead, e.g. the stand-in of benchmark_db.py.
+                                   Defaults to a new connection to config.MYSQL_HOST.
+        """
         self.log = helper.log
         self.log.info("Initializing database connection")
         try:
-            self.connection = mysql.connector.connect(
+            self.connection = connection or mysql.connector.connect(
                 user=config.MYSQL_USER, 
                 password=config.MYSQL_PASSWORD, 
                 host=config.MYSQL_HOST
@@ -27,6 +51,14 @@ class MySQLConnector():
             self.log.debug("Error details: ", exc_info=DBErr)
             sys.exit(-2)
         self.cursor = self.connection.cursor(dictionary=True)
+        # Distance of the AUTO_INCREMENT IDs of a multi-row INSERT, None if they may not be consecutive, see __insert_many()
+        self.id_step = self.__get_id_step()
+        # Run IDs by crawler and crawling date, see get_run_id()
+        self.run_ids = {}
+        # CrawlMetrics of the running crawls by crawler, the loaders record their time there, see track_metrics()
+        self.metrics = {}
+        # Whether load_metrics() stores the metrics, off for crawls that do not fetch from the onion service
+        self.store_metrics = True
         self.init_database()
         self.init_tables()
 
@@ -72,6 +104,14 @@ class MySQLConnector():
         """
         self.log.info("Init tables")
         try:
+            self.log.debug("Init crawl runs table")
+            self.cursor.execute(config.CREATE_CRAWL_RUNS_TABLE_QUERY)
+            self.log.debug("Crawl runs table created successfully")
+
+            self.log.debug("Init crawl metrics table")
+            self.cursor.execute(config.CREATE_CRAWL_METRICS_TABLE_QUERY)
+            self.log.debug("Crawl metrics table created successfully")
+
             self.log.debug("Init forums table")
             self.cursor.execute(config.CREATE_FORUMS_TABLE_QUERY)
             self.log.debug("Forums table created successfully")
@@ -84,6 +124,14 @@ class MySQLConnector():
             self.cursor.execute(config.CREATE_POSTS_TABLE_QUERY)
             self.log.debug("Posts table created successfully")
 
+            self.log.debug("Init post messages table")
+            self.cursor.execute(config.CREATE_POST_MESSAGES_TABLE_QUERY)
+            self.log.debug("Post messages table created successfully")
+
+            self.log.debug("Init topic progress table")
+            self.cursor.execute(config.CREATE_TOPIC_PROGRESS_TABLE_QUERY)
+            self.log.debug("Topic progress table created successfully")
+
             self.log.debug("Init users detailed table")
             self.cursor.execute(config.CREATE_USERS_DETAILED_TABLE_QUERY)
             self.log.debug("Users detailed table created successfully")
@@ -96,16 +144,147 @@ class MySQLConnector():
             self.cursor.execute(config.CREATE_FEEDBACK_REVIEW_TABLE)
             self.log.debug("Feedback review table created successfully")
 
+            migrated = self.__migrate_tables()
+
+            self.log.debug("Init latest snapshot tables")
+            for table in LATEST_TABLES:
+                self.cursor.execute(f"CREATE TABLE IF NOT EXISTS {table}_latest LIKE {table}")
+            self.log.debug("Latest snapshot tables created successfully")
+
         except Exception as err:
             self.log.warning("Table creation failed")
             self.log.debug("Error details:", exc_info=err)
+            return
+        # Snapshot tables are rebuilt after a migration, so they get the new columns and indexes,
+        # and filled if the database holds crawls from before they existed
+        self.cursor.execute("SELECT EXISTS (SELECT 1 FROM forums_latest) AS filled")
+        if migrated or not self.cursor.fetchone()["filled"]:
+            self.refresh_latest_tables(["forums", "subforums", "posts"])
+        self.cursor.execute("SELECT EXISTS (SELECT 1 FROM users_general_latest) AS filled")
+        if migrated or not self.cursor.fetchone()["filled"]:
+            self.refresh_latest_tables(["users_general"])
+
+    def __migrate_tables(self):
+        """
+        Brings tables created by older versions up to the current schema, in place.
+
+        Tables without a run_id column get it, together with one crawl run per distinct crawling date
+        (marked as finished) and the foreign key. Missing indexes of config.MYSQL_INDEXES are created.
+
+        Returns:
+            bool: True if a run_id column was added to any table.
+
+        Note:
+            This method is intended for internal use within the MySQLConnector class.
+        """
+        migrated = False
+        for table, (crawler, date_column) in RUN_TABLES.items():
+            self.cursor.execute("SELECT COUNT(*) AS found FROM INFORMATION_SCHEMA.COLUMNS "
+                                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = 'run_id'", (table,))
+            if self.cursor.fetchone()["found"]:
+                continue
+            self.log.info(f"Migrating table '{table}': adding crawl runs")
+            start = time.perf_counter()
+            self.cursor.execute(f"ALTER TABLE {table} ADD COLUMN run_id INT AFTER {self.__primary_key(table)}")
+            self.cursor.execute(f"INSERT IGNORE INTO crawl_runs (crawler, crawling_date, finished_at) "
+                                f"SELECT DISTINCT %s, {date_column}, {date_column} FROM {table} WHERE {date_column} IS NOT NULL",
+                                (crawler,))
+            self.cursor.execute(f"UPDATE {table} JOIN crawl_runs ON crawl_runs.crawler = %s "
+                                f"AND crawl_runs.crawling_date = {table}.{date_column} SET {table}.run_id = crawl_runs.run_id",
+                                (crawler,))
+            self.cursor.execute(f"ALTER TABLE {table} ADD FOREIGN KEY (run_id) REFERENCES crawl_runs(run_id)")
+            self.__commit()
+            self.log.info(f"Migrated table '{table}' in {time.perf_counter() - start:.2f}s")
+            migrated = True
+        for table, indexes in config.MYSQL_INDEXES.items():
+            self.cursor.execute("SELECT DISTINCT INDEX_NAME AS name FROM INFORMATION_SCHEMA.STATISTICS "
+                                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", (table,))
+            existing = {row["name"] for row in self.cursor.fetchall()}
+            for name, columns in indexes.items():
+                if name not in existing:
+                    self.log.debug(f"Creating index '{name}' on {table} ({columns})")
+                    self.cursor.execute(f"CREATE INDEX {name} ON {table} ({columns})")
+        return migrated
+
+    def __primary_key(self, table):
+        """
+        Note:
+            This method is intended for internal use within the MySQLConnector class.
+        """
+        self.cursor.execute("SELECT COLUMN_NAME AS name FROM INFORMATION_SCHEMA.COLUMNS "
+                            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_KEY = 'PRI'", (table,))
+        return self.cursor.fetchone()["name"]
+
+    def get_run_id(self, crawler, crawling_date):
+        """
+        Returns the crawl run of a crawler's crawl, registering the run on first use.
+        All rows of one crawl share its crawling date, a resumed crawl keeps its run.
+
+        Args:
+            crawler (str): 'forums', 'topics', 'users_general' or 'users_detailed'
+            crawling_date (str): The crawling date of the crawl in the format '%Y-%m-%d %H:%M:%S'.
 
-    def load_forums(self, data):
+        Returns:
+            int: The ID of the crawl run.
+
+        Example:
+            connector = MySQLConnector()
+            run_id = connector.get_run_id("forums", "2023-09-01 12:00:00")
+        """
+        key = (crawler, str(crawling_date))
+        if key not in self.run_ids:
+            self.cursor.execute("INSERT IGNORE INTO crawl_runs (crawler, crawling_date) VALUES (%s, %s)", key)
+            self.cursor.execute("SELECT run_id FROM crawl_runs WHERE crawler = %s AND crawling_date = %s", key)
+            self.run_ids[key] = self.cursor.fetchone()["run_id"]
+        return self.run_ids[key]
+
+    def finish_run(self, crawler, crawling_date):
+        """
+        Marks a crawl run as finished and makes it the latest snapshot of the crawler's tables, unless a crawl
+        with a later crawling date has already finished (e.g. a resumed crawl that finishes after a newer one).
+
+        Args:
+            crawler (str): 'forums', 'topics', 'users_general' or 'users_detailed'
+            crawling_date (str): The crawling date of the crawl in the format '%Y-%m-%d %H:%M:%S'.
+
+        Example:
+            connector = MySQLConnector()
+            connector.finish_run("users_general", "2023-09-01 12:00:00")
+        """
+        try:
+            run_id = self.get_run_id(crawler, crawling_date)
+            self.cursor.execute("UPDATE crawl_runs SET finished_at = NOW() WHERE run_id = %s", (run_id,))
+            self.__commit()
+        except Exception as err:
+            self.connection.rollback()
+            self.log.error(f"Failed to finish the {crawler} crawl run of {crawling_date}")
+            self.log.debug("Error details: ", exc_info=err)
+            return
+        tables = [table for table in LATEST_TABLES if RUN_TABLES[table][0] == crawler]
+        if not tables:
+            return
+        latest_run_id = self.get_latest_run(crawler)
+        if latest_run_id != run_id:
+            self.log.info(f"The {crawler} crawl of {crawling_date} is older than run {latest_run_id}, "
+                          "the latest snapshot is left unchanged")
+            return
+        self.refresh_latest_tables(tables, run_id)
+
+    def load_forums(self, data, finish=True):
         """
         Loads forum data into the database.
 
+        All rows of one crawl are written in a single transaction with one multi-row INSERT per table
+        (split into chunks of config.MYSQL_BATCH_SIZE rows). The forum and subforum IDs assigned by
+        AUTO_INCREMENT are derived from LAST_INSERT_ID() of each INSERT, so posts can reference their parents
+        without a round trip per inserted row.
+
         Args:
             data (list): A list of dictionaries containing forum, subforum, and post information.
+            finish (bool, optional): Whether the crawl is complete and is finished as the latest snapshot. Defaults to True.
+
+        Returns:
+            bool: True if the crawl was stored, False if its transaction failed.
 
         Note:
             This method is intended for internal use within the ForumScraper class.
@@ -115,36 +294,45 @@ class MySQLConnector():
             connector.load_forums(forum_data)
         """
         self.log.info("Loading forums into DB")
+        start = time.perf_counter()
+        forum_rows, subforum_rows, forum_post_rows, subforum_post_rows = [], [], [], []
         try:
-            pbar = tqdm(total=len(data), desc="Progress", unit="forum")
-            for forum_data in data:
-                if "subforums" in forum_data:
-                    forum_values = {key: value for key, value in forum_data.items() if key != "subforums"}
-                    self.cursor.execute(config.INSERT_FORUMS_QUERY, tuple(forum_values.values()))
-                    forum_id = self.cursor.lastrowid
-                    
-                    for subforum_data in forum_data["subforums"]:
-                        subforum_values = {key: value for key, value in subforum_data.items() if key != "posts"}
-                        self.cursor.execute(config.INSERT_SUBFORUMS_QUERY, tuple(subforum_values.values()) + (forum_id,))
-                        subforum_id = self.cursor.lastrowid
-                        
-                        for post_data in subforum_data.get("posts", []):
-                            post_values = {key: value for key, value in post_data.items()}
-                            self.cursor.execute(config.INSERT_POSTS_WITH_SUBFORUM_QUERY, tuple(post_values.values()) + (subforum_id,))
-                else:
-                    forum_values = {key: value for key, value in forum_data.items() if key != "posts"}
-                    self.cursor.execute(config.INSERT_FORUMS_QUERY, tuple(forum_values.values()))
-                    forum_id = self.cursor.lastrowid
-                    
-                    for post_data in forum_data.get("posts", []):
-                        post_values = {key: value for key, value in post_data.items()}
-                        self.cursor.execute(config.INSERT_POSTS_WITH_FORUM_QUERY, tuple(post_values.values()) + (forum_id,))
-                pbar.update(1)
+            # All rows of a forum crawl share its crawling date and thus its run
+            run_id = self.get_run_id("forums", data[0]["crawling_date"]) if data else None
+            forum_rows = [(run_id,) + tuple(forum_data[key] for key in FORUM_COLUMNS) for forum_data in data]
+            forum_ids = self.__insert_many(config.INSERT_FORUMS_QUERY, forum_rows, return_ids=True)
+            subforums = []
+            for forum_data, forum_id in zip(data, forum_ids):
+                for subforum_data in forum_data.get("subforums", []):
+                    subforums.append(subforum_data)
+                    subforum_rows.append((run_id,) + tuple(subforum_data[key] for key in FORUM_COLUMNS) + (forum_id,))
+                for post_data in forum_data.get("posts", []):
+                    forum_post_rows.append((run_id,) + tuple(post_data[key] for key in POST_COLUMNS) + (forum_id,))
+            subforum_ids = self.__insert_many(config.INSERT_SUBFORUMS_QUERY, subforum_rows, return_ids=True)
+            for subforum_data, subforum_id in zip(subforums, subforum_ids):
+                for post_data in subforum_data.get("posts", []):
+                    subforum_post_rows.append((run_id,) + tuple(post_data[key] for key in POST_COLUMNS) + (subforum_id,))
+
+            self.__insert_many(config.INSERT_POSTS_WITH_FORUM_QUERY, forum_post_rows)
+            self.__insert_many(config.INSERT_POSTS_WITH_SUBFORUM_QUERY, subforum_post_rows)
+            self.__commit()
         except Exception as err:
+            self.connection.rollback()
+            # Runs registered in the rolled back transaction are gone
+            self.run_ids.clear()
+            self.__record_load("forums", time.perf_counter() - start, 0, error=True)
             self.log.error("Failed to load forums data to DB")
             self.log.debug("Error details: ", exc_info=err)
-        finally:
-            self.connection.commit()
+            return False
+        row_count = len(forum_rows) + len(subforum_rows) + len(forum_post_rows) + len(subforum_post_rows)
+        duration = time.perf_counter() - start
+        self.__record_load("forums", duration, row_count)
+        self.log.info("Loaded {} forums, {} subforums and {} posts in {:.2f}s ({:.0f} rows/s)"
+                      .format(len(forum_rows), len(subforum_rows), len(forum_post_rows) + len(subforum_post_rows),
+                              duration, row_count / duration if duration else 0))
+        if data and finish:
+            self.finish_run("forums", data[0]["crawling_date"])
+        return True
 
     def single_load_user_detailed(self, single_user_data):
         """
@@ -166,13 +354,14 @@ class MySQLConnector():
         self.log.debug("Loading single user data into DB")
         try:
             single_user_values = self.__clean_detailed_user(single_user_data)
-            self.cursor.execute(config.INSERT_USER_DETAILED_DATA, tuple(single_user_values.values()))
+            run_id = self.get_run_id("users_detailed", single_user_values["crawling_date"])
+            self.cursor.execute(config.INSERT_USER_DETAILED_DATA, (run_id,) + tuple(single_user_values.values()))
             return self.cursor.lastrowid
         except Exception as err:
             self.log.error("Failed to load user data")
             self.log.debug("Error details: ", exc_info=err)
         finally:
-            self.connection.commit()
+            self.__commit()
 
     def single_load_user_general(self, single_user_data):
         """
@@ -193,13 +382,15 @@ class MySQLConnector():
         """
         self.log.debug("Loading single user data into DB")
         try:
-            self.cursor.execute(config.INSERT_USER_GENERAL_DATA, tuple(single_user_data.values()))
+            run_id = self.get_run_id("users_general", single_user_data["crawled_datetime"])
+            self.cursor.execute(config.INSERT_USER_GENERAL_DATA,
+                                (run_id,) + tuple(single_user_data[key] for key in USER_GENERAL_COLUMNS))
             return self.cursor.lastrowid
         except Exception as err:
             self.log.error("Failed to load user data")
             self.log.debug("Error details: ", exc_info=err)
         finally:
-            self.connection.commit()
+            self.__commit()
 
     def single_load_user_feedback(self, feedback_data, user_id, crawling_date):
         """
@@ -225,13 +416,13 @@ class MySQLConnector():
         """
         self.log.debug("Loading user feedback data into DB")
         try:
-            feedback_values = (user_id, crawling_date) + tuple(feedback_data.values())
+            feedback_values = (self.get_run_id("users_detailed", crawling_date), user_id, crawling_date) + tuple(feedback_data.values())
             self.cursor.execute(config.INSERT_USER_FEEDBACK_QUERY, feedback_values)
         except Exception as err:
             self.log.error("Failed to load user feedback data")
             self.log.debug("Error details: ", exc_info=err)
         finally:
-            self.connection.commit()
+            self.__commit()
 
     def bulk_load_user_general(self, user_list):
         """
@@ -240,6 +431,9 @@ class MySQLConnector():
         Args:
             user_list (list): A list of dictionaries containing general user information.
 
+        Returns:
+            list: The users that could not be stored, all of them if the transaction failed.
+
         Note:
             This method is intended for internal use within the ForumScraper class.
 
@@ -253,24 +447,38 @@ class MySQLConnector():
             connector.bulk_load_user_general(user_data)
         """
         self.log.info("Bulk loading general user data into db")
+        start = time.perf_counter()
         try:
-            with tqdm(total=len(user_list), desc="Progress", unit="user") as pbar:
-                for user in user_list:
-                    self.cursor.execute(config.INSERT_USER_GENERAL_DATA, tuple(user.values()))
-                    pbar.update(1)
+            self.__insert_many(config.INSERT_USER_GENERAL_DATA,
+                               [(self.get_run_id("users_general", user["crawled_datetime"]),)
+                                + tuple(user[key] for key in USER_GENERAL_COLUMNS) for user in user_list])
+            self.__commit()
         except Exception as err:
+            self.connection.rollback()
+            self.run_ids.clear()
+            self.__record_load("users_general", time.perf_counter() - start, 0, error=True)
             self.log.error("Failed to bulk load general user data")
             self.log.debug("Error details: ", exc_info=err)
-        finally:
-            self.connection.commit()
+            return user_list
+        duration = time.perf_counter() - start
+        self.__record_load("users_general", duration, len(user_list))
+        self.log.debug("Loaded {} general users in {:.2f}s".format(len(user_list), duration))
+        return []
 
     def bulk_load_user_detailed(self, user_list):
         """
         Bulk loads detailed user data into the database.
 
+        Users and their feedback entries are written with multi-row INSERTs, one transaction
+        (and one commit) per config.MYSQL_COMMIT_BATCH_SIZE users. If a batch fails, e.g. because the table
+        rejects one of its rows, its users are loaded one by one instead, see __load_users_detailed_singly().
+
         Args:
             user_list (list): A list of dictionaries containing detailed user information.
 
+        Returns:
+            list: The users that could not be stored.
+
         Note:
             This method is intended for internal use within the ForumScraper class.
 
@@ -295,24 +503,247 @@ class MySQLConnector():
             ]
             connector.bulk_load_user_detailed(user_data)
         """
-        self.log.info("Bulk loading general user data into db")
+        self.log.info("Bulk loading detailed user data into db")
+        batch_size = config.MYSQL_COMMIT_BATCH_SIZE
+        failed_users = []
+        for batch_start in range(0, len(user_list), batch_size):
+            batch = user_list[batch_start:batch_start+batch_size]
+            start = time.perf_counter()
+            user_rows, feedback_rows = [], []
+            try:
+                user_rows = [(self.get_run_id("users_detailed", user_data["crawled_datetime"]),)
+                             + tuple(self.__clean_detailed_user(user_data).values()) for user_data in batch]
+                # Feedback rows reference the user IDs assigned by the multi-row INSERT, no round trip per user
+                user_ids = self.__insert_many(config.INSERT_USER_DETAILED_DATA, user_rows, return_ids=True)
+                for user_data, user_row, user_id in zip(batch, user_rows, user_ids):
+                    for feedback_review in user_data["feedback_reviews"] or []:
+                        feedback_rows.append((user_row[0], user_id, user_data["crawled_datetime"])
+                                             + tuple(feedback_review[key] for key in FEEDBACK_COLUMNS))
+                self.__insert_many(config.INSERT_USER_FEEDBACK_QUERY, feedback_rows)
+                self.__commit()
+            except Exception as err:
+                self.connection.rollback()
+                self.run_ids.clear()
+                self.log.warning("Failed to bulk load detailed user data [{}-{}], loading the users one by one"
+                                 .format(batch_start+1, batch_start+len(batch)))
+                self.log.debug("Error details: ", exc_info=err)
+                # A single bad row must not cost the whole batch
+                user_count, feedback_count, failed = self.__load_users_detailed_singly(batch)
+                failed_users.extend(failed)
+                self.__record_load("users_detailed", time.perf_counter() - start, user_count + feedback_count,
+                                   error=bool(failed))
+                self.log.info("Loaded users [{}-{}] of {} one by one: {} users and {} feedback entries, {} users failed"
+                              .format(batch_start+1, batch_start+len(batch), len(user_list),
+                                      user_count, feedback_count, len(failed)))
+                continue
+            duration = time.perf_counter() - start
+            self.__record_load("users_detailed", duration, len(user_rows) + len(feedback_rows))
+            self.log.info("Loaded users [{}-{}] of {}: {} users and {} feedback entries in {:.2f}s"
+                          .format(batch_start+1, batch_start+len(batch), len(user_list),
+                                  len(user_rows), len(feedback_rows), duration))
+        return failed_users
+
+    def __load_users_detailed_singly(self, user_list):
+        """
+        Loads detailed users with one transaction per user, after the multi-row INSERT of their batch failed.
+        A feedback entry the table rejects (e.g. a comment longer than its column) is left out,
+        a user that cannot be stored is skipped together with its feedback.
+
+        Returns:
+            tuple: The number of stored users and feedback entries, and the users that could not be stored.
+
+        Note:
+            This method is intended for internal use within the MySQLConnector class.
+        """
+        user_count, feedback_count, failed = 0, 0, []
+        for user_data in user_list:
+            stored_feedback = 0
+            try:
+                run_id = self.get_run_id("users_detailed", user_data["crawled_datetime"])
+                self.cursor.execute(config.INSERT_USER_DETAILED_DATA,
+                                    (run_id,) + tuple(self.__clean_detailed_user(user_data).values()))
+                user_id = self.cursor.lastrowid
+                for feedback_review in user_data["feedback_reviews"] or []:
+                    try:
+                        self.cursor.execute(config.INSERT_USER_FEEDBACK_QUERY, (run_id, user_id, user_data["crawled_datetime"])
+                                            + tuple(feedback_review[key] for key in FEEDBACK_COLUMNS))
+                        stored_feedback += 1
+                    except (DataError, IntegrityError) as err:
+                        # Only the statement is rolled back, the user's transaction goes on
+                        self.log.error("Left out a feedback entry of user {}".format(user_data["name"]))
+                        self.log.debug("Error details: ", exc_info=err)
+                self.__commit()
+            except Exception as err:
+                self.connection.rollback()
+                self.run_ids.clear()
+                failed.append(user_data)
+                self.log.error("Failed to load detailed user {}".format(user_data["name"]))
+                self.log.debug("Error details: ", exc_info=err)
+                continue
+            user_count += 1
+            feedback_count += stored_feedback
+        return user_count, feedback_count, failed
+
+    def bulk_load_post_messages(self, pages):
+        """
+        Bulk loads the messages of topic pages into the database, messages that are already stored are skipped.
+
+        The progress of a topic (topic_progress) is moved to the last position of a page in the same transaction,
+        but only if the page follows the messages stored before. After a failed batch the progress stays in front
+        of its pages, so the next crawl fetches them again, also if later pages of the topic could be stored.
+
+        Args:
+            pages (list): A list of dictionaries with the topic link, the first and last position and the new messages of a page.
+
+        Returns:
+            list: The pages that could not be stored, all of them if the transaction failed.
+
+        Note:
+            This method is intended for internal use within the Topics class.
+
+        Example:
+            connector = MySQLConnector()
+            pages = [
+                {
+                    "topic_link": "http://example.onion/viewtopic.php?id=5",
+                    "first_position": 1,
+                    "last_position": 25,
+                    "messages": [
+                        {
+                            "topic_link": "http://example.onion/viewtopic.php?id=5",
+                            "position": 1,
+                            "post_link": "http://example.onion/viewtopic.php?pid=12#p12",
+                            "author": "user1",
+                            "posted_at": "2023-09-01 12:00:00",
+                            "body": "Hello",
+                            "crawling_date": "2023-09-02 08:00:00"
+                        },
+                        # ...
+                    ]
+                },
+                # ...
+            ]
+            failed = connector.bulk_load_post_messages(pages)
+        """
+        start = time.perf_counter()
+        messages = [message for page in pages for message in page["messages"]]
         try:
-            with tqdm(total=len(user_list), desc="Progress", unit="user") as pbar:
-                for user_data in user_list:
-                    user_values = self.__clean_detailed_user(user_data)
-                    self.cursor.execute(config.INSERT_USER_DETAILED_DATA, tuple(user_values.values()))
-                    user_id = self.cursor.lastrowid
-
-                    if user_data["feedback_reviews"]:
-                        for feedback_review in user_data["feedback_reviews"]:
-                            self.single_load_user_feedback(feedback_review, user_id, user_data["crawled_datetime"])
-                    pbar.update(1)
+            self.__insert_many(config.INSERT_POST_MESSAGES_QUERY,
+                               [(self.get_run_id("topics", message["crawling_date"]),)
+                                + tuple(message[key] for key in MESSAGE_COLUMNS) for message in messages])
+            # One statement per page, see UPSERT_TOPIC_PROGRESS_QUERY
+            with profiler.span("insert", table="topic_progress", rows=len(pages)):
+                for page in pages:
+                    self.cursor.execute(config.UPSERT_TOPIC_PROGRESS_QUERY,
+                                        (page["topic_link"], page["first_position"], page["last_position"],
+                                         page["first_position"], page["last_position"]))
+            self.__commit()
         except Exception as err:
-            self.log.error("Failed to bulk load detailed user data")
+            self.connection.rollback()
+            self.run_ids.clear()
+            self.__record_load("topics", time.perf_counter() - start, 0, error=True)
+            self.log.error("Failed to bulk load post messages")
             self.log.debug("Error details: ", exc_info=err)
-            self.log.debug(user_values)
-        finally:
-            self.connection.commit()
+            return pages
+        duration = time.perf_counter() - start
+        self.__record_load("topics", duration, len(messages))
+        self.log.debug("Loaded {} post messages in {:.2f}s".format(len(messages), duration))
+        return []
+
+    def track_metrics(self, metrics):
+        """
+        Records the time spent in the loaders of a crawler in its metrics, until the crawler's metrics are loaded.
+
+        Args:
+            metrics (CrawlMetrics): The metrics of a running crawl.
+        """
+        self.metrics[metrics.crawler] = metrics
+
+    def load_metrics(self, metrics, crawling_date):
+        """
+        Loads the metrics of a crawl into the crawl_metrics table, one row per stage.
+
+        Args:
+            metrics (CrawlMetrics): The metrics of the crawl.
+            crawling_date (str): The crawling date of the crawl in the format '%Y-%m-%d %H:%M:%S'.
+
+        Example:
+            connector = MySQLConnector()
+            connector.load_metrics(metrics, "2023-09-01 12:00:00")
+        """
+        self.metrics.pop(metrics.crawler, None)
+        if not self.store_metrics:
+            return
+        try:
+            run_id = self.get_run_id(metrics.crawler, crawling_date)
+            self.__insert_many(config.INSERT_CRAWL_METRICS_QUERY, [
+                (run_id, metrics.recorded_at, stage) + tuple(stats[key] for key in METRIC_COLUMNS)
+                for stage, stats in metrics.get_stats().items()
+            ])
+            self.__commit()
+        except Exception as err:
+            self.connection.rollback()
+            self.run_ids.clear()
+            self.log.error(f"Failed to load the metrics of the {metrics.crawler} crawl of {crawling_date}")
+            self.log.debug("Error details: ", exc_info=err)
+
+    def refresh_latest_tables(self, tables, run_id=None):
+        """
+        Replaces the latest snapshot tables (<table>_latest) of the given tables with the rows of one crawl run.
+
+        The dashboards read the latest crawl from these tables instead of searching all stored crawls for it.
+        The new snapshots are built next to the current ones and swapped in with a single RENAME TABLE,
+        so readers see either the previous or the new crawl of all given tables, never a mix.
+
+        Args:
+            tables (list): Tables out of LATEST_TABLES of the same crawler, e.g. ["forums", "subforums", "posts"]
+            run_id (int, optional): The crawl run to copy. Defaults to the latest finished run of the tables' crawler.
+
+        Example:
+            connector = MySQLConnector()
+            connector.refresh_latest_tables(["users_general"])
+        """
+        start = time.perf_counter()
+        try:
+            if run_id is None:
+                run_id = self.get_latest_run(RUN_TABLES[tables[0]][0])
+                if run_id is None:
+                    return
+            for table in tables:
+                self.cursor.execute(f"DROP TABLE IF EXISTS {table}_latest_new")
+                self.cursor.execute(f"CREATE TABLE {table}_latest_new LIKE {table}")
+                self.cursor.execute(f"INSERT INTO {table}_latest_new SELECT * FROM {table} WHERE run_id = %s", (run_id,))
+            self.__commit()
+            self.cursor.execute("RENAME TABLE " + ", ".join(
+                f"{table}_latest TO {table}_latest_old, {table}_latest_new TO {table}_latest" for table in tables
+            ))
+            for table in tables:
+                self.cursor.execute(f"DROP TABLE {table}_latest_old")
+        except Exception as err:
+            self.connection.rollback()
+            self.log.error("Failed to refresh the latest snapshot of {}".format(", ".join(tables)))
+            self.log.debug("Error details: ", exc_info=err)
+            return
+        self.log.info("Refreshed the latest snapshot of {} (run {}) in {:.2f}s"
+                      .format(", ".join(tables), run_id, time.perf_counter() - start))
+
+    def get_latest_run(self, crawler):
+        """
+        Args:
+            crawler (str): 'forums', 'users_general' or 'users_detailed'
+
+        Returns:
+            int or None: The ID of the crawler's finished crawl run with the latest crawling date, None if it has none.
+
+        Example:
+            connector = MySQLConnector()
+            run_id = connector.get_latest_run("forums")
+        """
+        # Runs are numbered when they start, a resumed crawl can finish after a newer one
+        self.cursor.execute("SELECT run_id FROM crawl_runs WHERE crawler = %s AND finished_at IS NOT NULL "
+                            "ORDER BY crawling_date DESC LIMIT 1", (crawler,))
+        row = self.cursor.fetchone()
+        return row["run_id"] if row else None
 
     def delete_tables(self, table_list):
         """
@@ -335,7 +766,89 @@ class MySQLConnector():
                 self.log.error(f"Error while deleting table {table_name}")
                 self.log.debug(f"Error: {err}")
             finally:
-                self.connection.commit()
+                self.__commit()
+
+    def __record_load(self, crawler, seconds, rows, error=False):
+        """
+        Records a write of a loader in the metrics of its crawler, if they are tracked.
+
+        Note:
+            This method is intended for internal use within the MySQLConnector class.
+        """
+        metrics = self.metrics.get(crawler)
+        if metrics:
+            metrics.record("db", seconds, rows, error)
+
+    def __commit(self):
+        """
+        Commits the running transaction. In profiling mode the commit is recorded as a commit span,
+        the flush of the redo log is not part of the insert spans.
+
+        Note:
+            This method is intended for internal use within the MySQLConnector class.
+        """
+        with profiler.span("commit"):
+            self.connection.commit()
+
+    def __insert_many(self, query, rows, return_ids=False):
+        """
+        Inserts rows with multi-row INSERT statements of at most config.MYSQL_BATCH_SIZE rows each.
+        In profiling mode every statement is recorded as an insert span tagged with its table.
+
+        InnoDB reserves the AUTO_INCREMENT IDs of a multi-row INSERT with a known number of rows in one step
+        under innodb_autoinc_lock_mode 0 or 1, so the rows of a statement get consecutive IDs starting at
+        LAST_INSERT_ID() (the cursor's lastrowid), auto_increment_increment apart. If the server does not
+        guarantee this (see __get_id_step()), rows whose IDs are needed are inserted one by one instead.
+
+        Args:
+            query (str): The INSERT statement of a single row.
+            rows (list): The parameters of every row.
+            return_ids (bool, optional): Whether the AUTO_INCREMENT IDs of the rows are needed. Defaults to False.
+
+        Returns:
+            list: The AUTO_INCREMENT IDs of the rows in their order if return_ids is set, not meaningful for INSERT IGNORE.
+
+        Note:
+            This method is intended for internal use within the MySQLConnector class.
+        """
+        table = query.split("INTO", 1)[1].split()[0]
+        ids = []
+        for idx in range(0, len(rows), config.MYSQL_BATCH_SIZE):
+            batch = rows[idx:idx+config.MYSQL_BATCH_SIZE]
+            with profiler.span("insert", table=table, rows=len(batch)):
+                if return_ids and self.id_step is None:
+                    for row in batch:
+                        self.cursor.execute(query, row)
+                        ids.append(self.cursor.lastrowid)
+                    continue
+                self.cursor.executemany(query, batch)
+            if return_ids:
+                ids.extend(range(self.cursor.lastrowid, self.cursor.lastrowid + len(batch) * self.id_step, self.id_step))
+        return ids
+
+    def __get_id_step(self):
+        """
+        Checks whether the rows of a multi-row INSERT get consecutive AUTO_INCREMENT IDs. Under
+        innodb_autoinc_lock_mode 2, the default since MySQL 8.0, concurrent inserts may interleave their IDs.
+
+        Returns:
+            int or None: The auto_increment_increment, None if the IDs of a statement may not be consecutive.
+
+        Note:
+            This method is intended for internal use within the MySQLConnector class.
+        """
+        try:
+            self.cursor.execute("SELECT @@auto_increment_increment AS increment, @@innodb_autoinc_lock_mode AS lock_mode")
+            row = self.cursor.fetchall()[0]
+        except DatabaseError as err:
+            self.log.warning("Could not check the AUTO_INCREMENT settings, inserting rows with needed IDs one by one")
+            self.log.debug("Error details: ", exc_info=err)
+            return None
+        if int(row["lock_mode"]) not in (0, 1):
+            self.log.info("innodb_autoinc_lock_mode is {}, inserting rows with needed IDs one by one. Set it to 1 "
+                          "for multi-row inserts of forums, subforums and detailed users".format(row["lock_mode"]))
+            return None
+        return int(row["increment"])
 
     def __clean_detailed_user(self, data):
         """
@@ -408,6 +921,42 @@ class MySQLConnector():
         self.cursor.execute(query)
         return self.cursor.fetchall()
 
+    def get_latest_forum_snapshot(self):
+        """
+        Retrieves the forums, subforums and posts stored by the latest forum crawl.
+
+        Returns:
+            tuple: Three lists of dictionaries containing the forum, subforum and post rows.
+
+        Example:
+            connector = MySQLConnector()
+            forums, subforums, posts = connector.get_latest_forum_snapshot()
+        """
+        run_id = self.get_latest_run("forums")
+        if run_id is None:
+            return [], [], []
+        snapshot = []
+        for table in ("forums", "subforums", "posts"):
+            self.cursor.execute(f"SELECT * FROM {table} WHERE run_id = %s", (run_id,))
+            snapshot.append(self.cursor.fetchall())
+        return tuple(snapshot)
+
+    def get_topics(self):
+        """
+        Retrieves the topics of the latest forum crawl and how far their messages are stored.
+
+        Returns:
+            list: A list of dictionaries with the link, replies_count and the stored messages of every topic.
+
+        Example:
+            connector = MySQLConnector()
+            topics = connector.get_topics()
+        """
+        self.cursor.execute("SELECT latest.link, latest.replies_count, COALESCE(progress.messages, 0) AS stored "
+                            "FROM (SELECT link, MAX(replies_count) AS replies_count FROM posts_latest GROUP BY link) AS latest "
+                            "LEFT JOIN topic_progress AS progress ON progress.topic_link = latest.link")
+        return self.cursor.fetchall()
+
     def get_all_forums(self):
         """
         Retrieves all forums from the database.
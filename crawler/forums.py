@@ -1,23 +1,161 @@
 # Copyright (C) 2023 Martin Pretz
 
+import config
 import requests
-from lxml import html
+import profiler
+from lxml import etree, html
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, urlunparse, parse_qs, parse_qsl, urlencode
 from datetime import datetime, timedelta
 from helper import Helper
 from database import MySQLConnector
+from transport import Transport
+from metrics import CrawlMetrics
+
+# The values of an 'info-*' item of a row: the number in <strong>, or the last post's time and author
+INFO_VALUE = etree.XPath("strong")
+LAST_POST_TIME = etree.XPath("strong/a")
+LAST_POST_AUTHOR = etree.XPath("cite")
+
+class RowExtractor():
+    """
+    Extracts the fields of the rows of a forum listing with XPath expressions compiled once.
+
+    Every row of the index, a subforum list or a topic list is a div holding a link in its heading and a list
+    of 'info-*' items (topics, posts, replies, views, last post). The info items of a row are collected in a
+    single pass, their values are then read from the children of each item.
+
+    Example:
+        for row in TOPIC_ROWS.rows(tree):
+            fields = TOPIC_ROWS.extract(row)
+    """
+    def __init__(self, rows, anchor, info, title=None, author=None, info_items=".//ul/li"):
+        """
+        Args:
+            rows (str): Selects the rows of a page.
+            anchor (str): Selects the heading link of a row, the link's href is the row's link.
+            info (dict): Maps the class of each required info item to its field, 'info-lastpost' yields
+                the fields 'last_post_time' and 'last_post_author'.
+            title (str, optional): Selects the title relative to the anchor. Defaults to the anchor itself.
+            author (str, optional): Selects the author of a row. Defaults to None.
+            info_items (str, optional): Selects the info items of a row. Defaults to ".//ul/li".
+        """
+        self.rows = etree.XPath(rows)
+        self.anchor = etree.XPath(anchor)
+        self.title = etree.XPath(title) if title else None
+        self.author = etree.XPath(author) if author else None
+        self.info_items = etree.XPath(info_items)
+        self.info = info
+
+    def extract(self, row):
+        """
+        Args:
+            row (lxml.html.HtmlElement): A row selected by rows()
+
+        Raises:
+            IndexError: If a field is missing in the row.
+
+        Returns:
+            dict: The raw text of each field of the row
+        """
+        anchor = self.anchor(row)[0]
+        link = anchor.get("href")
+        if link is None:
+            raise IndexError("Heading link without href")
+        fields = {
+            "title": (self.title(anchor)[0] if self.title else anchor).text_content(),
+            "link": link
+        }
+        if self.author:
+            fields["author"] = self.author(row)[0].text_content()
+        items = {}
+        for item in self.info_items(row):
+            items.setdefault(item.get("class"), item)
+        for item_class, field in self.info.items():
+            if item_class not in items:
+                raise IndexError("Missing info item '{}'".format(item_class))
+            item = items[item_class]
+            if item_class == "info-lastpost":
+                fields["last_post_time"] = LAST_POST_TIME(item)[0].text_content()
+                fields["last_post_author"] = LAST_POST_AUTHOR(item)[0].text_content()
+            else:
+                fields[field] = INFO_VALUE(item)[0].text_content()
+        return fields
+
+# Forums on the index page
+FORUM_ROWS = RowExtractor(
+    rows='//div[contains(@class, "main-item")]',
+    anchor='.//div[@class="item-subject"]/h3/a',
+    title="span",
+    info={"info-topics": "topics_count", "info-posts": "posts_count", "info-lastpost": None},
+    info_items=".//li"
+)
+# Subforums listed on a forum page
+SUBFORUM_ROWS = RowExtractor(
+    rows='//div[contains(@class, "vf-subforum")]',
+    anchor=".//div/h3/a",
+    info={"info-topics": "topics_count", "info-posts": "posts_count", "info-lastpost": None}
+)
+# Topics listed on a forum or subforum page
+TOPIC_ROWS = RowExtractor(
+    rows="//div[contains(@class, 'main-item')]",
+    anchor=".//div/h3/a",
+    author=".//p/span/cite",
+    info={"info-replies": "replies_count", "info-views": "views_count", "info-lastpost": None}
+)
+# A forum page listing topics instead of subforums
+TOPIC_LIST = etree.XPath('//div[contains(@class, "forum-views")]')
+LAST_PAGE_LINK = etree.XPath('//link[@rel="last"]/@href')
+PAGING_NUMBERS = etree.XPath('//*[contains(@class, "paging")]//a/text()')
+
+def get_page_count(tree):
+    """
+    Determines the number of pages of a paginated topic list or topic from its first page.
+
+    Args:
+        tree (ElementTree): The parsed HTML tree of the first page.
+
+    Returns:
+        int: The number of pages, 1 if the page is not paginated.
+    """
+    last_links = LAST_PAGE_LINK(tree)
+    if last_links:
+        page = parse_qs(urlparse(last_links[0]).query).get("p")
+        if page and page[0].isdigit():
+            return int(page[0])
+    # No link to the last page in the header, fall back to the highest page number in the paging bar
+    page_numbers = [int(number) for number in PAGING_NUMBERS(tree)
+                    if number.strip().isdigit()]
+    return max(page_numbers + [1])
+
+def page_link(link, page):
+    """
+    Builds the link of a given page of a topic list or topic.
+
+    Example:
+        link = page_link("http://example.onion/viewforum.php?id=3", 2)
+    """
+    parts = urlparse(link)
+    query = [(key, value) for key, value in parse_qsl(parts.query) if key != "p"] + [("p", str(page))]
+    return urlunparse(parts._replace(query=urlencode(query)))
 
 class Forums():
     
-    def __init__(self, base_link, cookie, helper: Helper, db: MySQLConnector):
+    def __init__(self, base_link, cookie, helper: Helper, db: MySQLConnector, transport: Transport = None):
+        self.helper = helper
         self.log = helper.log
         self.db = db
         self.base_link = base_link
         self.log.debug("Forum crawler base link: {}".format(self.base_link))
         self.log.debug("Forum crawler cookie: {}".format(cookie))
 
-        self.session = requests.session()
-        self.session.proxies = {'http':  'socks5h://127.0.0.1:9050', 'https': 'socks5h://127.0.0.1:9050'}
-        self.session.cookies.update({'PHPSESSID': cookie})
+        # Pooled keep-alive session, shared with other crawlers if given
+        self.transport = transport if transport else Transport(helper)
+        self.transport.set_cookie(cookie)
+        # Requests, parse and database time of the current crawl
+        self.metrics = CrawlMetrics(helper, "forums")
+        # Forums, subforums and topic list pages left out of the current crawl because they could not be retrieved
+        self.dropped = []
         
     def get_forum_info(self, crawling_date, tree=None, html_content=None):
         """
@@ -37,21 +175,20 @@ class Forums():
         self.log.debug("Started extracting forum information")
         if html_content:
             tree = html.fromstring(html_content)
-        div_elements = tree.xpath('//div[contains(@class, "main-item")]')
+        div_elements = FORUM_ROWS.rows(tree)
 
         result_divs = []
         for idx, div in enumerate(div_elements):
             self.log.debug("Extracting forum information [{} of {}]"
                            .format(idx+1, len(div_elements)))
             try:
-                forum_description = div.xpath('.//div[@class="item-subject"]/h3/a/span')[0].text_content()
-                forum_link = div.xpath('.//div[@class="item-subject"]/h3/a/@href')[0]
-                topics_count = div.xpath('.//li[@class="info-topics"]/strong')[0].text_content()
-                posts_count = div.xpath('.//li[@class="info-posts"]/strong')[0].text_content()
-                last_post_time = self.__convert_relative_date(
-                    div.xpath('.//li[@class="info-lastpost"]/strong/a')[0].text_content()
-                )
-                last_post_author = div.xpath('.//li[@class="info-lastpost"]/cite')[0].text_content()
+                fields = FORUM_ROWS.extract(div)
+                forum_description = fields["title"]
+                forum_link = fields["link"]
+                topics_count = fields["topics_count"]
+                posts_count = fields["posts_count"]
+                last_post_time = self.__convert_relative_date(fields["last_post_time"])
+                last_post_author = fields["last_post_author"]
 
                 self.log.debug("Successfully extracted information of forum: {}".format(forum_link))
             except IndexError as err:
@@ -90,21 +227,20 @@ class Forums():
         self.log.debug("Started extracting subforum information")
         if html_content:
             tree = html.fromstring(html_content)
-        subforum_elements = tree.xpath('//div[contains(@class, "vf-subforum")]')
+        subforum_elements = SUBFORUM_ROWS.rows(tree)
         
         subforum_info_list = []
         for idx, subforum in enumerate(subforum_elements):
             self.log.debug("Extracting subforum information [{} of {}]"
                            .format(idx+1, len(subforum_elements)))
             try:
-                subforum_name = subforum.xpath('.//div/h3/a')[0].text_content()
-                subforum_link = subforum.xpath('.//div/h3/a/@href')[0]
-                topics_count = subforum.xpath('.//ul/li[@class="info-topics"]/strong')[0].text_content()
-                posts_count = subforum.xpath('.//ul/li[@class="info-posts"]/strong')[0].text_content()
-                last_post_time = self.__convert_relative_date(
-                    subforum.xpath('.//ul/li[@class="info-lastpost"]/strong/a')[0].text_content()
-                )
-                last_post_author = subforum.xpath('.//ul/li[@class="info-lastpost"]/cite')[0].text_content()
+                fields = SUBFORUM_ROWS.extract(subforum)
+                subforum_name = fields["title"]
+                subforum_link = fields["link"]
+                topics_count = fields["topics_count"]
+                posts_count = fields["posts_count"]
+                last_post_time = self.__convert_relative_date(fields["last_post_time"])
+                last_post_author = fields["last_post_author"]
             except IndexError as err:
                 self.log.error("Could not extract forum information")
                 self.log.debug("Error details: ", exc_info=err)
@@ -141,7 +277,7 @@ class Forums():
         self.log.debug("Started extracting post information")
         if html_content:
             tree = html.fromstring(html_content)
-        post_elements = tree.xpath("//div[contains(@class, 'main-item')]")
+        post_elements = TOPIC_ROWS.rows(tree)
 
         posts = []
         for idx, post_element in enumerate(post_elements):
@@ -151,15 +287,14 @@ class Forums():
                 self.log.debug("Sipping posts because it does no longer exists")
                 continue
             try:
-                post_title = post_element.xpath(".//div/h3/a")[0].text_content()
-                post_link = post_element.xpath(".//div/h3/a/@href")[0]
-                author = post_element.xpath(".//p/span/cite")[0].text_content()
-                replies_count = post_element.xpath(".//ul/li[@class='info-replies']/strong")[0].text_content()
-                views_count = post_element.xpath(".//ul/li[@class='info-views']/strong")[0].text_content()
-                last_post_time = self.__convert_relative_date(
-                    post_element.xpath(".//ul/li[@class='info-lastpost']/strong/a")[0].text_content()
-                )
-                last_post_author = post_element.xpath(".//ul/li[@class='info-lastpost']/cite")[0].text_content()
+                fields = TOPIC_ROWS.extract(post_element)
+                post_title = fields["title"]
+                post_link = fields["link"]
+                author = fields["author"]
+                replies_count = fields["replies_count"]
+                views_count = fields["views_count"]
+                last_post_time = self.__convert_relative_date(fields["last_post_time"])
+                last_post_author = fields["last_post_author"]
 
                 self.log.debug("Successfully extracted information of post: {}".format(post_link))
             except IndexError as err:
@@ -181,12 +316,29 @@ class Forums():
 
         return posts
     
-    def crawl_forums(self, auto_push_db=False):
+    def crawl_forums(self, auto_push_db=False, incremental=False, crawling_date=None):
         """
         Crawls forums to extract forum, subforum, and post information.
 
+        The forum tree is walked level by level: first all forum pages, then all subforum pages.
+        Each level is fetched concurrently with at most config.CRAWLER_MAX_WORKERS requests in flight
+        on the shared session, the results are assembled in the original order.
+
+        In incremental mode forums and subforums whose topics count, posts count and last post time
+        equal the latest stored crawl are not fetched again. Their subforums and posts are copied
+        forward from that crawl, so every crawl still holds a complete snapshot.
+
+        Forums, subforums and topic list pages that can not be retrieved are left out of the crawl. A crawl
+        with such gaps is stored, but its run is not finished, so the latest snapshot (<table>_latest) and the
+        comparison of the next crawl stay on the latest complete crawl.
+
+        The requests, parse and database time of the crawl are measured in a CrawlMetrics and,
+        with auto_push_db, stored in the crawl_metrics table.
+
         Args:
             auto_push_db (bool, optional): Indicates whether to automatically push data to the database.
+            incremental (bool, optional): Only re-fetch forums and subforums that changed since the latest stored crawl.
+            crawling_date (str, optional): The crawling date stored with all rows, e.g. of an archived crawl. Defaults to now.
 
         Returns:
             list or None: A list of dictionaries containing extracted forum, subforum, and post information.
@@ -196,36 +348,364 @@ class Forums():
             forum_data = scraper.crawl_forums(auto_push_db=True)
         """
         self.log.info("Started crawling the forums")
+        crawling_date = crawling_date or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.metrics = CrawlMetrics(self.helper, "forums")
+        self.dropped = []
+        self.metrics.attach(self.transport)
+        if auto_push_db:
+            self.db.track_metrics(self.metrics)
+        forum_data = None
+        stored = False
+        try:
+            forum_data = self.__crawl(incremental, crawling_date)
+            if forum_data is not None:
+                self.transport.log_stats()
+                if self.dropped:
+                    self.log.warning("{} forums, subforums or topic list pages could not be retrieved, the crawl "
+                                     "does not replace the latest snapshot".format(len(self.dropped)))
+                stored = self.db.load_forums(forum_data, finish=not self.dropped) if auto_push_db else True
+        finally:
+            self.metrics.detach(self.transport)
+            # Failed and crashed crawls are stored too, their crawl stage counts as an error
+            self.metrics.stop(sum(1 + len(forum.get("posts", [])) + sum(1 + len(subforum.get("posts", []))
+                                                                     for subforum in forum.get("subforums", []))
+                                  for forum in forum_data or []), error=not stored or bool(self.dropped))
+            self.metrics.log_stats()
+            if auto_push_db:
+                self.db.load_metrics(self.metrics, crawling_date)
+        return forum_data
+
+    def __crawl(self, incremental, crawling_date):
+        """
+        Crawls the forum tree level by level, see crawl_forums().
+
+        Returns:
+            list or None: The forum dictionaries including their subforums and posts, None if the crawl failed.
+
+        Note:
+            This method is intended for internal use within the ForumScraper class.
+        """
         html_content = self.__request_onion_sites()
         if not html_content:
             return None
-        crawling_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        self.forum_data = self.get_forum_info(crawling_date, html_content=html_content.text)
-        for idx_forums, forum in enumerate(self.forum_data):
-            self.log.info("[{}/{}] Processing forum...".format(idx_forums+1, len(self.forum_data)))
-            self.log.debug("Processing forum: {}".format(forum["link"]))
-            forum_html_content = self.__request_onion_sites(forum["link"])
-            forum_tree = html.fromstring(forum_html_content.text)
-            if forum_tree.xpath('//div[contains(@class, "vf-subforum")]'):
-                subforums = self.get_subforum_info(crawling_date, tree=forum_tree)
-                for idx_subforum, subforum in enumerate(subforums):
-                    self.log.debug("[{}/{}] Processing subforum: {}"
-                                   .format(idx_subforum+1, len(subforums), subforum["link"]))
-                    subforum_html_content = self.__request_onion_sites(subforum["link"])
-                    posts = self.get_posts_info(crawling_date, html_content=subforum_html_content.text)
-                    subforums[idx_subforum]["posts"] = posts
-                self.forum_data[idx_forums]["subforums"] = subforums
-            elif forum_tree.xpath('//div[contains(@class, "forum-views")]'):
-                self.log.debug("Forums does not contain subforums")
-                posts = self.get_posts_info(crawling_date, tree=forum_tree)
-                self.forum_data[idx_forums]["posts"] = posts
-            else:
-                self.log.error("No matching HTML structure found. Provided HTML is neither post view forum nor subforum")
-                return None
-        if auto_push_db:
-            self.db.load_forums(self.forum_data)
+        with self.metrics.timed("parse", url=self.base_link, page_type="index"):
+            self.forum_data = self.get_forum_info(crawling_date, html_content=html_content.text)
+        previous = self.__load_previous_snapshot() if incremental else None
+        # Every forum or subforum listing topics, together with its number of pages
+        topic_lists = []
+        with ThreadPoolExecutor(max_workers=config.CRAWLER_MAX_WORKERS) as executor:
+            # First level: all forum pages
+            changed_forums = []
+            for forum in self.forum_data:
+                previous_forum = previous["forums"].get(forum["link"]) if previous else None
+                if previous_forum and self.__is_unchanged(forum, previous_forum):
+                    self.__copy_forward_forum(forum, previous_forum, previous, crawling_date)
+                else:
+                    changed_forums.append((forum, previous_forum))
+            self.log.info("Fetching {} forums".format(len(changed_forums)))
+            forum_responses = self.__fetch_all(executor, [forum["link"] for forum, _ in changed_forums])
+            pending_subforums = []
+            for idx_forums, ((forum, previous_forum), forum_html_content) in enumerate(zip(changed_forums, forum_responses)):
+                self.log.info("[{}/{}] Processing forum...".format(idx_forums+1, len(changed_forums)))
+                self.log.debug("Processing forum: {}".format(forum["link"]))
+                if not forum_html_content:
+                    # Left out instead of stored without its topics, the next incremental crawl fetches it again
+                    self.log.error("Could not retrieve forum, leaving it out of this crawl: {}".format(forum["link"]))
+                    self.forum_data.remove(forum)
+                    self.dropped.append(forum["link"])
+                    continue
+                with self.metrics.timed("parse", url=forum["link"], page_type="forum"):
+                    forum_tree = html.fromstring(forum_html_content.text)
+                    if SUBFORUM_ROWS.rows(forum_tree):
+                        page_type = "subforums"
+                        subforums = self.get_subforum_info(crawling_date, tree=forum_tree)
+                    elif TOPIC_LIST(forum_tree):
+                        page_type = "topics"
+                        posts = self.get_posts_info(crawling_date, tree=forum_tree)
+                        page_count = self.get_page_count(forum_tree)
+                    else:
+                        page_type = None
+                if page_type == "subforums":
+                    previous_subforums = {}
+                    if previous_forum:
+                        previous_subforums = {row["link"]: row for row in previous["subforums"].get(previous_forum["forum_id"], [])}
+                    for subforum in subforums:
+                        previous_subforum = previous_subforums.get(subforum["link"])
+                        if previous_subforum and self.__is_unchanged(subforum, previous_subforum):
+                            subforum["posts"] = self.__copy_forward_posts(
+                                previous["posts"].get(("subforum", previous_subforum["subforum_id"]), []), crawling_date)
+                        else:
+                            pending_subforums.append((forum, subforum))
+                    forum["subforums"] = subforums
+                elif page_type == "topics":
+                    self.log.debug("Forums does not contain subforums")
+                    forum["posts"] = posts
+                    topic_lists.append((forum, page_count))
+                else:
+                    self.log.error("No matching HTML structure found. Provided HTML is neither post view forum nor subforum")
+                    return None
+
+            # Second level: all subforum pages of all forums
+            self.log.info("Fetching {} subforums".format(len(pending_subforums)))
+            subforum_responses = self.__fetch_all(executor, [subforum["link"] for _, subforum in pending_subforums])
+            for idx_subforum, ((forum, subforum), subforum_html_content) in enumerate(zip(pending_subforums, subforum_responses)):
+                self.log.debug("[{}/{}] Processing subforum: {}"
+                               .format(idx_subforum+1, len(pending_subforums), subforum["link"]))
+                if not subforum_html_content:
+                    self.log.error("Could not retrieve subforum, leaving it out of this crawl: {}".format(subforum["link"]))
+                    forum["subforums"].remove(subforum)
+                    self.dropped.append(subforum["link"])
+                    continue
+                subforum["posts"], page_count = self.__parse_topic_list(subforum["link"], subforum_html_content, crawling_date)
+                topic_lists.append((subforum, page_count))
+
+            # Third level: the later pages of every topic list
+            if config.CRAWLER_TOPIC_PAGINATION:
+                if previous is None and self.db:
+                    previous = self.__load_previous_snapshot()
+                self.__crawl_topic_pages(executor, topic_lists, previous, crawling_date)
         return self.forum_data
-    
+
+    def get_page_count(self, tree):
+        """
+        Determines the number of pages of a paginated topic list from its first page.
+
+        Args:
+            tree (ElementTree): The parsed HTML tree of the first page.
+
+        Returns:
+            int: The number of pages, 1 if the list is not paginated.
+
+        Example:
+            scraper = ForumScraper()
+            page_count = scraper.get_page_count(html.fromstring(forum_page_content))
+        """
+        return get_page_count(tree)
+
+    def __crawl_topic_pages(self, executor, topic_lists, previous, crawling_date):
+        """
+        Fetches the later pages of every topic list and appends their posts to the list's posts.
+
+        All lists are paged through at the same time, every round fetches the next
+        config.CRAWLER_TOPIC_PAGE_WINDOW pages of each list concurrently. A list stops as soon as
+        one of its pages only contains topics that were already recorded unchanged by the latest crawl,
+        since topics are ordered by their last post. The topics of the pages after it are copied forward
+        from that crawl, so the list stays complete.
+
+        Args:
+            executor (ThreadPoolExecutor): The executor the pages are fetched with.
+            topic_lists (list): Tuples of the forum/subforum dictionary and its number of pages.
+            previous (dict or None): The latest stored crawl, see __load_previous_snapshot(). None without database.
+            crawling_date (str): The crawling date of the current crawl.
+
+        Note:
+            This method is intended for internal use within the ForumScraper class.
+        """
+        previous_posts = self.__previous_posts_by_list(previous) if previous else {}
+        known_posts = {(row["link"], str(row["last_post_time"])) for rows in previous_posts.values() for row in rows}
+        # Next page to fetch of every topic list that still needs to be paged through
+        next_pages = {}
+        for idx, (topic_list, page_count) in enumerate(topic_lists):
+            if page_count == 1:
+                continue
+            if self.__only_known_posts(topic_list["posts"], known_posts):
+                self.__copy_forward_tail(topic_list, previous_posts, crawling_date)
+            else:
+                next_pages[idx] = 2
+        self.log.info("Fetching later pages of {} topic lists".format(len(next_pages)))
+        while next_pages:
+            batch = []
+            for idx, next_page in next_pages.items():
+                last_page = min(next_page + config.CRAWLER_TOPIC_PAGE_WINDOW, topic_lists[idx][1] + 1)
+                batch.extend((idx, page) for page in range(next_page, last_page))
+                next_pages[idx] = last_page
+            links = [page_link(topic_lists[idx][0]["link"], page) for idx, page in batch]
+            responses = self.__fetch_all(executor, links)
+            for (idx, page), link, response in zip(batch, links, responses):
+                topic_list, page_count = topic_lists[idx]
+                if idx not in next_pages:
+                    continue
+                if not response:
+                    self.log.error("Could not retrieve page {} of {}".format(page, topic_list["link"]))
+                    self.dropped.append(link)
+                    del next_pages[idx]
+                    continue
+                posts, _ = self.__parse_topic_list(link, response, crawling_date)
+                topic_list["posts"].extend(posts)
+                if self.__only_known_posts(posts, known_posts):
+                    self.log.debug("Reached already recorded topics on page {} of {}".format(page, topic_list["link"]))
+                    self.__copy_forward_tail(topic_list, previous_posts, crawling_date)
+                    del next_pages[idx]
+                elif page == page_count:
+                    del next_pages[idx]
+
+    def __fetch_all(self, executor, links):
+        """
+        Fetches pages concurrently. Pages that still failed after their retries are put on a dead-letter list
+        and fetched once more after all other pages, when a flaky circuit or overloaded service may have recovered.
+
+        Args:
+            executor (ThreadPoolExecutor): The executor the pages are fetched with.
+            links (list): The URLs to fetch.
+
+        Returns:
+            list: The responses in the order of the links, None for pages that could not be retrieved.
+
+        Note:
+            This method is intended for internal use within the ForumScraper class.
+        """
+        responses = list(executor.map(self.__request_onion_sites, links))
+        dead_letters = [idx for idx, response in enumerate(responses) if response is None]
+        if dead_letters:
+            self.log.warning("Retrying {} failed pages after all others".format(len(dead_letters)))
+            for idx, response in zip(dead_letters, executor.map(self.__request_onion_sites,
+                                                                [links[idx] for idx in dead_letters])):
+                responses[idx] = response
+        return responses
+
+    def __parse_topic_list(self, link, response, crawling_date):
+        """
+        Extracts the posts and the number of pages of a topic list page.
+        If the body is unchanged since it was parsed earlier today, the cached result is reused.
+
+        Returns:
+            tuple: The list of post dictionaries and the number of pages of the topic list.
+
+        Note:
+            This method is intended for internal use within the ForumScraper class.
+        """
+        cache = self.transport.cache
+        parsed = cache.get_parsed(link, response) if cache else None
+        if parsed:
+            posts, page_count = parsed
+            for post in posts:
+                post["crawling_date"] = crawling_date
+            return posts, page_count
+        with self.metrics.timed("parse", url=link, page_type="topics"):
+            tree = html.fromstring(response.text)
+            posts = self.get_posts_info(crawling_date, tree=tree)
+            page_count = self.get_page_count(tree)
+        if cache:
+            cache.set_parsed(link, response, [posts, page_count])
+        return posts, page_count
+
+    def __only_known_posts(self, posts, known_posts):
+        """
+        Checks whether all posts were already recorded with the same last post time by the latest crawl.
+        A page without posts is not known, it says nothing about the pages after it.
+
+        Note:
+            This method is intended for internal use within the ForumScraper class.
+        """
+        return bool(posts) and all((post["link"], post["last_post_time"]) in known_posts for post in posts)
+
+    def __previous_posts_by_list(self, previous):
+        """
+        Returns:
+            dict: The post rows of the latest stored crawl by the link of their forum or subforum.
+
+        Note:
+            This method is intended for internal use within the ForumScraper class.
+        """
+        posts = {}
+        for forum in previous["forums"].values():
+            posts[forum["link"]] = previous["posts"].get(("forum", forum["forum_id"]), [])
+            for subforum in previous["subforums"].get(forum["forum_id"], []):
+                posts[subforum["link"]] = previous["posts"].get(("subforum", subforum["subforum_id"]), [])
+        return posts
+
+    def __copy_forward_tail(self, topic_list, previous_posts, crawling_date):
+        """
+        Completes a topic list that stopped at already recorded topics with the topics of the latest stored crawl
+        that are not on its fetched pages.
+
+        Note:
+            This method is intended for internal use within the ForumScraper class.
+        """
+        fetched = {post["link"] for post in topic_list["posts"]}
+        tail = [row for row in previous_posts.get(topic_list["link"], []) if row["link"] not in fetched]
+        self.log.debug("Copying forward {} topics of {}".format(len(tail), topic_list["link"]))
+        topic_list["posts"].extend(self.__copy_forward_posts(tail, crawling_date))
+
+    def __load_previous_snapshot(self):
+        """
+        Loads the latest stored crawl, grouped for the incremental comparison and the topic lists copied forward.
+
+        Returns:
+            dict: Forums by link, subforums by forum ID and posts by ("forum"/"subforum", ID).
+
+        Note:
+            This method is intended for internal use within the ForumScraper class.
+        """
+        forums, subforums, posts = self.db.get_latest_forum_snapshot()
+        self.log.info("Comparing against {} forums, {} subforums and {} posts of the latest crawl"
+                      .format(len(forums), len(subforums), len(posts)))
+        previous = {"forums": {row["link"]: row for row in forums}, "subforums": {}, "posts": {}}
+        for row in subforums:
+            previous["subforums"].setdefault(row["forum_id"], []).append(row)
+        for row in posts:
+            parent = ("subforum", row["subforum_id"]) if row["subforum_id"] else ("forum", row["forum_id"])
+            previous["posts"].setdefault(parent, []).append(row)
+        return previous
+
+    def __is_unchanged(self, element, previous_row):
+        """
+        Compares the index statistics of a forum or subforum with its row of the latest stored crawl.
+
+        Note:
+            This method is intended for internal use within the ForumScraper class.
+        """
+        return all(
+            str(element[key]).replace(",", "") == str(previous_row[key])
+            for key in ("topics_count", "posts_count", "last_post_time")
+        )
+
+    def __copy_forward_forum(self, forum, previous_forum, previous, crawling_date):
+        """
+        Fills an unchanged forum with the subforums and posts of the latest stored crawl.
+
+        Note:
+            This method is intended for internal use within the ForumScraper class.
+        """
+        self.log.debug("Forum unchanged, copying forward: {}".format(forum["link"]))
+        previous_subforums = previous["subforums"].get(previous_forum["forum_id"])
+        if previous_subforums:
+            forum["subforums"] = []
+            for row in previous_subforums:
+                subforum = {
+                    "element_type": row["element_type"],
+                    "crawling_date": crawling_date,
+                    "title": row["title"],
+                    "link": row["link"],
+                    "topics_count": str(row["topics_count"]),
+                    "posts_count": str(row["posts_count"]),
+                    "last_post_time": str(row["last_post_time"]),
+                    "last_post_author": row["last_post_author"]
+                }
+                subforum["posts"] = self.__copy_forward_posts(previous["posts"].get(("subforum", row["subforum_id"]), []), crawling_date)
+                forum["subforums"].append(subforum)
+        else:
+            forum["posts"] = self.__copy_forward_posts(previous["posts"].get(("forum", previous_forum["forum_id"]), []), crawling_date)
+
+    def __copy_forward_posts(self, rows, crawling_date):
+        """
+        Turns post rows of the latest stored crawl into post dictionaries of the current crawl.
+
+        Note:
+            This method is intended for internal use within the ForumScraper class.
+        """
+        return [{
+            "element_type": row["element_type"],
+            "crawling_date": crawling_date,
+            "title": row["title"],
+            "link": row["link"],
+            "author": row["author"],
+            "replies_count": str(row["replies_count"]),
+            "views_count": str(row["views_count"]),
+            "last_post_time": str(row["last_post_time"]),
+            "last_post_author": row["last_post_author"]
+        } for row in rows]
+
     def __request_onion_sites(self, link=None):
         """
         Sends a request to an onion site and returns the response data.
@@ -244,9 +724,17 @@ class Forums():
         """
         self.log.debug("Sending request for {}"
                        .format(link if link else self.base_link))
-        data = self.session.get(link if link else self.base_link)
+        try:
+            data = self.transport.get(link if link else self.base_link)
+        except requests.RequestException as err:
+            self.metrics.record_error()
+            self.log.error("Request failed after all retries: {}".format(type(err).__name__))
+            self.log.debug("Error details: ", exc_info=err)
+            return None
         if "phishing" in data.text.lower():
             self.log.error("Received phishing mirror respose. Probably invalid cookie")
+            if self.transport.limiter:
+                self.transport.limiter.backoff("phishing mirror response")
             self.log.debug(data.text)
         elif data.status_code == 200:
             self.log.debug("Successfully received response")
@@ -272,13 +760,14 @@ class Forums():
         Example:
             converted_date = self.__convert_relative_date("heute")
         """
-        today = datetime.now().date()
-        
-        if "heute" in relative_date.lower():
-            return today.strftime("%Y-%m-%d")
-        elif "gestern" in relative_date.lower():
-            yesterday = today - timedelta(days=1)
-            return yesterday.strftime("%Y-%m-%d")
-        else:
-            parts = relative_date.split()
-            return parts[0]
\ No newline at end of file
+        with profiler.span("normalise", field="date"):
+            today = datetime.now().date()
+
+            if "heute" in relative_date.lower():
+                return today.strftime("%Y-%m-%d")
+            elif "gestern" in relative_date.lower():
+                yesterday = today - timedelta(days=1)
+                return yesterday.strftime("%Y-%m-%d")
+            else:
+                parts = relative_date.split()
+                return parts[0]
\ No newline at end of file
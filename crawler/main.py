@@ -1,45 +1,102 @@
 # Copyright (C) 2023 Xian Chen, Martin Pretz
 
 import config
+import profiler
 from forums import Forums
 from database import MySQLConnector
 from helper import Helper
+from transport import Transport, CircuitPool
+from replay import FixtureStore, FixtureRecorder
+from archive import PageArchive
+from cache import ResponseCache
+from rate_limiter import RateLimiter
+from retry import RetryPolicy
+from orchestrator import CrawlOrchestrator
+from topics import Topics
 from user_crawler import User_Detailed_Profiles, User_Profiles
 
-# Initalize needed helper methods and database
-helper = Helper(config.LOGGING_FILE_PATH)
-db = MySQLConnector(helper=helper)
-# Initiate user interaction for first cookie
-cookie = None
-helper.log.info("Please visit http://germania7zs27fu3gi76wlr5rd64cc2yjexyzvrbm4jufk7pibrpizad.onion and solve one captcha.")
-# Need for cookie
-while not cookie:
-    cookie = input("Enter the valid PHPSESSID cookie here:\n")
-    if len(cookie) < 5:
-        helper.log.warn("You entered an invalid cookie, please try again.")
-        cookie = None
-        continue
-    config.CRAWLER_COOKIE = cookie
-# Instantiate Forum crawler
-forum_scraper = Forums(
-    base_link=config.CRAWLER_BASE_LINK,
-    cookie=config.CRAWLER_COOKIE,
-    helper=helper,
-    db=db
-)
-# Crawl forums
-forum_scraper.crawl_forums(auto_push_db=True)
+def main():
+    # Initalize needed helper methods
+    helper = Helper(config.LOGGING_FILE_PATH)
+    # Profiling mode, records the time spent fetching, parsing, normalising and inserting into a trace file
+    if config.PROFILE_TRACE_PATH:
+        profiler.enable(helper, config.PROFILE_TRACE_PATH, config.PROFILE_CPROFILE_PATH)
+    # Initiate user interaction for first cookie
+    cookie = None
+    helper.log.info("Please visit http://germania7zs27fu3gi76wlr5rd64cc2yjexyzvrbm4jufk7pibrpizad.onion and solve one captcha.")
+    # Need for cookie
+    while not cookie:
+        cookie = input("Enter the valid PHPSESSID cookie here:\n")
+        if len(cookie) < 5:
+            helper.log.warn("You entered an invalid cookie, please try again.")
+            cookie = None
+            continue
+        config.CRAWLER_COOKIE = cookie
+    # One pooled session for the forum crawler, profiles and userlists are spread over several circuits
+    # Pages unchanged since the last crawl are revalidated and not parsed again
+    cache = ResponseCache(helper) if config.CRAWLER_CACHE else None
+    # All requests of both crawlers share one adaptive request rate
+    limiter = RateLimiter(helper) if config.CRAWLER_RATE_LIMIT else None
+    # Timeouts and failed requests are retried with jittered backoff, within a retry budget per URL
+    retry = RetryPolicy(helper)
+    transport = Transport(helper, cookie=config.CRAWLER_COOKIE, cache=cache, limiter=limiter, retry=retry)
+    circuits = CircuitPool(helper, cookie=config.CRAWLER_COOKIE, cache=cache, limiter=limiter, retry=retry)
+    # Optionally record all fetched pages, they can be replayed offline by benchmark.py
+    if config.CRAWLER_FIXTURE_PATH:
+        recorder = FixtureRecorder(helper, FixtureStore(config.CRAWLER_FIXTURE_PATH))
+        recorder.attach(transport)
+        recorder.attach(circuits)
+    # Keep the raw pages, they can be parsed again offline by reparse.py
+    if config.CRAWLER_ARCHIVE:
+        archive = PageArchive(helper)
+        archive.attach(transport)
+        archive.attach(circuits)
+    # Choose the user crawl up front, it runs alongside the forum crawl
+    start_page = int(input("At what page number [1,25] do we start scraping the users?\n"))-1
+    while start_page > 24 or start_page < 0:
+        start_page = int(input("The userlist has 25 pages.\nAt what page number [1,25] do you want to start scraping?\n"))-1
 
-# Then choose the page number
-start_page = int(input("At what page number [1,25] do we start scraping the users?\n"))-1
-while start_page > 24 or start_page < 0:
-    start_page = int(input("The userlist has 25 pages.\nAt what page number [1,25] do you want to start scraping?\n"))-1
+    # Ask user, whether they want in interactive long crawl for detailed information, or a general fast crawl
+    choice = int(input("Do you want to crawl the general user information (type '1') or crawl the detailed profiles additionally (type '2')?\n[Warning: Detailed crawl is an interactive crawl, could take up to hours!]\n"))
+    while choice not in (1, 2):
+        helper.log.warn("Invalid crawler chosen.")
+        choice = int(input("Type '1' for the general or '2' for the detailed user crawl.\n"))
 
-# Ask user, whether they want in interactive long crawl for detailed information, or a general fast crawl
-choice = int(input("Do you want to crawl the general user information (type '1') or crawl the detailed profiles additionally (type '2')?\n[Warning: Detailed crawl is an interactive crawl, could take up to hours!]\n"))
-if choice == 1:
-    User_Profiles(start_page, helper, db)
-elif choice == 2:
-    User_Detailed_Profiles(start_page, helper, db)
-else:
-    helper.log.warn("Invalid crawler chosen.")
+    # Both crawlers write through their own database connection
+    forum_scraper = Forums(
+        base_link=config.CRAWLER_BASE_LINK,
+        cookie=config.CRAWLER_COOKIE,
+        helper=helper,
+        db=MySQLConnector(helper=helper),
+        transport=transport
+    )
+    user_db = MySQLConnector(helper=helper)
+
+    def crawl_forums():
+        forum_scraper.crawl_forums(auto_push_db=True, incremental=config.CRAWLER_INCREMENTAL)
+        # Then the messages of the topics that got new replies
+        if config.CRAWLER_TOPIC_MESSAGES:
+            Topics(helper, forum_scraper.db, transport).crawl_topics()
+
+    if choice == 1:
+        crawl_users = lambda: User_Profiles(start_page, helper, user_db, circuits, parallel=config.CRAWLER_PARALLEL_USERLIST)
+    else:
+        crawl_users = lambda: User_Detailed_Profiles(start_page, helper, user_db, circuits)
+    # Crawl forums and users at the same time, the snapshot takes about as long as the slower crawl.
+    # The detailed crawl prompts for captchas, it runs after the forums so the prompt has the terminal to itself
+    orchestrator = CrawlOrchestrator(helper)
+    orchestrator.add_stage("forums", crawl_forums, [transport])
+    orchestrator.add_stage("users", crawl_users, [circuits])
+    orchestrator.run(concurrent=config.CRAWLER_CONCURRENT_STAGES and choice == 1)
+    if config.CRAWLER_ARCHIVE:
+        archive.log_stats()
+    if cache:
+        cache.log_stats()
+    if limiter:
+        limiter.log_stats()
+    retry.log_stats()
+    profiler.disable()
+
+# The parse workers import this module again, only the crawler process itself runs the crawl
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# Copyright (C) 2023 Martin Pretz
+
+import time
+import threading
+import profiler
+from contextlib import contextmanager
+from datetime import datetime
+from helper import Helper
+from replay import get_sessions
+
+# Stages of a crawl run, in the order they are reported and stored
+STAGES = ["crawl", "fetch", "parse", "db"]
+
+class CrawlMetrics():
+    """
+    Measures where the time of one crawl run goes, for the crawl_metrics table and the crawler health dashboard.
+
+    The stages of a run are:
+        crawl: the whole run, its operations are the records crawled.
+        fetch: every response of the crawler's transport, with latency (until the headers arrived), size,
+               status and whether it was a captcha. Requests that failed for good without a response
+               count as errors.
+        parse: every page parsed by the crawler.
+        db: every batch written by the database loaders, its operations are the rows written.
+
+    Example:
+        metrics = CrawlMetrics(helper, "forums")
+        metrics.attach(transport)
+        with metrics.timed("parse"):
+            tree = html.fromstring(response.text)
+    """
+    def __init__(self, helper: Helper, crawler):
+        """
+        Args:
+            helper (Helper): The logger
+            crawler (str): The crawler of the run, 'forums', 'users_general' or 'users_detailed'.
+        """
+        self.log = helper.log
+        self.crawler = crawler
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.recorded_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # Duration of every operation and the counters, by stage
+        self.durations = {stage: [] for stage in STAGES}
+        self.operations = dict.fromkeys(STAGES, 0)
+        self.errors = dict.fromkeys(STAGES, 0)
+        self.captchas = 0
+        self.bytes = 0
+        self.statuses = {}
+
+    def attach(self, transport):
+        """
+        Measures every response of a transport until it is detached again.
+
+        Args:
+            transport (Transport or CircuitPool): The transport of the crawler.
+        """
+        for session in get_sessions(transport):
+            session.hooks["response"].append(self.__record_response)
+
+    def detach(self, transport):
+        for session in get_sessions(transport):
+            if self.__record_response in session.hooks["response"]:
+                session.hooks["response"].remove(self.__record_response)
+
+    def record(self, stage, seconds, operations=1, error=False):
+        """
+        Args:
+            stage (str): A stage out of STAGES.
+            seconds (float): Duration of the operations.
+            operations (int, optional): Pages, rows or records the duration was spent on. Defaults to 1.
+            error (bool, optional): Whether the operations failed. Defaults to False.
+        """
+        with self.lock:
+            self.durations[stage].append(seconds)
+            self.operations[stage] += operations
+            self.errors[stage] += int(error)
+
+    def record_error(self, stage="fetch"):
+        """
+        Counts a failed operation that has no duration, e.g. a request that failed without a response.
+        """
+        with self.lock:
+            self.errors[stage] += 1
+
+    @contextmanager
+    def timed(self, stage, operations=1, **tags):
+        """
+        Records the duration of the enclosed block, also if it raises. In profiling mode the block is also
+        recorded as a span of the stage.
+
+        Args:
+            **tags: Tags of the profiling span, e.g. url or page_type.
+        """
+        start = time.perf_counter()
+        error = True
+        try:
+            with profiler.span(stage, **tags):
+                yield
+            error = False
+        finally:
+            self.record(stage, time.perf_counter() - start, operations, error)
+
+    def stop(self, records, error=False):
+        """
+        Records the duration of the whole run.
+
+        Args:
+            records (int): Number of records crawled.
+            error (bool, optional): Whether the run failed or crashed, it then counts as an error of the crawl stage.
+                Defaults to False.
+        """
+        self.record("crawl", time.perf_counter() - self.start, records, error)
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: By stage the operations, errors, captchas, bytes, total seconds and the average,
+            95th percentile and maximum duration in ms. Stages without operations are left out.
+        """
+        stats = {}
+        with self.lock:
+            for stage in STAGES:
+                durations = sorted(self.durations[stage])
+                if not durations and not self.errors[stage]:
+                    continue
+                stats[stage] = {
+                    "operations": self.operations[stage],
+                    "errors": self.errors[stage],
+                    "captchas": self.captchas if stage == "fetch" else 0,
+                    "bytes": self.bytes if stage == "fetch" else 0,
+                    "seconds": sum(durations),
+                    "avg_ms": sum(durations) / len(durations) * 1000 if durations else None,
+                    "p95_ms": durations[int(0.95 * (len(durations) - 1))] * 1000 if durations else None,
+                    "max_ms": durations[-1] * 1000 if durations else None
+                }
+        return stats
+
+    def log_stats(self):
+        for stage, stats in self.get_stats().items():
+            self.log.info("Metrics {} {}: {} operations, {} errors, {:.2f}s, {} ms average, {} ms p95".format(
+                self.crawler, stage, stats["operations"], stats["errors"], stats["seconds"],
+                "{:.0f}".format(stats["avg_ms"]) if stats["avg_ms"] is not None else "-",
+                "{:.0f}".format(stats["p95_ms"]) if stats["p95_ms"] is not None else "-"
+            ))
+        with self.lock:
+            statuses = ", ".join("{}: {}".format(status, count) for status, count in sorted(self.statuses.items()))
+            captchas, received = self.captchas, self.bytes
+        self.log.info("Metrics {} fetch: {:.1f} MB received, {} captchas, statuses {}"
+                      .format(self.crawler, received / 1024 / 1024, captchas, statuses or "-"))
+
+    def __record_response(self, response, *args, **kwargs):
+        captcha = b'name="captcha"' in response.content
+        with self.lock:
+            self.durations["fetch"].append(response.elapsed.total_seconds())
+            self.operations["fetch"] += 1
+            self.errors["fetch"] += int(response.status_code >= 400)
+            self.captchas += int(captcha)
+            self.bytes += len(response.content)
+            self.statuses[response.status_code] = self.statuses.get(response.status_code, 0) + 1
+        return response
@@ -0,0 +1,177 @@
+# Copyright (C) 2023 Xian Chen, Martin Pretz
+
+import time
+import threading
+import config
+from helper import Helper
+from replay import get_sessions
+
+class CrawlStage():
+    """
+    One crawler of a snapshot, run in its own thread. Counts the pages its transports receive.
+    """
+    def __init__(self, name, run, transports):
+        """
+        Args:
+            name (str): The stage name shown in the progress and the summary.
+            run (callable): Performs the crawl of the stage.
+            transports (list): The Transports and CircuitPools the crawl sends its requests through.
+        """
+        self.name = name
+        self.run = run
+        self.transports = transports
+        self.lock = threading.Lock()
+        self.pages = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.error = None
+        self.thread = None
+        self.start_time = None
+        # Set once the stage ended. Unlike Thread.is_alive() it stays reliable after an interrupted join()
+        self.finished = threading.Event()
+        for transport in transports:
+            for session in get_sessions(transport):
+                session.hooks["response"].append(self.__count)
+
+    def is_running(self):
+        return self.thread is not None and not self.finished.is_set()
+
+    def stop(self):
+        """
+        Stops the transports of the stage, the crawl fails its remaining requests and winds down.
+        """
+        for transport in self.transports:
+            transport.stop()
+
+    def get_progress(self):
+        """
+        Returns:
+            tuple: Pages and bytes received so far, seconds since the start of the stage.
+        """
+        with self.lock:
+            pages, received = self.pages, self.bytes
+        seconds = self.seconds if not self.is_running() else time.perf_counter() - self.start_time
+        return pages, received, seconds
+
+    def __count(self, response, *args, **kwargs):
+        with self.lock:
+            self.pages += 1
+            self.bytes += len(response.content)
+        return response
+
+class CrawlOrchestrator():
+    """
+    Runs the stages of a snapshot (the forum crawl and the user crawl) concurrently.
+
+    The stages share no data and spend most of their time waiting on Tor, so a snapshot takes about as
+    long as its slowest stage. Every stage brings its own sessions and database connection. While the
+    stages run, their progress is logged together, and a summary of all stages is logged at the end.
+    On an interrupt (Ctrl+C) the transports of all stages are stopped and the stages are waited for, so
+    they store what they crawled so far. A second interrupt ends the snapshot right away.
+
+    Example:
+        orchestrator = CrawlOrchestrator(helper)
+        orchestrator.add_stage("forums", forum_scraper.crawl_forums, [transport])
+        orchestrator.add_stage("users", lambda: User_Profiles(0, helper, db, circuits), [circuits])
+        orchestrator.run()
+    """
+    def __init__(self, helper: Helper, progress_interval=config.CRAWLER_PROGRESS_INTERVAL):
+        """
+        Args:
+            helper (Helper): The logger
+            progress_interval (float, optional): Seconds between two progress reports. Defaults to config.CRAWLER_PROGRESS_INTERVAL.
+        """
+        self.log = helper.log
+        self.progress_interval = progress_interval
+        self.stages = []
+
+    def add_stage(self, name, run, transports=()):
+        """
+        Args:
+            name (str): The stage name shown in the progress and the summary.
+            run (callable): Performs the crawl of the stage.
+            transports (list, optional): The Transports and CircuitPools of the stage, their pages are counted. Defaults to ().
+        """
+        self.stages.append(CrawlStage(name, run, transports))
+
+    def run(self, concurrent=True):
+        """
+        Runs all stages and logs the summary.
+
+        Args:
+            concurrent (bool, optional): Run the stages at the same time, otherwise one after another. Defaults to True.
+
+        Returns:
+            bool: True if all stages finished without an error and without an interrupt.
+        """
+        start = time.perf_counter()
+        interrupted = False
+        if concurrent:
+            for stage in self.stages:
+                # Daemon threads, so a second interrupt ends the process even while a stage is still running
+                stage.thread = threading.Thread(target=self.__run_stage, args=(stage,), name=stage.name, daemon=True)
+                stage.start_time = time.perf_counter()
+                stage.thread.start()
+            running = self.stages
+            try:
+                while running:
+                    # Returns early when the stage finishes, the progress then shows it as done
+                    running[0].finished.wait(self.progress_interval)
+                    running = [stage for stage in self.stages if stage.is_running()]
+                    if running:
+                        self.log_progress()
+            except KeyboardInterrupt:
+                interrupted = True
+                self.log.warning("Interrupted, stopping the stages. Interrupt again to quit right away")
+                for stage in running:
+                    stage.stop()
+                for stage in running:
+                    stage.finished.wait()
+                    stage.error = stage.error or "interrupted"
+        else:
+            for stage in self.stages:
+                stage.start_time = time.perf_counter()
+                try:
+                    self.__run_stage(stage)
+                # The stage ran in this thread, it wound down while the interrupt passed through it
+                except KeyboardInterrupt:
+                    interrupted = True
+                    stage.error = "interrupted"
+                    self.log.warning("Interrupted, the remaining stages are skipped")
+                    break
+        self.log_summary(time.perf_counter() - start)
+        return not interrupted and not any(stage.error for stage in self.stages)
+
+    def log_progress(self):
+        self.log.info("Progress: " + ", ".join(
+            "{} {} pages in {:.0f}s{}".format(stage.name, pages, seconds, "" if stage.is_running() else " (done)")
+            for stage, (pages, _, seconds) in ((stage, stage.get_progress()) for stage in self.stages)
+        ))
+
+    def log_summary(self, seconds):
+        """
+        Args:
+            seconds (float): Wall-clock time of the whole snapshot.
+        """
+        self.log.info("Snapshot finished in {:.0f}s, its stages took {:.0f}s together"
+                      .format(seconds, sum(stage.seconds for stage in self.stages)))
+        for stage in self.stages:
+            pages, received, stage_seconds = stage.get_progress()
+            self.log.info("  {:<8} {:>6} pages {:>8.1f} MB {:>7.0f}s {:>6.2f} pages/s  {}".format(
+                stage.name, pages, received / 1024 / 1024, stage_seconds, pages / stage_seconds if stage_seconds else 0,
+                "failed: {}".format(stage.error) if stage.error else "ok"
+            ))
+
+    def __run_stage(self, stage):
+        self.log.info("Stage '{}' started".format(stage.name))
+        try:
+            stage.run()
+        # MySQLConnector exits if the database is unreachable, that must not end the other stages
+        except (Exception, SystemExit) as err:
+            stage.error = err if str(err) else type(err).__name__
+            self.log.error("Stage '{}' failed".format(stage.name))
+            self.log.debug("Error details: ", exc_info=err)
+        finally:
+            stage.seconds = time.perf_counter() - stage.start_time
+            stage.finished.set()
+        self.log.info("Stage '{}' finished in {:.0f}s".format(stage.name, stage.seconds))
@@ -0,0 +1,117 @@
+# Copyright (C) 2023 Xian Chen
+
+import os
+import json
+import queue
+import threading
+import config
+from helper import Helper
+
+class WriteThroughPipeline():
+    """
+    Producer/consumer pipeline that persists crawled records while the crawl is still running.
+
+    Crawlers put each scraped record onto a bounded queue. A writer thread collects the records into
+    micro-batches and flushes every batch to an append-only JSONL file and, if given, to the database.
+    Memory stays flat regardless of the crawl size, database I/O overlaps with network I/O and a crash
+    only loses the records of the current micro-batch.
+    """
+    # Marks the end of the stream on the queue
+    STOP = object()
+
+    def __init__(self, helper: Helper, jsonl_path, load_batch=None, on_flush=None,
+                 batch_size=config.PIPELINE_BATCH_SIZE, queue_size=config.PIPELINE_QUEUE_SIZE,
+                 flush_interval=config.PIPELINE_FLUSH_INTERVAL):
+        """
+        Args:
+            helper (Helper): The logger
+            jsonl_path (str): File every record is appended to as one JSON line.
+            load_batch (callable, optional): Called with each list of records to store them in the database, returns
+                the records it could not store or raises if the whole batch failed. Defaults to None.
+            on_flush (callable, optional): Called with the keys of the records of each batch that were stored. Defaults to None.
+            batch_size (int, optional): Records per micro-batch. Defaults to config.PIPELINE_BATCH_SIZE.
+            queue_size (int, optional): Records buffered before producers block. Defaults to config.PIPELINE_QUEUE_SIZE.
+            flush_interval (float, optional): Seconds after which an incomplete batch is flushed. Defaults to config.PIPELINE_FLUSH_INTERVAL.
+        """
+        self.log = helper.log
+        self.jsonl_path = jsonl_path
+        self.load_batch = load_batch
+        self.on_flush = on_flush
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # Number of records written so far
+        self.count = 0
+        # Number of records that could not be written, e.g. because the database rejected them
+        self.failed = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(jsonl_path)), exist_ok=True)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.writer = threading.Thread(target=self.__run, name="pipeline-writer", daemon=True)
+        self.writer.start()
+
+    def put(self, record, key=None):
+        """
+        Hands a record to the writer thread, blocks while the queue is full.
+
+        Args:
+            record (dict): The record to persist.
+            key (optional): Identifies the record towards on_flush. Defaults to None.
+        """
+        self.queue.put((record, key))
+
+    def close(self):
+        """
+        Flushes all outstanding records and stops the writer thread.
+        """
+        self.queue.put(self.STOP)
+        self.writer.join()
+        self.log.info("{} records written to '{}'".format(self.count, self.jsonl_path))
+        if self.failed:
+            self.log.warning("{} records could not be written".format(self.failed))
+
+    def __run(self):
+        batch = []
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+            if item is self.STOP:
+                self.__flush(batch)
+                return
+            if item:
+                batch.append(item)
+            # Flush full batches, and partial ones once the producer has been idle for a while
+            if len(batch) >= self.batch_size or (item is None and batch):
+                self.__flush(batch)
+                batch = []
+
+    def __flush(self, batch):
+        if not batch:
+            return
+        records = [record for record, _ in batch]
+        self.log.debug("Flushing {} records".format(len(records)))
+        try:
+            with open(self.jsonl_path, "a", encoding="utf-8") as jsonl_file:
+                for record in records:
+                    jsonl_file.write(json.dumps(record) + "\n")
+            rejected = self.load_batch(records) if self.load_batch else None
+        except Exception as err:
+            # Keep the writer alive, the crawl itself must not stop because of a failed batch
+            self.failed += len(records)
+            self.log.error("Failed to flush {} records".format(len(records)))
+            self.log.debug("Error details: ", exc_info=err)
+            return
+        # Only stored records count as written, the others are not reported to on_flush and are crawled again
+        rejected = {id(record) for record in rejected or []}
+        stored = [key for record, key in batch if id(record) not in rejected]
+        self.count += len(stored)
+        self.failed += len(rejected)
+        if rejected:
+            self.log.error("Failed to store {} of {} records".format(len(rejected), len(records)))
+        if self.on_flush and stored:
+            try:
+                self.on_flush(stored)
+            except Exception as err:
+                self.log.error("Failed to report {} stored records".format(len(stored)))
+                self.log.debug("Error details: ", exc_info=err)
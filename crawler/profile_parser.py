@@ -0,0 +1,161 @@
+# Copyright (C) 2023 Xian Chen
+
+import re
+from lxml import etree, html
+from helper import Helper
+
+# Profile pages are served as UTF-8, decoding them explicitly keeps umlauts like in 'Verkäufer' intact
+UTF8_PARSER = html.HTMLParser(encoding="utf-8")
+
+# Precompiled expressions, evaluated relative to the section elements found during the traversal.
+# Plain strings are returned, so the records do not keep references to the parsed page.
+NEXT_ELEMENT = etree.XPath("following-sibling::*[1]", smart_strings=False)
+LIST_ITEMS = etree.XPath(".//li", smart_strings=False)
+FIRST_STRONG_TEXT = etree.XPath("string((.//strong)[1])", smart_strings=False)
+FIRST_BADGE_TEXT = etree.XPath("string((.//li//a)[1])", smart_strings=False)
+FEEDBACK_ROWS = etree.XPath(".//div[@id='trade-scroll']//tbody//tr", smart_strings=False)
+CELLS = etree.XPath(".//td", smart_strings=False)
+FIRST_SPAN_TEXT = etree.XPath("string((.//span)[1])", smart_strings=False)
+HAS_SPAN = etree.XPath("boolean(.//span)", smart_strings=False)
+LINKS = etree.XPath(".//a[@href]", smart_strings=False)
+# Second link with a href from the start of the cell on, continues behind the cell like find_next() does.
+# Only needed for cells with less than two links, the following axis is expensive on large tables.
+AUTHOR_TEXT = etree.XPath("string((descendant::a[@href] | following::a[@href])[2])", smart_strings=False)
+
+PUBLIC_KEY_STYLE = "line-height:15px;user-select:all"
+
+def parse_profile_page(content):
+    """
+    Parses the HTML content of a profile page.
+
+    Args:
+        content (bytes): The HTML content of the page
+
+    Returns:
+        lxml.html.HtmlElement: The root of the parsed page
+    """
+    return html.fromstring(content, parser=UTF8_PARSER)
+
+class ProfileParser():
+    """
+    Extracts the detailed information of a user profile from a page parsed with lxml.
+
+    All sections are located in a single traversal over the candidate elements (li, h3, h4, pre),
+    the fields within a section are then read with precompiled XPath expressions.
+    The results are identical to the BeautifulSoup based scraping this parser replaces.
+    """
+    def __init__(self, helper: Helper):
+        """
+        Args:
+            helper (Helper): The logger
+        """
+        self.log = helper.log
+
+    def parse(self, tree):
+        """
+        Args:
+            tree (lxml.html.HtmlElement): The parsed profile page, see parse_profile_page()
+
+        Returns:
+            tuple: badge, trading activity, feedback statistics, feedback reviews, fingerprint and public key,
+                each None if the profile does not have it
+        """
+        trade_item = feedback_legend = badge_legend = reviews_legend = fingerprint = public_key = None
+        # Only the first match of every section counts, just like soup.find()
+        for element in tree.iter("li", "h3", "h4", "pre"):
+            tag = element.tag
+            if tag == "pre":
+                if fingerprint is None:
+                    fingerprint = element
+                if public_key is None and element.get("style") == PUBLIC_KEY_STYLE:
+                    public_key = element
+                continue
+            classes = element.get("class", "").split()
+            if tag == "li":
+                if trade_item is None and "first-item" in classes and "Handelspunkte" in element.text_content():
+                    trade_item = element
+            elif "ct-legend" in classes:
+                text = element.text_content()
+                if tag == "h3":
+                    if reviews_legend is None and "Feedback zum Verkäufer" in text:
+                        reviews_legend = element
+                    continue
+                if feedback_legend is None and "Feedback-Durchschnittswerte" in text:
+                    feedback_legend = element
+                if badge_legend is None and "Abzeichen" in text:
+                    badge_legend = element
+
+        return (
+            self.__badge(badge_legend),
+            self.__trading_activity(trade_item),
+            self.__feedback_statistic(feedback_legend),
+            self.__feedback_reviews(reviews_legend),
+            fingerprint.text_content().strip() if fingerprint is not None else None,
+            public_key.text_content().strip() if public_key is not None else None
+        )
+
+    def __badge(self, legend):
+        # Not each user has a badge
+        if legend is None:
+            return None
+        self.log.debug(f"Badge exists! Now scraping...")
+        return re.findall("[a-zA-Z]+", FIRST_BADGE_TEXT(NEXT_ELEMENT(legend)[0]))[0]
+
+    def __trading_activity(self, item):
+        if item is None:
+            return None
+        self.log.debug(f"Trading activity information exists! Now scraping...")
+        items = LIST_ITEMS(item.getparent())
+        return {
+            "Handelspunkte": int(FIRST_STRONG_TEXT(items[0])),
+            "Positive Feedbacks": int(FIRST_STRONG_TEXT(items[1])),
+            "Neutrale Feedbacks": int(FIRST_STRONG_TEXT(items[2])),
+            "Negative Feedbacks": int(FIRST_STRONG_TEXT(items[3])),
+        }
+
+    def __feedback_statistic(self, legend):
+        if legend is None:
+            return None
+        self.log.debug(f"Trading Feedback exists! Now scraping...")
+        items = LIST_ITEMS(NEXT_ELEMENT(legend)[0])
+        return {
+            "Produktverpackung": FIRST_STRONG_TEXT(items[0]),
+            "Kontakt & Lieferung": FIRST_STRONG_TEXT(items[1]),
+            "Produkt/Dienstleistung": FIRST_STRONG_TEXT(items[2])
+        }
+
+    def __feedback_reviews(self, legend):
+        if legend is None:
+            return None
+        self.log.debug(f"Trading Feedback Table exists! Now scraping...")
+        feedback_reviews = []
+        for row in FEEDBACK_ROWS(legend.getparent()):
+            columns = CELLS(row)
+            if len(columns) < 4:
+                continue
+            mark = columns[1].text_content().strip().lower()
+            # Adding a comma between the feedback and status in the grading/mark
+            if 'positiv' in mark:
+                mark = "Positiv, " + mark.split("positiv")[-1]
+            elif 'negativ' in mark:
+                mark = "Negativ, " + mark.split("negativ")[-1]
+            elif 'neutral' in mark:
+                mark = "Neutral, " + mark.split("neutral")[-1]
+
+            # Some reviews have an ID in a span, which is removed from the date
+            date = columns[0].text_content().strip()
+            if HAS_SPAN(columns[0]):
+                date = date.replace(FIRST_SPAN_TEXT(columns[0]).strip(), "")
+            feedback_reviews.append({
+                'date': date.replace("(Einzelheiten)", ""),
+                'mark': mark,
+                'comment': columns[2].text_content().strip(),
+                'author': self.__author(columns[3])
+            })
+        return feedback_reviews
+
+    def __author(self, cell):
+        links = LINKS(cell)
+        if len(links) >= 2:
+            return links[1].text_content().strip()
+        return AUTHOR_TEXT(cell).strip()
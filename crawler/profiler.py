@@ -0,0 +1,216 @@
+# Copyright (C) 2023 Martin Pretz
+
+"""
+Profiling mode: timing spans of the crawler stages, written as a trace file.
+
+While profiling is enabled, the fetch, parse, normalise, insert and commit stages are recorded as spans tagged
+with their URL, page type or table. The trace is written in the Chrome trace event format, which chrome://tracing,
+Perfetto (ui.perfetto.dev) and speedscope open as a timeline and flame graph. Optionally every stage is also
+profiled with cProfile, one pstats dump per stage.
+
+Profiling is off unless enabled, a span then costs a single function call. It is also off in processes forked
+from the profiled one, their spans are added by the parent with Tracer.add_span():
+
+    profiler.enable(helper, "./data/trace.json", cprofile_path="./data/cprofile")
+    with profiler.span("parse", url=link, page_type="topics"):
+        ...
+    profiler.disable()
+"""
+
+import os
+import json
+import time
+import pstats
+import cProfile
+import threading
+from contextlib import contextmanager, nullcontext
+from helper import Helper
+
+# Returned by span() while profiling is disabled
+NO_SPAN = nullcontext()
+
+class Tracer():
+    """
+    Collects the spans of all threads and writes them as Chrome trace events.
+
+    With a cProfile path, the outermost span of each thread is additionally profiled by a cProfile.Profile
+    of its stage and thread. Spans nested in another one (e.g. normalise within parse) are part of the
+    outer span's profile, since a thread can only run one profiler at a time. Spans of worker processes
+    are added with add_span() and have no profile.
+    """
+    def __init__(self, helper: Helper, trace_path, cprofile_path=None):
+        """
+        Args:
+            helper (Helper): The logger
+            trace_path (str): The trace file written by save().
+            cprofile_path (str, optional): Directory of the per-stage cProfile dumps, None disables cProfile. Defaults to None.
+        """
+        self.log = helper.log
+        self.trace_path = trace_path
+        self.cprofile_path = cprofile_path
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        # Forked children inherit the tracer, but their spans would never reach the trace file
+        self.pid = os.getpid()
+        self.events = []
+        # Thread names by thread ID, written as metadata so viewers label the tracks
+        self.threads = {}
+        # cProfile.Profile by stage and thread ID
+        self.profiles = {}
+        # Spans open per thread, only the outermost one is profiled
+        self.local = threading.local()
+
+    @contextmanager
+    def span(self, name, **tags):
+        """
+        Records the enclosed block as a span.
+
+        Args:
+            name (str): The stage, e.g. 'fetch', 'parse', 'normalise', 'insert' or 'commit'.
+            **tags: Shown with the span, e.g. url or page_type.
+        """
+        depth = getattr(self.local, "depth", 0)
+        profile = self.__get_profile(name) if self.cprofile_path and depth == 0 else None
+        self.local.depth = depth + 1
+        if profile:
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler is active in this thread
+                profile = None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            if profile:
+                profile.disable()
+            self.local.depth = depth
+            self.add_span(name, start, end - start, **tags)
+
+    def add_span(self, name, start, duration, pid=None, **tags):
+        """
+        Records a span measured elsewhere.
+
+        Args:
+            name (str): The stage of the span.
+            start (float): Start of the span in time.perf_counter() seconds.
+            duration (float): Duration of the span in seconds.
+            pid (int, optional): The worker process the span was measured in, shown as its own track.
+                                 Defaults to None, the current thread.
+            **tags: Shown with the span.
+        """
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": name,
+            "ph": "X",
+            "ts": (start - self.start) * 1e6,
+            "dur": duration * 1e6,
+            "pid": pid or os.getpid(),
+            "tid": pid or thread.ident,
+            "args": tags
+        }
+        with self.lock:
+            self.events.append(event)
+            if not pid:
+                self.threads.setdefault(thread.ident, thread.name)
+
+    def save(self):
+        """
+        Writes the trace file and, with cProfile, one '<stage>.prof' pstats dump per stage.
+        """
+        with self.lock:
+            events = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": ident, "args": {"name": name}}
+                      for ident, name in self.threads.items()] + self.events
+            profiles = dict(self.profiles)
+        os.makedirs(os.path.dirname(os.path.abspath(self.trace_path)), exist_ok=True)
+        with open(self.trace_path, "w", encoding="utf-8") as trace_file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, trace_file)
+        self.log.info("Wrote {} spans to '{}'".format(len(self.events), self.trace_path))
+        if not self.cprofile_path:
+            return
+        os.makedirs(self.cprofile_path, exist_ok=True)
+        for stage in sorted({stage for stage, _ in profiles}):
+            stats = None
+            for (profile_stage, _), profile in profiles.items():
+                if profile_stage != stage:
+                    continue
+                try:
+                    stats = pstats.Stats(profile) if stats is None else stats.add(profile)
+                except TypeError:
+                    # The profile never ran, e.g. its thread had another profiler enabled
+                    continue
+            if stats:
+                stats.dump_stats(os.path.join(self.cprofile_path, stage + ".prof"))
+        self.log.info("Wrote the cProfile dumps of the stages to '{}'".format(self.cprofile_path))
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: Number of spans and total seconds by stage.
+        """
+        stats = {}
+        with self.lock:
+            for event in self.events:
+                count, seconds = stats.get(event["name"], (0, 0.0))
+                stats[event["name"]] = (count + 1, seconds + event["dur"] / 1e6)
+        return stats
+
+    def log_stats(self):
+        for name, (count, seconds) in sorted(self.get_stats().items()):
+            self.log.info("Profile {}: {} spans, {:.2f}s".format(name, count, seconds))
+
+    def __get_profile(self, name):
+        key = (name, threading.get_ident())
+        with self.lock:
+            if key not in self.profiles:
+                self.profiles[key] = cProfile.Profile()
+            return self.profiles[key]
+
+# The tracer of the running crawl, None while profiling is disabled
+tracer = None
+
+def enable(helper: Helper, trace_path, cprofile_path=None):
+    """
+    Starts recording spans, see Tracer.
+
+    Returns:
+        Tracer: The tracer recording the spans.
+    """
+    global tracer
+    tracer = Tracer(helper, trace_path, cprofile_path)
+    helper.log.info("Profiling enabled, the trace is written to '{}'".format(trace_path))
+    return tracer
+
+def disable():
+    """
+    Stops recording and writes the trace, if profiling was enabled.
+    """
+    global tracer
+    if tracer:
+        finished, tracer = tracer, None
+        finished.log_stats()
+        finished.save()
+
+def span(name, **tags):
+    """
+    Returns:
+        A context manager recording the enclosed block as a span of the given stage, a no-op while profiling is
+        disabled and in forked processes.
+    """
+    return tracer.span(name, **tags) if tracer and tracer.pid == os.getpid() else NO_SPAN
+
+def page_type(url):
+    """
+    Args:
+        url (str): A requested URL.
+
+    Returns:
+        str: The kind of page the URL points to, the tag of fetch spans.
+    """
+    for marker, kind in (("profile.php", "profile"), ("userlist.php", "userlist"), ("viewforum.php", "forum"),
+                         ("viewtopic.php", "topic")):
+        if marker in url:
+            return kind
+    return "index"
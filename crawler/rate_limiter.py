@@ -0,0 +1,135 @@
+# Copyright (C) 2023 Martin Pretz
+
+import time
+import threading
+import config
+from helper import Helper
+
+class RateLimiter():
+    """
+    Token bucket shared by all requests of the crawlers, with a request rate that adapts to the onion service.
+
+    Every request takes a token, tokens are refilled at the current rate up to the burst size.
+    The rate follows additive increase / multiplicative decrease: it grows by a fixed step after every window
+    of clean responses and drops sharply on a captcha or a phishing mirror response, moderately on HTTP errors
+    and slightly when the latency rises far above its usual level. Captchas stall the whole crawl until the
+    operator reacts, so avoiding them is worth far more than the last bit of speed.
+    """
+    # Factors the rate is multiplied with on each kind of trouble
+    BACKOFF_FACTOR = 0.5
+    ERROR_FACTOR = 0.8
+    LATENCY_FACTOR = 0.9
+    # A response slower than this multiple of the average latency counts as congestion
+    LATENCY_THRESHOLD = 3.0
+    # Weight of the newest sample in the average latency
+    SMOOTHING = 0.1
+
+    def __init__(self, helper: Helper, rate=config.CRAWLER_RATE_INITIAL, min_rate=config.CRAWLER_RATE_MIN,
+                 max_rate=config.CRAWLER_RATE_MAX, burst=config.CRAWLER_RATE_BURST,
+                 step=config.CRAWLER_RATE_STEP, window=config.CRAWLER_RATE_WINDOW):
+        """
+        Args:
+            helper (Helper): The logger
+            rate (float, optional): Initial requests per second. Defaults to config.CRAWLER_RATE_INITIAL.
+            min_rate (float, optional): Lowest requests per second. Defaults to config.CRAWLER_RATE_MIN.
+            max_rate (float, optional): Highest requests per second. Defaults to config.CRAWLER_RATE_MAX.
+            burst (int, optional): Tokens that can be saved up. Defaults to config.CRAWLER_RATE_BURST.
+            step (float, optional): Requests per second added after each clean window. Defaults to config.CRAWLER_RATE_STEP.
+            window (int, optional): Clean responses needed before the rate is increased. Defaults to config.CRAWLER_RATE_WINDOW.
+        """
+        self.log = helper.log
+        self.lock = threading.Lock()
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.step = step
+        self.window = window
+        self.tokens = 1.0
+        self.refilled = time.monotonic()
+        self.clean_streak = 0
+        self.latency = None
+        self.request_count = 0
+        self.error_count = 0
+        self.backoff_count = 0
+
+    def acquire(self):
+        """
+        Blocks until the next request may be sent.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+                self.refilled = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def record(self, latency, error):
+        """
+        Adapts the rate to the outcome of a finished request.
+
+        Args:
+            latency (float): Duration of the request in seconds.
+            error (bool): Whether the request failed (exception or HTTP 5xx).
+        """
+        with self.lock:
+            self.request_count += 1
+            if error:
+                self.error_count += 1
+                self.clean_streak = 0
+                self.__set_rate(self.rate * self.ERROR_FACTOR)
+                return
+            if self.latency is not None and latency > self.LATENCY_THRESHOLD * self.latency:
+                self.clean_streak = 0
+                self.__set_rate(self.rate * self.LATENCY_FACTOR)
+            else:
+                self.clean_streak += 1
+                if self.clean_streak >= self.window:
+                    self.clean_streak = 0
+                    self.__set_rate(self.rate + self.step)
+            self.latency = latency if self.latency is None else self.latency + self.SMOOTHING * (latency - self.latency)
+
+    def backoff(self, reason):
+        """
+        Cuts the rate after the service pushed back, e.g. with a captcha or a phishing mirror response.
+        Saved up tokens are dropped, so no burst follows right after.
+
+        Args:
+            reason (str): What happened, for the log.
+        """
+        with self.lock:
+            self.backoff_count += 1
+            self.clean_streak = 0
+            self.tokens = 0.0
+            self.__set_rate(self.rate * self.BACKOFF_FACTOR)
+            self.log.info("Backing off after {}: {:.2f} requests/s".format(reason, self.rate))
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: Current rate, requests, errors, back-offs and back-offs per 1000 requests.
+        """
+        with self.lock:
+            return {
+                "rate": self.rate,
+                "requests": self.request_count,
+                "errors": self.error_count,
+                "backoffs": self.backoff_count,
+                "backoffs_per_1000": 1000 * self.backoff_count / self.request_count if self.request_count else 0
+            }
+
+    def log_stats(self):
+        stats = self.get_stats()
+        self.log.info("Rate limiter: {:.2f} requests/s, {} requests, {} errors, {} back-offs ({:.1f} per 1000 requests)"
+                      .format(stats["rate"], stats["requests"], stats["errors"], stats["backoffs"],
+                              stats["backoffs_per_1000"]))
+
+    def __set_rate(self, rate):
+        previous = self.rate
+        self.rate = min(self.max_rate, max(self.min_rate, rate))
+        if self.rate != previous:
+            self.log.debug("Request rate {:.2f} -> {:.2f} requests/s".format(previous, self.rate))
@@ -0,0 +1,86 @@
+# Copyright (C) 2023 Martin Pretz, Xian Chen
+
+"""
+Repeats extraction and database loading of archived crawls, without any network access.
+
+The pages of each run in the PageArchive (config.ARCHIVE_PATH) are replayed through the real crawlers,
+so parser fixes and new fields can be applied to old snapshots. Every run keeps its original crawling date.
+
+    python reparse.py --list
+    python reparse.py 12 13
+    python reparse.py --all --dry-run
+"""
+
+import argparse
+import requests
+import config
+from helper import Helper
+from database import MySQLConnector
+from transport import Transport, CircuitPool
+from replay import ReplayAdapter, install
+from archive import PageArchive, ArchiveStore
+from forums import Forums
+from user_crawler import User_Profiles, User_Detailed_Profiles
+
+def reparse_run(helper: Helper, archive: PageArchive, run_id, db: MySQLConnector = None):
+    """
+    Replays one archived run: the forum crawl if the index page was archived, and the detailed or general
+    user crawl from the first archived userlist page on.
+
+    Args:
+        helper (Helper): The logger
+        archive (PageArchive): The archive.
+        run_id (int): The run to replay.
+        db (MySQLConnector, optional): Database the extracted data is loaded into. Defaults to None.
+    """
+    store = ArchiveStore(archive, run_id)
+    adapter = ReplayAdapter(store)
+    urls = store.urls()
+    helper.log.info("Re-parsing run {} with {} archived pages".format(run_id, len(urls)))
+
+    # The archive holds the URLs as sent, e.g. including the trailing slash of the base link
+    index_link = requests.Request("GET", config.CRAWLER_BASE_LINK).prepare().url
+    if store.get_fetch_time(index_link):
+        transport = Transport(helper, cookie=config.CRAWLER_COOKIE)
+        install(transport, adapter)
+        Forums(config.CRAWLER_BASE_LINK, config.CRAWLER_COOKIE, helper, db, transport) \
+            .crawl_forums(auto_push_db=db is not None, crawling_date=store.get_fetch_time(index_link))
+
+    archived_pages = [idx for idx, link in enumerate(config.CRAWLER_USERLIST_LINKS) if store.get_fetch_time(link)]
+    if archived_pages:
+        start_page = archived_pages[0]
+        crawled_datetime = store.get_fetch_time(config.CRAWLER_USERLIST_LINKS[start_page])
+        circuits = CircuitPool(helper, cookie=config.CRAWLER_COOKIE)
+        install(circuits, adapter)
+        if any("profile.php" in url for url in urls):
+            User_Detailed_Profiles(start_page, helper, db, circuits, crawled_datetime=crawled_datetime,
+                                   state_name="users_detailed_reparse_{}".format(run_id))
+        else:
+            User_Profiles(start_page, helper, db, circuits, parallel=config.CRAWLER_PARALLEL_USERLIST,
+                          crawled_datetime=crawled_datetime)
+    helper.log.info("Run {}: {} pages replayed".format(run_id, adapter.request_count))
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-parse archived crawls without network access.")
+    parser.add_argument("runs", nargs="*", type=int, help="The archived runs to re-parse")
+    parser.add_argument("--all", action="store_true", help="Re-parse all archived runs")
+    parser.add_argument("--list", action="store_true", help="List the archived runs")
+    parser.add_argument("--dry-run", action="store_true", help="Only extract to the JSONL files, do not load the database")
+    args = parser.parse_args()
+
+    helper = Helper(config.LOGGING_FILE_PATH)
+    archive = PageArchive(helper)
+    runs = archive.get_runs()
+    if args.list or not (args.runs or args.all):
+        for run_id, started, page_count in runs:
+            print("Run {:>4}  started {}  {:>7} pages".format(run_id, started, page_count))
+        return
+    db = None if args.dry_run else MySQLConnector(helper=helper)
+    if db:
+        # Replayed pages have no real fetch times, the metrics of the original crawl stay as they are
+        db.store_metrics = False
+    for run_id in [run[0] for run in runs] if args.all else args.runs:
+        reparse_run(helper, archive, run_id, db)
+
+if __name__ == "__main__":
+    main()
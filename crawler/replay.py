@@ -0,0 +1,204 @@
+# Copyright (C) 2023 Martin Pretz
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import deque
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from helper import Helper
+
+MANIFEST_NAME = "manifest.json"
+# Served instead of a page when a captcha is injected, detected like the real captcha page
+CAPTCHA_PAGE = b'<html><body><iframe name="captcha" src="/captcha.php"></iframe></body></html>'
+
+class FixtureStore():
+    """
+    Directory of recorded pages, used to replay crawls without Tor.
+
+    Every page is stored as its own HTML file, the manifest maps the requested URL to that file.
+    """
+    def __init__(self, directory):
+        """
+        Args:
+            directory (str): The fixture directory, created if it does not exist.
+        """
+        self.directory = directory
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        manifest_path = os.path.join(directory, MANIFEST_NAME)
+        self.manifest = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding="utf-8") as manifest_file:
+                self.manifest = json.load(manifest_file)
+
+    def get(self, url):
+        """
+        Args:
+            url (str): The requested URL.
+
+        Returns:
+            bytes or None: The recorded page, None if the URL was not recorded.
+        """
+        file_name = self.manifest.get(url)
+        if not file_name:
+            return None
+        with open(os.path.join(self.directory, file_name), "rb") as page_file:
+            return page_file.read()
+
+    def save(self, url, content):
+        """
+        Records a page, replacing an earlier recording of the same URL.
+
+        Args:
+            url (str): The requested URL.
+            content (bytes): The HTML content of the page.
+        """
+        file_name = hashlib.sha1(url.encode("utf-8")).hexdigest()[:16] + ".html"
+        with open(os.path.join(self.directory, file_name), "wb") as page_file:
+            page_file.write(content)
+        with self.lock:
+            self.manifest[url] = file_name
+            with open(os.path.join(self.directory, MANIFEST_NAME), "w", encoding="utf-8") as manifest_file:
+                json.dump(self.manifest, manifest_file, indent=1, sort_keys=True)
+
+    def urls(self):
+        """
+        Returns:
+            list: All recorded URLs.
+        """
+        return list(self.manifest)
+
+class FixtureRecorder():
+    """
+    Records every successful response of a crawl into a FixtureStore, captcha pages are left out.
+    Attached to the sessions of a Transport or CircuitPool through a requests response hook.
+    """
+    def __init__(self, helper: Helper, store: FixtureStore):
+        self.log = helper.log
+        self.store = store
+
+    def attach(self, transport):
+        """
+        Args:
+            transport (Transport or CircuitPool): The transport whose responses are recorded.
+        """
+        for session in get_sessions(transport):
+            session.hooks["response"].append(self.__record)
+        self.log.info("Recording responses to '{}'".format(self.store.directory))
+
+    def __record(self, response, *args, **kwargs):
+        if response.status_code == 200 and b'name="captcha"' not in response.content:
+            self.store.save(response.url, response.content)
+        return response
+
+class ReplayAdapter(BaseAdapter):
+    """
+    requests transport adapter that answers from a FixtureStore instead of the network.
+
+    Each response is delayed by the configured latency, so concurrency behaves like on the onion service.
+    Captchas are injected per cookie: after captcha_every matching requests sent with the same cookie, or as soon as
+    a cookie sends more than captcha_above matching requests per second (measured over the last RATE_PERIOD seconds),
+    every further matching request of that cookie receives the captcha page until the cookie changes.
+
+    Example:
+        adapter = ReplayAdapter(FixtureStore("./fixtures"), latency=0.5, captcha_every=40)
+        install(transport, adapter)
+    """
+    # Seconds over which the request rate of a cookie is measured
+    RATE_PERIOD = 10.0
+
+    def __init__(self, store: FixtureStore, latency=0.0, captcha_every=0, captcha_pattern="profile.php", captcha_above=0.0):
+        """
+        Args:
+            store (FixtureStore): The recorded pages.
+            latency (float, optional): Seconds every response is delayed. Defaults to 0.0.
+            captcha_every (int, optional): Requests per cookie before captchas are served, 0 disables them. Defaults to 0.
+            captcha_pattern (str, optional): Only URLs containing this string count and receive captchas. Defaults to "profile.php".
+            captcha_above (float, optional): Requests per second of a cookie that trigger captchas, 0 disables them. Defaults to 0.0.
+        """
+        super().__init__()
+        self.store = store
+        self.latency = latency
+        self.captcha_every = captcha_every
+        self.captcha_pattern = captcha_pattern
+        self.captcha_above = captcha_above
+        self.lock = threading.Lock()
+        self.cookie_uses = {}
+        self.cookie_requests = {}
+        self.flagged_cookies = set()
+        self.request_count = 0
+        self.captcha_count = 0
+
+    def send(self, request, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.request_count += 1
+        content = self.store.get(request.url)
+        if content is not None and self.__inject_captcha(request):
+            content = CAPTCHA_PAGE
+        return self.__build_response(request, content)
+
+    def close(self):
+        pass
+
+    def __inject_captcha(self, request):
+        if not (self.captcha_every or self.captcha_above) or self.captcha_pattern not in request.url:
+            return False
+        cookie = request.headers.get("Cookie", "")
+        now = time.monotonic()
+        with self.lock:
+            self.cookie_uses[cookie] = self.cookie_uses.get(cookie, 0) + 1
+            if self.captcha_every and self.cookie_uses[cookie] > self.captcha_every:
+                self.flagged_cookies.add(cookie)
+            if self.captcha_above:
+                sent = self.cookie_requests.setdefault(cookie, deque())
+                sent.append(now)
+                while sent[0] < now - self.RATE_PERIOD:
+                    sent.popleft()
+                if len(sent) > self.captcha_above * self.RATE_PERIOD:
+                    self.flagged_cookies.add(cookie)
+            if cookie not in self.flagged_cookies:
+                return False
+            self.captcha_count += 1
+            return True
+
+    def __build_response(self, request, content):
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.status_code = 200 if content is not None else 404
+        response.reason = "OK" if content is not None else "Not Found"
+        response.headers = CaseInsensitiveDict({"Content-Type": "text/html; charset=utf-8"})
+        response._content = content if content is not None else b""
+        response.encoding = "utf-8"
+        return response
+
+def get_sessions(transport):
+    """
+    Args:
+        transport (Transport or CircuitPool): The transport of a crawler.
+
+    Returns:
+        list: The requests sessions used by the transport.
+    """
+    if hasattr(transport, "circuits"):
+        return [circuit.transport.session for circuit in transport.circuits]
+    return [transport.session]
+
+def install(transport, adapter: ReplayAdapter):
+    """
+    Routes all requests of a transport to the replay adapter instead of Tor.
+
+    Args:
+        transport (Transport or CircuitPool): The transport of a crawler.
+        adapter (ReplayAdapter): The adapter serving the recorded pages.
+    """
+    for session in get_sessions(transport):
+        session.proxies = {}
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
@@ -0,0 +1,102 @@
+# Copyright (C) 2023 Martin Pretz
+
+import time
+import random
+import threading
+import requests
+import config
+from helper import Helper
+
+class RetryPolicy():
+    """
+    Retries requests that failed for transient reasons, as they are common on Tor: circuits that time out,
+    drop the connection or answer with a 5xx status of the onion service.
+
+    Attempts are spaced by exponential backoff with full jitter, so workers that failed at the same moment
+    do not retry in lockstep. Besides the retries of a single request, every URL has its own retry budget
+    for the whole crawl, a permanently broken page cannot eat up the time of the other pages.
+    """
+    # Statuses of the onion service and the Tor proxy worth another attempt
+    RETRY_STATUSES = {500, 502, 503, 504}
+    # Errors of the connection itself, anything else (e.g. an invalid URL) fails immediately
+    RETRY_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+    def __init__(self, helper: Helper, retries=config.CRAWLER_RETRIES, base_delay=config.CRAWLER_RETRY_BASE_DELAY,
+                 max_delay=config.CRAWLER_RETRY_MAX_DELAY, budget=config.CRAWLER_RETRY_BUDGET):
+        """
+        Args:
+            helper (Helper): The logger
+            retries (int, optional): Retries of a single request, 0 disables retrying. Defaults to config.CRAWLER_RETRIES.
+            base_delay (float, optional): Upper bound of the first backoff in seconds. Defaults to config.CRAWLER_RETRY_BASE_DELAY.
+            max_delay (float, optional): Upper bound of any backoff in seconds. Defaults to config.CRAWLER_RETRY_MAX_DELAY.
+            budget (int, optional): Retries of a URL over the whole crawl. Defaults to config.CRAWLER_RETRY_BUDGET.
+        """
+        self.log = helper.log
+        self.lock = threading.Lock()
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        # Retries spent per URL
+        self.spent = {}
+        self.retry_count = 0
+        self.exhausted_count = 0
+
+    def call(self, link, send):
+        """
+        Sends a request, retrying transient failures within the retry budget of the URL.
+
+        Args:
+            link (str): The requested URL.
+            send (callable): Sends a single attempt of the request and returns its requests.Response.
+
+        Returns:
+            requests.Response: The first response without a retryable status, or the last response once
+            the retries are used up.
+
+        Raises:
+            requests.RequestException: The error of the last attempt, if it did not produce a response.
+        """
+        attempt = 0
+        while True:
+            try:
+                response = send()
+                if response.status_code not in self.RETRY_STATUSES:
+                    return response
+                reason = "status {}".format(response.status_code)
+            except self.RETRY_ERRORS as err:
+                response = None
+                reason = type(err).__name__
+                error = err
+            if attempt >= self.retries or not self.__take_budget(link):
+                with self.lock:
+                    self.exhausted_count += 1
+                self.log.warning("Giving up on {} after {} attempts ({})".format(link, attempt + 1, reason))
+                if response is None:
+                    raise error
+                return response
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+            attempt += 1
+            self.log.debug("Retrying {} in {:.1f}s ({}, attempt {})".format(link, delay, reason, attempt + 1))
+            time.sleep(delay)
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: Number of retries and of requests that failed after all their retries.
+        """
+        with self.lock:
+            return {"retries": self.retry_count, "exhausted": self.exhausted_count}
+
+    def log_stats(self):
+        stats = self.get_stats()
+        self.log.info("Retries: {} retries, {} requests failed after all retries"
+                      .format(stats["retries"], stats["exhausted"]))
+
+    def __take_budget(self, link):
+        with self.lock:
+            if self.spent.get(link, 0) >= self.budget:
+                return False
+            self.spent[link] = self.spent.get(link, 0) + 1
+            self.retry_count += 1
+            return True
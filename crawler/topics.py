@@ -0,0 +1,280 @@
+# Copyright (C) 2023 Martin Pretz
+
+import config
+import requests
+import profiler
+from lxml import etree, html
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timedelta
+from helper import Helper
+from database import MySQLConnector
+from transport import Transport
+from metrics import CrawlMetrics
+from pipeline import WriteThroughPipeline
+from forums import get_page_count, page_link
+
+# The messages of a topic page and their number, author, permalink (holding the time) and text
+MESSAGES = etree.XPath('//div[contains(concat(" ", normalize-space(@class), " "), " post ")]')
+MESSAGE_NUMBER = etree.XPath('.//span[@class="post-num"]/text()')
+MESSAGE_AUTHOR = etree.XPath('.//span[@class="post-byline"]//strong')
+MESSAGE_PERMALINK = etree.XPath('.//span[@class="post-link"]/a')
+MESSAGE_BODY = etree.XPath('.//div[contains(@class, "entry-content")]')
+# Elements of a message text that start a new line
+LINE_BREAKS = etree.XPath(".//p | .//div | .//blockquote | .//li | .//pre | .//br")
+
+class Topics():
+    """
+    Crawls the messages of the topics of the latest forum crawl into the post_messages table.
+
+    The topics are the posts of the latest forum snapshot (posts_latest). A topic is only fetched if the forum
+    lists more messages (its replies plus the opening message) than its progress (topic_progress) covers,
+    starting on the page after the progress, so only the pages past the last stored reply are fetched.
+
+    Up to config.CRAWLER_TOPIC_WORKERS topics are crawled at the same time, the pages of one topic one after
+    another. Every page is handed to a WriteThroughPipeline and written in micro-batches while the crawl goes on,
+    memory stays flat no matter how many topics there are and how long they are. The progress of a topic only
+    moves on with the pages stored without a gap, so messages the page leaves out (without author or text) do not
+    hold it back and the pages of a failed batch are fetched again by the next crawl.
+
+    Example:
+        topics = Topics(helper, db, transport)
+        topics.crawl_topics()
+    """
+    def __init__(self, helper: Helper, db: MySQLConnector, transport: Transport = None,
+                 workers=config.CRAWLER_TOPIC_WORKERS):
+        """
+        Args:
+            helper (Helper): The logger
+            db (MySQLConnector): The database holding the forum crawls, the messages are written into it.
+            transport (Transport or CircuitPool, optional): The transport of the requests. Defaults to a new Transport.
+            workers (int, optional): Topics crawled at the same time. Defaults to config.CRAWLER_TOPIC_WORKERS.
+        """
+        self.helper = helper
+        self.log = helper.log
+        self.db = db
+        self.workers = workers
+        self.transport = transport if transport else Transport(helper)
+        # Requests, parse and database time of the current crawl
+        self.metrics = CrawlMetrics(helper, "topics")
+        self.pipeline = None
+        # New messages of the pages stored by the pipeline
+        self.message_count = 0
+
+    def crawl_topics(self, crawling_date=None):
+        """
+        Crawls the new messages of all topics of the latest forum crawl.
+
+        The run is only marked as finished if every topic could be crawled and stored, the next crawl continues
+        the other topics after their progress.
+
+        Args:
+            crawling_date (str, optional): The crawling date stored with the new messages. Defaults to now.
+
+        Returns:
+            int: The number of new messages.
+
+        Example:
+            topics = Topics(helper, db)
+            message_count = topics.crawl_topics()
+        """
+        self.log.info("Started crawling the topics")
+        crawling_date = crawling_date or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.metrics = CrawlMetrics(self.helper, "topics")
+        self.message_count = 0
+        topics = [(topic["link"], topic["stored"]) for topic in self.db.get_topics()
+                  if topic["stored"] < topic["replies_count"] + 1]
+        self.log.info("{} topics have messages that are not stored yet".format(len(topics)))
+
+        time_now = datetime.now().strftime("%Y-%m-%d_%H-%M")
+        self.pipeline = WriteThroughPipeline(
+            self.helper,
+            f"./data/post_messages_{time_now}.jsonl",
+            load_batch=self.db.bulk_load_post_messages,
+            on_flush=self.__count_messages
+        )
+        self.metrics.attach(self.transport)
+        self.db.track_metrics(self.metrics)
+        failed = 0
+        crashed = True
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                running = set()
+                for idx, (link, stored_messages) in enumerate(topics):
+                    # Topics are submitted as workers become free instead of all at once
+                    if len(running) >= self.workers:
+                        done, running = wait(running, return_when=FIRST_COMPLETED)
+                        failed += sum(not future.result() for future in done)
+                    self.log.debug("[{}/{}] Crawling topic {}".format(idx+1, len(topics), link))
+                    running.add(executor.submit(self.crawl_topic, link, stored_messages, crawling_date))
+                failed += sum(not future.result() for future in wait(running).done)
+            crashed = False
+        finally:
+            # Persist everything crawled so far, even if the crawl was interrupted
+            self.pipeline.close()
+            self.metrics.detach(self.transport)
+            # Crashed and incomplete crawls are stored too, their crawl stage counts as an error
+            self.metrics.stop(self.message_count, error=crashed or bool(failed or self.pipeline.failed))
+            self.metrics.log_stats()
+            self.db.load_metrics(self.metrics, crawling_date)
+        self.transport.log_stats()
+        if failed:
+            self.log.warning("{} topics could not be crawled completely, they are continued next time".format(failed))
+        elif self.pipeline.failed:
+            self.log.warning("{} topic pages could not be stored, they are fetched again next time".format(self.pipeline.failed))
+        else:
+            self.db.finish_run("topics", crawling_date)
+        self.log.info("Stored {} new messages of {} topics".format(self.message_count, len(topics)))
+        return self.message_count
+
+    def crawl_topic(self, link, stored, crawling_date):
+        """
+        Fetches the pages of a topic from the page after its progress on, and hands every page with
+        its new messages to the pipeline.
+
+        Args:
+            link (str): The link of the topic.
+            stored (int): The progress of the topic, the position up to which its messages are stored.
+            crawling_date (str): The crawling date stored with the new messages.
+
+        Returns:
+            bool: True if all pages of the topic could be retrieved.
+        """
+        page = stored // config.CRAWLER_TOPIC_MESSAGES_PER_PAGE + 1
+        first_page = page
+        page_count = page
+        while page <= page_count:
+            url = page_link(link, page) if page > 1 else link
+            response = self.__request(url)
+            if response is None:
+                self.log.error("Could not retrieve page {} of topic {}".format(page, link))
+                return False
+            with self.metrics.timed("parse", url=url, page_type="topic"):
+                tree = html.fromstring(response.text)
+                topic_page = parse_topic_page(tree, link, page, crawling_date)
+                page_count = get_page_count(tree)
+            first_position = topic_page["first_position"]
+            if page == first_page > 1 and (first_position is None or first_position > stored + 1):
+                # The topic has more messages per page than configured, the first new messages are on an earlier page
+                self.log.warning("Page {} of topic {} starts after its first new message, fetching the topic from "
+                                 "its first page. Check config.CRAWLER_TOPIC_MESSAGES_PER_PAGE".format(page, link))
+                page = first_page = 1
+                continue
+            # Pages without new messages are handed over too, they move the progress past the messages left out
+            if first_position is not None:
+                topic_page["messages"] = [message for message in topic_page["messages"] if message["position"] > stored]
+                self.pipeline.put(topic_page, key=len(topic_page["messages"]))
+            page += 1
+        return True
+
+    def __count_messages(self, message_counts):
+        """
+        Counts the new messages of the pages the pipeline stored.
+
+        Note:
+            This method is intended for internal use within the Topics class.
+        """
+        self.message_count += sum(message_counts)
+
+    def __request(self, url):
+        """
+        Returns:
+            requests.Response or None: The response of a topic page, None if it could not be retrieved.
+
+        Note:
+            This method is intended for internal use within the Topics class.
+        """
+        try:
+            response = self.transport.get(url)
+        except requests.RequestException as err:
+            self.metrics.record_error()
+            self.log.error("Request failed after all retries: {}".format(type(err).__name__))
+            self.log.debug("Error details: ", exc_info=err)
+            return None
+        if response.status_code != 200:
+            self.log.error("Received unexpected response {}".format(response.status_code))
+            return None
+        return response
+
+def parse_topic_page(tree, topic_link, page, crawling_date):
+    """
+    Extracts the messages of a topic page.
+
+    Args:
+        tree (ElementTree): The parsed HTML tree of the page.
+        topic_link (str): The link of the topic, stored with every message.
+        page (int): The number of the page, the position of messages without a number is derived from it.
+        crawling_date (str): The crawling date stored with every message.
+
+    Returns:
+        dict: The topic link, the first and last position on the page (None if it shows no messages) and the
+        message dictionaries in the order of the page. Messages without author or text are left out of the
+        messages, but not of the positions.
+    """
+    messages = []
+    positions = []
+    first_position = (page - 1) * config.CRAWLER_TOPIC_MESSAGES_PER_PAGE + 1
+    for idx, message in enumerate(MESSAGES(tree)):
+        number = "".join(MESSAGE_NUMBER(message)).strip().lstrip("#")
+        positions.append(int(number) if number.isdigit() else first_position + idx)
+        author = MESSAGE_AUTHOR(message)
+        body = MESSAGE_BODY(message)
+        if not author or not body:
+            continue
+        permalink = MESSAGE_PERMALINK(message)
+        messages.append({
+            "topic_link": topic_link,
+            "position": positions[-1],
+            "post_link": permalink[0].get("href") if permalink else None,
+            "author": author[0].text_content().strip(),
+            "posted_at": convert_message_time(permalink[0].text_content()) if permalink else None,
+            "body": get_message_text(body[0]),
+            "crawling_date": crawling_date
+        })
+    return {
+        "topic_link": topic_link,
+        "first_position": min(positions) if positions else None,
+        "last_position": max(positions) if positions else None,
+        "messages": messages
+    }
+
+def get_message_text(body):
+    """
+    Args:
+        body (lxml.html.HtmlElement): The element holding the text of a message.
+
+    Returns:
+        str: The text of the message, paragraphs, quotes and line breaks on lines of their own.
+    """
+    for element in LINE_BREAKS(body):
+        element.tail = "\n" + (element.tail or "")
+    return "\n".join(line.strip() for line in body.text_content().splitlines() if line.strip())
+
+def convert_message_time(message_time):
+    """
+    Converts the time of a message into a formatted datetime string.
+
+    Args:
+        message_time (str): The time as shown by the forum, e.g. 'Heute 12:30:05', 'Gestern 12:30' or '2023-09-01 12:30:05'.
+
+    Returns:
+        str or None: The time in the format '%Y-%m-%d %H:%M:%S', None if the format is unknown.
+
+    Example:
+        posted_at = convert_message_time("Gestern 12:30")
+    """
+    with profiler.span("normalise", field="posted_at"):
+        parts = message_time.split()
+        if not parts:
+            return None
+        day = parts[0]
+        if day.lower() == "heute":
+            day = datetime.now().strftime("%Y-%m-%d")
+        elif day.lower() == "gestern":
+            day = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+        clock = parts[1] if len(parts) > 1 else "00:00:00"
+        if clock.count(":") == 1:
+            clock += ":00"
+        try:
+            return datetime.strptime("{} {}".format(day, clock), "%Y-%m-%d %H:%M:%S").strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            return None
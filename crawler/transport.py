@@ -0,0 +1,410 @@
+# Copyright (C) 2023 Martin Pretz
+
+import time
+import threading
+import config
+import requests
+import profiler
+from requests.adapters import HTTPAdapter
+from helper import Helper
+from cache import ResponseCache
+from rate_limiter import RateLimiter
+from retry import RetryPolicy
+
+COOKIE_NAME = "PHPSESSID"
+
+class TransportStopped(requests.RequestException):
+    """
+    Raised instead of sending a request once the transport was stopped, the crawlers handle it like any
+    failed request and wind down without further network access.
+    """
+
+def counting_pool_class(pool_cls, on_new_connection):
+    """
+    Derives a connection pool class that reports every newly opened connection.
+
+    Args:
+        pool_cls (type): The urllib3 connection pool class to derive from.
+        on_new_connection (callable): Called without arguments whenever the pool opens a new connection.
+
+    Returns:
+        type: The derived connection pool class.
+    """
+    class CountingConnectionPool(pool_cls):
+        def _new_conn(self):
+            on_new_connection()
+            return super()._new_conn()
+    return CountingConnectionPool
+
+class CountingAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose connection pools (direct and proxied) count newly opened connections.
+    """
+    def __init__(self, on_new_connection, **kwargs):
+        # Has to be set before HTTPAdapter.__init__ creates the first pool manager
+        self.on_new_connection = on_new_connection
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.__count_connections(self.poolmanager)
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        is_new = proxy not in self.proxy_manager
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        if is_new:
+            self.__count_connections(manager)
+        return manager
+
+    def __count_connections(self, manager):
+        manager.pool_classes_by_scheme = {
+            scheme: counting_pool_class(pool_cls, self.on_new_connection)
+            for scheme, pool_cls in manager.pool_classes_by_scheme.items()
+        }
+
+class Transport():
+    """
+    Persistent, pooled HTTP session shared by all requests of a crawler.
+
+    Connections to the onion service are kept alive and reused, so the SOCKS5 handshake through Tor
+    is only paid once per pooled connection instead of once per request.
+    The PHPSESSID cookie is managed centrally in the session's cookie jar.
+    With a ResponseCache, requests are sent conditionally and responses are flagged if their body is unchanged.
+    Every request has a connect and read timeout, transient failures are retried according to the RetryPolicy.
+    """
+    def __init__(self, helper: Helper, cookie=None, proxy=config.CRAWLER_PROXY,
+                 pool_size=config.CRAWLER_POOL_SIZE, connections_per_host=config.CRAWLER_CONNECTIONS_PER_HOST,
+                 cache: ResponseCache = None, limiter: RateLimiter = None, retry: RetryPolicy = None):
+        """
+        Args:
+            helper (Helper): The logger
+            cookie (str, optional): The initial PHPSESSID cookie. Defaults to None.
+            proxy (str, optional): The proxy all requests are routed through. Defaults to config.CRAWLER_PROXY.
+            pool_size (int, optional): Number of per-host connection pools kept. Defaults to config.CRAWLER_POOL_SIZE.
+            connections_per_host (int, optional): Maximum open connections per host. Defaults to config.CRAWLER_CONNECTIONS_PER_HOST.
+            cache (ResponseCache, optional): The HTTP cache of the session. Defaults to None.
+            limiter (RateLimiter, optional): The rate limiter every request has to pass. Defaults to None.
+            retry (RetryPolicy, optional): How failed requests are retried. Defaults to a new RetryPolicy.
+        """
+        self.log = helper.log
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.connection_count = 0
+        self.cache = cache
+        self.limiter = limiter
+        self.retry = retry if retry else RetryPolicy(helper)
+        self.stopped = False
+
+        self.session = requests.session()
+        # Block instead of opening surplus connections, this enforces the per-host limit
+        adapter = CountingAdapter(
+            self.__on_new_connection,
+            pool_connections=pool_size,
+            pool_maxsize=connections_per_host,
+            pool_block=True
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Connection': 'keep-alive'})
+        if proxy:
+            self.session.proxies = {'http': proxy, 'https': proxy}
+        if cookie:
+            self.set_cookie(cookie)
+        if cache:
+            # First hook, so hooks attached later (archive, fixture recorder) see the completed 304 answers
+            self.session.hooks["response"].insert(0, cache.revalidate)
+
+    def get(self, link, **kwargs):
+        """
+        Sends a GET request through the pooled session, retrying transient failures.
+
+        Args:
+            link (str): The URL to request.
+            **kwargs: Passed on to requests.Session.get.
+
+        Returns:
+            requests.Response: The response to the request.
+
+        Raises:
+            requests.RequestException: If the request still failed after its retries.
+        """
+        return self.retry.call(link, lambda: self.send(link, **kwargs))
+
+    def send(self, link, **kwargs):
+        """
+        Sends a single GET request through the pooled session, without retrying.
+
+        Args:
+            link (str): The URL to request.
+            **kwargs: Passed on to requests.Session.get.
+
+        Returns:
+            requests.Response: The response to the request.
+        """
+        with profiler.span("fetch", url=link, page_type=profiler.page_type(link)):
+            return self.__send(link, **kwargs)
+
+    def stop(self):
+        """
+        Fails every further request with TransportStopped, requests already sent are completed.
+        """
+        self.stopped = True
+
+    def __send(self, link, **kwargs):
+        if self.stopped:
+            raise TransportStopped("The transport was stopped, {} is not requested".format(link))
+        with self.lock:
+            self.request_count += 1
+        kwargs.setdefault("timeout", (config.CRAWLER_CONNECT_TIMEOUT, config.CRAWLER_READ_TIMEOUT))
+        if self.cache:
+            kwargs["headers"] = {**self.cache.get_validators(link), **(kwargs.get("headers") or {})}
+        if not self.limiter:
+            return self.session.get(link, **kwargs)
+        self.limiter.acquire()
+        start = time.monotonic()
+        try:
+            response = self.session.get(link, **kwargs)
+        except requests.RequestException:
+            self.limiter.record(time.monotonic() - start, error=True)
+            raise
+        # Captchas are not a clean response, the back-off itself happens once per captcha when it is solved
+        if b'name="captcha"' not in response.content:
+            self.limiter.record(time.monotonic() - start, error=response.status_code >= 500)
+        return response
+
+    def set_cookie(self, cookie):
+        """
+        Replaces the PHPSESSID cookie used for all following requests.
+
+        Args:
+            cookie (str): The new PHPSESSID value.
+        """
+        # Drop cookies of the same name the server may have set for its own domain/path
+        for stored in list(self.session.cookies):
+            if stored.name == COOKIE_NAME:
+                self.session.cookies.clear(stored.domain, stored.path, stored.name)
+        self.session.cookies.set(COOKIE_NAME, cookie)
+
+    def get_cookie(self):
+        """
+        Returns:
+            str or None: The PHPSESSID cookie currently in use.
+        """
+        for stored in self.session.cookies:
+            if stored.name == COOKIE_NAME:
+                return stored.value
+        return None
+
+    def get_stats(self):
+        """
+        Returns the connection reuse counters of this transport.
+
+        Returns:
+            dict: Number of requests, newly opened connections and requests served by a reused connection.
+        """
+        with self.lock:
+            return {
+                "requests": self.request_count,
+                "new_connections": self.connection_count,
+                "reused_connections": max(self.request_count - self.connection_count, 0)
+            }
+
+    def log_stats(self):
+        stats = self.get_stats()
+        self.log.info("Transport: {} requests, {} new connections, {} reused connections"
+                      .format(stats["requests"], stats["new_connections"], stats["reused_connections"]))
+
+    def __on_new_connection(self):
+        with self.lock:
+            self.connection_count += 1
+
+class Circuit():
+    """
+    A single Tor circuit: its own Transport (session and cookie jar) plus the health statistics
+    used to decide how much work it gets.
+
+    The statistics fade while a circuit receives no requests, halving every HALF_LIFE seconds. A circuit that
+    was avoided after errors or slow responses thus becomes attractive again over time and gets a probe request,
+    whose outcome decides whether it stays in use. Without this, a circuit that recovered would never be tried again.
+    """
+    # Weight of the newest sample in the moving averages
+    SMOOTHING = 0.3
+    # Latency in seconds charged for a failed request, fast failures must not look attractive
+    ERROR_PENALTY = 10.0
+    # Seconds without a finished request after which the latency and error rate of a circuit count half
+    HALF_LIFE = 60.0
+
+    def __init__(self, name, transport: Transport):
+        self.name = name
+        self.transport = transport
+        self.in_flight = 0
+        self.latency = 0.0
+        self.error_rate = 0.0
+        self.request_count = 0
+        self.error_count = 0
+        # When the last request of the circuit finished
+        self.updated = time.monotonic()
+
+    def score(self, now=None):
+        """
+        Args:
+            now (float, optional): The current time.monotonic(). Defaults to now.
+
+        Returns:
+            float: Expected cost of sending the next request on this circuit, lower is better.
+        """
+        decay = self.__decay(now)
+        return (self.in_flight + 1) * self.latency * decay * (1 + 10 * self.error_rate * decay)
+
+    def record(self, latency, error, now=None):
+        """
+        Updates the moving averages with the outcome of a finished request.
+
+        Args:
+            latency (float): Duration of the request in seconds.
+            error (bool): Whether the request failed.
+            now (float, optional): The current time.monotonic(). Defaults to now.
+        """
+        now = time.monotonic() if now is None else now
+        decay = self.__decay(now)
+        self.latency *= decay
+        self.error_rate *= decay
+        self.updated = now
+        self.request_count += 1
+        self.error_count += int(error)
+        if error:
+            latency = max(latency, self.ERROR_PENALTY)
+        if self.request_count == 1:
+            self.latency = latency
+        else:
+            self.latency += self.SMOOTHING * (latency - self.latency)
+        self.error_rate += self.SMOOTHING * (float(error) - self.error_rate)
+
+    def __decay(self, now=None):
+        """
+        Returns:
+            float: The factor the statistics fade by since the last finished request, 1 right after it.
+        """
+        idle = (time.monotonic() if now is None else now) - self.updated
+        return 0.5 ** (max(idle, 0.0) / self.HALF_LIFE)
+
+class CircuitPool():
+    """
+    Spreads requests over several Tor circuits, each with its own pooled session and cookie jar.
+
+    Circuits are either separate SOCKS endpoints or are forced apart on one endpoint through
+    SOCKS username isolation (Tor builds a new circuit for every distinct username).
+    Every request goes to the circuit with the lowest expected cost, so circuits with high latency
+    or many errors receive less work, until their statistics have faded and they are probed again.
+    A failed request is retried on the circuit that is best by then, usually a different one.
+    The class offers the same interface as Transport.
+    """
+    def __init__(self, helper: Helper, cookie=None, proxies=config.CRAWLER_PROXY_LIST,
+                 circuits_per_proxy=config.CRAWLER_CIRCUITS_PER_PROXY, cache: ResponseCache = None,
+                 limiter: RateLimiter = None, retry: RetryPolicy = None):
+        """
+        Args:
+            helper (Helper): The logger
+            cookie (str, optional): The initial PHPSESSID cookie of all circuits. Defaults to None.
+            proxies (list, optional): SOCKS endpoints to use. Defaults to config.CRAWLER_PROXY_LIST.
+            circuits_per_proxy (int, optional): Isolated circuits per endpoint. Defaults to config.CRAWLER_CIRCUITS_PER_PROXY.
+            cache (ResponseCache, optional): The HTTP cache shared by all circuits. Defaults to None.
+            limiter (RateLimiter, optional): The rate limiter shared by all circuits. Defaults to None.
+            retry (RetryPolicy, optional): How failed requests are retried. Defaults to a new RetryPolicy.
+        """
+        self.log = helper.log
+        self.lock = threading.Lock()
+        self.cache = cache
+        self.limiter = limiter
+        self.retry = retry if retry else RetryPolicy(helper)
+        self.circuits = []
+        for proxy in proxies:
+            for idx in range(circuits_per_proxy):
+                circuit_proxy = self.__isolate(proxy, idx) if circuits_per_proxy > 1 else proxy
+                self.circuits.append(Circuit(circuit_proxy, Transport(helper, cookie=cookie, proxy=circuit_proxy, cache=cache,
+                                                                      limiter=limiter, retry=self.retry)))
+        self.log.debug("Circuit pool with {} circuits: {}"
+                       .format(len(self.circuits), [circuit.name for circuit in self.circuits]))
+
+    def get(self, link, **kwargs):
+        """
+        Sends a GET request on the circuit with the lowest expected cost, retrying transient failures.
+
+        Args:
+            link (str): The URL to request.
+            **kwargs: Passed on to requests.Session.get.
+
+        Returns:
+            requests.Response: The response to the request.
+
+        Raises:
+            requests.RequestException: If the request still failed after its retries.
+        """
+        return self.retry.call(link, lambda: self.__send(link, **kwargs))
+
+    def __send(self, link, **kwargs):
+        with self.lock:
+            now = time.monotonic()
+            circuit = min(self.circuits, key=lambda circuit: (circuit.score(now), circuit.in_flight))
+            circuit.in_flight += 1
+        start = time.monotonic()
+        error = True
+        try:
+            response = circuit.transport.send(link, **kwargs)
+            error = response.status_code >= 500
+            return response
+        finally:
+            with self.lock:
+                circuit.in_flight -= 1
+                circuit.record(time.monotonic() - start, error)
+
+    def set_cookie(self, cookie):
+        """
+        Replaces the PHPSESSID cookie on every circuit.
+
+        Args:
+            cookie (str): The new PHPSESSID value.
+        """
+        for circuit in self.circuits:
+            circuit.transport.set_cookie(cookie)
+
+    def get_cookie(self):
+        return self.circuits[0].transport.get_cookie()
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: The connection reuse counters summed over all circuits.
+        """
+        stats = {"requests": 0, "new_connections": 0, "reused_connections": 0}
+        for circuit in self.circuits:
+            for key, value in circuit.transport.get_stats().items():
+                stats[key] += value
+        return stats
+
+    def stop(self):
+        """
+        Fails every further request of all circuits with TransportStopped, requests already sent are completed.
+        """
+        for circuit in self.circuits:
+            circuit.transport.stop()
+
+    def log_stats(self):
+        for circuit in self.circuits:
+            self.log.info("Circuit {}: {} requests, {} errors, {:.2f}s average latency"
+                          .format(circuit.name, circuit.request_count, circuit.error_count, circuit.latency))
+            circuit.transport.log_stats()
+
+    def __isolate(self, proxy, idx):
+        """
+        Adds a distinct SOCKS username to the proxy URL, forcing Tor onto a separate circuit.
+
+        Args:
+            proxy (str): The proxy URL, e.g. socks5h://127.0.0.1:9050
+            idx (int): Number of the circuit on this endpoint.
+
+        Returns:
+            str: The proxy URL including the isolation credentials.
+        """
+        scheme, address = proxy.split("://", 1)
+        return "{}://circuit{}:isolation@{}".format(scheme, idx, address.split("@")[-1])
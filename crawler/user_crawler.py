@@ -1,14 +1,30 @@
 # Copyright (C) 2023 Xian Chen
 
-import re
-import requests
-import json
+import os
+import time
+import multiprocessing
 import config
+import requests
+import profiler
 from tqdm import tqdm
 from bs4 import BeautifulSoup
+from lxml import html
 from datetime import datetime, timedelta
+from itertools import repeat
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from helper import Helper
 from database import MySQLConnector
+from transport import CircuitPool
+from pipeline import WriteThroughPipeline
+from crawl_state import CrawlState
+from captcha_gate import CaptchaGate
+from profile_parser import ProfileParser, parse_profile_page
+from metrics import CrawlMetrics
+
+# The parse workers are started from a clean server process, forking the crawler would copy the locks of its
+# transport, pipeline and profiler threads in whatever state they are
+PARSE_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
 
 class User_Detailed_Profiles():
     """
@@ -16,199 +32,110 @@ class User_Detailed_Profiles():
     Germania has implemented a security function that resets the session, when crawling through those profiles.
     Thus this function demands for INTERACTION.
     It implements a captcha_handler, in which a user input is necessary to pass on valid cookies.
+    The progress is checkpointed in a CrawlState, an interrupted crawl is resumed on the next start.
+    Userlist pages and profiles that still fail after their retries are put on dead-letter lists and
+    retried once more at the end of the crawl, instead of aborting it.
     """
-    def __init__(self, start_page: int, helper: Helper, db: MySQLConnector = None):
+    def __init__(self, start_page: int, helper: Helper, db: MySQLConnector = None, transport: CircuitPool = None,
+                 crawled_datetime=None, state_name="users_detailed"):
         """
         Initialize variables important throughout the function
 
         Args:
-            start_page (int): The number at which page we start crawling the userlists
+            start_page (int): The number at which page we start crawling the userlists, ignored when an unfinished crawl is resumed
             helper (Helper): The logger
             db (MySQLConnector, optional): Database in which crawled users will be saved. Defaults to None.
+            transport (CircuitPool, optional): Tor circuits all requests are spread over. Defaults to a new pool.
+            crawled_datetime (str, optional): The crawling date of a new crawl, e.g. of an archived crawl. Defaults to now.
+            state_name (str, optional): Name of the crawl in the CrawlState. Defaults to "users_detailed".
         """
         # The logger
         self.log = helper.log
         self.log.info("Detailed user_info crawl: Starting to crawl all users including their profiles.")
         # Keep track of already visited urls
         self.visited = set()
-        # The current userlist page to be visisted
-        self.current_page = config.CRAWLER_USERLIST_LINKS[start_page]
-        # Initialize an empty list to store user information
-        self.users = []
+        # Checkpoints of this crawl, continues an unfinished crawl with its original crawling date
+        self.state = CrawlState(helper, state_name)
+        first_page, self.crawled_datetime, _ = self.state.start(
+            config.CRAWLER_USERLIST_LINKS[start_page], crawled_datetime or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        )
+        # The current userlist page to be visisted, skipping pages that are already complete
+        self.current_page = self.state.next_open_page(first_page)
+        # Number of users crawled so far
+        self.user_count = 0
         # Status flag that determines the continuation of crawling
         self.status = False
-        # The session cookie (okay if not valid, we handle captcha's in this class)
-        self.cookies = { 'PHPSESSID': config.CRAWLER_COOKIE }
+        # Userlist pages and users whose profile could not be retrieved, retried at the end of the crawl
+        self.dead_pages = []
+        self.dead_profiles = []
+        # Tor circuits holding the cookie (okay if not valid, we handle captcha's in this class)
+        self.transport = transport if transport else CircuitPool(helper)
+        self.transport.set_cookie(config.CRAWLER_COOKIE)
+        # All profile workers pause here while a captcha is solved
+        self.gate = CaptchaGate()
+        # Extracts the details from the profile pages
+        self.parser = ProfileParser(helper)
         # Number of rows already processed, needed for debugging
         self.sum_row = 0
+        # Requests, parse and database time of this crawl, stored in the crawl_metrics table
+        self.metrics = CrawlMetrics(helper, "users_detailed")
 
-        self.crawled_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        # While there's still a page to crawl and the status flag is not set, we crawl the website
-        while self.current_page and not self.status:
-            self.crawl_profiles()
-            
         time_now = datetime.now().strftime("%Y-%m-%d_%H-%M")
-        # Save the collected user information to a JSON file
-        with open(f"./data/user_detailed_information_{time_now}.json", 'w') as json_file:
-            json.dump(self.users, json_file, indent=4)
-        self.log.info("User information saved to 'user_detailed_information.json'")
-        # If a MySQLConnector Object is given and exists, load collected data into that DB
+        # Crawled users are streamed to a JSONL file and, if a MySQLConnector Object is given, into that DB.
+        # Profiles are checkpointed as done once their record is written.
+        self.pipeline = WriteThroughPipeline(
+            helper,
+            f"./data/user_detailed_information_{time_now}.jsonl",
+            load_batch=db.bulk_load_user_detailed if db else None,
+            on_flush=self.state.mark_profiles_done
+        )
+        self.metrics.attach(self.transport)
         if db:
-            db.bulk_load_user_detailed(self.users)
+            db.track_metrics(self.metrics)
+
+        # While there's still a page to crawl and the status flag is not set, we crawl the website
+        crashed = True
+        try:
+            while self.current_page and not self.status:
+                self.crawl_profiles()
+            if not self.status:
+                self.retry_dead_letters()
+            crashed = False
+        finally:
+            # Persist everything crawled so far, even if the crawl was interrupted
+            self.pipeline.close()
+            self.metrics.detach(self.transport)
+            # Only a crawl that reached the last page without failures is finished, otherwise it is resumed next time.
+            # Profiles whose record could not be written are not checkpointed as done and are crawled again then.
+            finished = (not crashed and not self.current_page and not self.status and not self.dead_pages
+                        and not self.dead_profiles and not self.pipeline.failed)
+            # Unfinished and crashed crawls are stored too, their crawl stage counts as an error
+            self.metrics.stop(self.user_count, error=not finished)
+            self.metrics.log_stats()
+            if db:
+                db.load_metrics(self.metrics, self.crawled_datetime)
+        self.transport.log_stats()
+        if finished:
+            self.state.finish()
+            if db:
+                db.finish_run("users_detailed", self.crawled_datetime)
     
-    def get_profile_details(self, soup):
+    def get_profile_details(self, tree):
         """
-        This method purely deals with the profiles and returns a dictionary with all scraped data of a profile.
-        It contains several sub-methods in which each data-container is scraped for its specific categorized information (like only profile info, trade related info, etc.)
+        This method purely deals with the profiles and returns all scraped data of a profile.
+        The sections of the profile (badge, trade related info, feedback, keys) are extracted by the ProfileParser.
 
         Args:
-            soup (BeautifulSoup): BeautifulSoup object of a user profile
+            tree (lxml.html.HtmlElement): The parsed user profile, see parse_profile_page()
 
         Returns:
-            dict: Detailed data of each user found on their profile
+            tuple: badge, trading activity, feedback statistics, feedback reviews, fingerprint and public key
         """
-        def scrape_Handlesaktivitaet():
-            """
-            Sub-Method scrapes the trading activity of a user. Returns None, if no information in relation to trading activity exists
-
-            Returns:
-                dict: trading activity 
-            """
-            # Funktion zum Finden des gewünschten Elements
-            def find_target_element(tag):
-                return tag.name == 'li' and 'first-item' in tag.get('class', []) and 'Handelspunkte' in tag.get_text()
-            # By passing this function, the beauifulsoup library can find the element in which all the requirements are true
-            # So in this case we are trying to find a <li> element with the 'first-item' class and the text equals 'Handelspunkte'
-            trade_activity_element = soup.find(find_target_element)
-            # Since not all users have this element, we have to check whether that exists
-            if trade_activity_element:
-                trade_activity_element = trade_activity_element.parent.find_all("li")
-            else:
-                # If it does not exist, we simply return None, to represent a Null element in the DB later
-                return None
-            self.log.debug(f"Trading activity information exists! Now scraping...")
-            # If the element exists, we want to extract the information regarding the trade activity
-            trade_activity = trade_activity_element[0].find("strong").text
-            positive_feedbacks = trade_activity_element[1].find("strong").text
-            neutral_feedbacks = trade_activity_element[2].find("strong").text
-            negative_feedbacks = trade_activity_element[3].find("strong").text
-
-            # This function returns the information found as a dictionary
-            return {
-                "Handelspunkte": int(trade_activity),
-                "Positive Feedbacks": int(positive_feedbacks),
-                "Neutrale Feedbacks": int(neutral_feedbacks),
-                "Negative Feedbacks": int(negative_feedbacks),
-            }
-            
-        def scrape_Feedback():
-            """
-            This method is similar to the method before, it first tries to find the element and scrapes if it exists
-
-            Returns:
-                dict: Feedback on product packaging, contact, delivery and product itself
-            """
-            # Funktion zum Finden des gewünschten Elements
-            def find_target_element(tag):
-                return tag.name == 'h4' and 'ct-legend' in tag.get('class', []) and 'Feedback-Durchschnittswerte' in tag.get_text()
-            feedback_reviews = soup.find(find_target_element)
-            if feedback_reviews:
-                feedback_reviews = feedback_reviews.next_sibling.find_all("li")
-            else:
-                return None
-            self.log.debug(f"Trading Feedback exists! Now scraping...")
-            review_packaging = feedback_reviews[0].find("strong").text
-            review_transfer = feedback_reviews[1].find("strong").text
-            review_product = feedback_reviews[2].find("strong").text
-
-            return {
-                "Produktverpackung": review_packaging,
-                "Kontakt & Lieferung": review_transfer,
-                "Produkt/Dienstleistung": review_product
-            }
-
-        def scrape_Feedback_Entries():
-            """
-            Each user that is a trader has the possibility of customer reviews shown on their profile. Usually it is several reviews of different customers.
-            For each review we scraped the relevant information (Author, comment, date, grading/mark) and statistics (positive, neutral, negative feedbacks nr.)
-
-            Returns:
-                List: Returns a list of dictionaries. Each dictionary represents a review left on the user's page
-            """
-            # Funktion zum Finden des gewünschten Elements
-            def find_target_element(tag):
-                return tag.name == 'h3' and 'ct-legend' in tag.get('class', []) and 'Feedback zum Verkäufer' in tag.get_text()
-            # Find an element <h3> that has '.ct-legend' as class name and "Feedback zum Verkäufer" as text
-            feedback_rows = soup.find(find_target_element)
-            if feedback_rows:
-                feedback_rows = feedback_rows.parent.select('div#trade-scroll tbody tr')
-            else:
-                return None
-            self.log.debug(f"Trading Feedback Table exists! Now scraping...")
-            feedback_reviews = []
-            for row in feedback_rows:
-                columns = row.find_all('td')
-                if len(columns) >= 4:
-                    mark = columns[1].text.strip().lower()
-                    # Adding a comma between the feedback and status in the grading/mark
-                    if 'positiv' in mark:
-                        mark = "Positiv, " + mark.split("positiv")[-1]
-                    elif 'negativ' in mark:
-                        mark = "Negativ, " + mark.split("negativ")[-1]
-                    elif 'neutral' in mark:
-                        mark = "Neutral, " + mark.split("neutral")[-1]
-                    
-                    # If there's no ID, then there's nothing to replace in the date (some reviews have an ID, some do not)
-                    if columns[0].span:
-                        date = columns[0].text.strip().replace(columns[0].span.text.strip(), "").replace("(Einzelheiten)", "")
-                    else:
-                        date = columns[0].text.strip().replace("(Einzelheiten)", "")
-                    feedback = {
-                        'date': date,
-                        'mark': mark,
-                        'comment': columns[2].text.strip(),
-                        'author': columns[3].find_next('a', href=True).find_next('a', href=True).text.strip()
-                    }
-                    feedback_reviews.append(feedback)
-
-            return feedback_reviews
-        
-        def scrape_Badge():
-            """
-            Not each user has a badge, therefore only scrape if exists, otherwise return None
-            """
-            def find_target_element(tag):
-                return tag.name == 'h4' and 'ct-legend' in tag.get('class', []) and 'Abzeichen' in tag.get_text()
-            badge = soup.find(find_target_element)
-            if badge:
-                self.log.debug(f"Badge exists! Now scraping...")
-                badge = re.findall("[a-zA-Z]+", badge.next_sibling.select("li a")[0].text)[0]
-            return badge
-
-        # Now we call each function to scrape the whole profile information
-        badge = scrape_Badge()
-
-        trading_activity = scrape_Handlesaktivitaet()
-        feedback_stats = scrape_Feedback()
-        feedback_reviews = scrape_Feedback_Entries()
-
-        fingerprint = soup.find('pre')
-        if fingerprint:
-            fingerprint = fingerprint.text.strip()
-        else:
-            fingerprint = None
-        public_key = soup.find('pre', style='line-height:15px;user-select:all')
-        if public_key:
-            public_key = public_key.text.strip()
-        else:
-            public_key = None
-        # Then we return all informations for later usage to save
-        return badge, trading_activity, feedback_stats, feedback_reviews, fingerprint, public_key
+        return self.parser.parse(tree)
 
     def get_data(self, link):
         """
-         Create a new session to connect to the given link. Use cookies, when set
+         Send a request to the given link on one of the pooled Tor circuits, using its current cookie
 
         Args:
             link (String): Link .onion website that the request should be sent to
@@ -216,19 +143,58 @@ class User_Detailed_Profiles():
         Returns:
             requests.Response: The Response to the request sent prior
         """
-        session = requests.session()
-        session.proxies = {'http':  'socks5h://localhost:9050',
-                        'https': 'socks5h://localhost:9050'}
-        if self.cookies:
-            return session.get(link, cookies=self.cookies)
-        return session.get(link)
+        return self.transport.get(link)
         
-    def solve_captcha(self, url, response):
+    def get_page(self, url):
         """
-        This method is called on each request that is sent to handle a captcha.
-        It returns the given soup, if we cannot find a captcha in the response. Therefore, there are no new requests sent, if the response already contains the information we're looking for (AKA NOT the captcha)
-        
-        Once a captcha is detected, the while-loop will be entered and won't be left unless the response is not a captcha, or the user decides to save the current users it has accumulated.
+        Sends a request through the shared captcha gate and returns the response without captcha.
+        This method is used by all profile workers concurrently. Before each request the worker waits at the gate,
+        so no request is sent while a captcha is being solved. If the response contains a captcha, the gate is closed,
+        the operator is asked once (see solve_captcha) and the request is retried with the new cookie.
+
+        Args:
+            url (String): The (userlist or user profile) link to visit
+
+        Returns:
+            requests.Response: response without captcha, None if the request failed or the user decided to save
+        """
+        while True:
+            generation = self.gate.wait()
+            if self.gate.stopped:
+                return None
+            try:
+                response = self.get_data(url)
+            except requests.RequestException as err:
+                self.metrics.record_error()
+                self.log.warning(f"Failed to retrieve {url}: {type(err).__name__}")
+                return None
+            if response.status_code != 200:
+                self.log.warning(f"Failed to retrieve {url}: {response.status_code}")
+                return None
+            if not has_captcha(response.content):
+                return response
+            self.log.debug(f"Captcha detected when visiting {url}! Current cookie: {self.transport.get_cookie()}")
+            if not self.gate.solve(generation, self.solve_captcha):
+                self.status = True
+                return None
+
+    def get_soup(self, url):
+        """
+        Args:
+            url (String): The userlist link to visit
+
+        Returns:
+            BeautifulSoup: soup of website without captcha, None if the request failed or the user decided to save
+        """
+        response = self.get_page(url)
+        if response is None:
+            return None
+        with self.metrics.timed("parse", url=url, page_type="userlist"):
+            return BeautifulSoup(response.content, features='html.parser')
+
+    def solve_captcha(self):
+        """
+        This method is called once per detected captcha, while all workers wait at the captcha gate.
         3. Options are given: Continue with existing cookies, enter a new cookie or save current user data.
         The user has to input either 
             1.'continue', 
@@ -238,130 +204,168 @@ class User_Detailed_Profiles():
             
             WITHOUT any spaces!
 
-        Args:
-            url (String): The current (user profile) link which captcha needs to be solved for
-            response (requests.Response): The response that potentially has a captcha
-            
         Returns:
-            BeautifulSoup: soup of website without captcha
+            bool: True if the workers should retry their requests, False if the user decided to save the current users
 
         """
-        soup = BeautifulSoup(response.content, features='html.parser')
-        while soup.find("iframe", {"name":"captcha"}):
-            self.log.debug(f"Captcha detected when visiting {url}! Current cookie(s): {self.cookies}")
+        # Slow down before crawling on, the captcha shows we were too fast for the service
+        if self.transport.limiter:
+            self.transport.limiter.backoff("captcha")
+        while True:
             user_input = input("Captcha detected!\n3. Options: Continue by typing 'continue', give me a new cookie or save current data. Please enter the information in the following format:\ncookie:[THE COOKIE]\n(NO SPACES!)\nOr simply type 'save'\n")
             self.log.debug(f"User input: {user_input}")
             if user_input.lower() == "continue":
-                self.log.debug(f"Continuing with same cookie as before: {self.cookies}")
-                new_response = self.get_data(url)
+                self.log.debug(f"Continuing with same cookie as before: {self.transport.get_cookie()}")
+                return True
             elif "cookie" in user_input.lower():
                 user_input = user_input.split(":")
-                self.cookies = { 'PHPSESSID': user_input[1].strip()}
-                new_response = self.get_data(url)
+                self.transport.set_cookie(user_input[1].strip())
+                return True
             elif user_input.lower() == "save":
                 self.log.debug(f"Saving crawled data.")
-                self.status = True
-                break
+                return False
             else:
                 self.log.debug(f"Input invalid.")
-                continue
-            if new_response.status_code == 200:
-                soup = BeautifulSoup(new_response.content, 'html.parser')
 
-        return soup
+    def crawl_profile(self, user):
+        """
+        Visits the profile of a user from the userlist and scrapes the detailed information. Runs in a worker thread.
+
+        Args:
+            user (dict): The user information found on the userlist, including the 'link' to the profile
+
+        Returns:
+            dict: The detailed user information, None if the profile could not be retrieved
+        """
+        # Send an HTTP GET request to the each profile to get detailed information
+        self.log.debug(f"Connecting to {user['name']}'s profile on {user['link']}.")
+        response = self.get_page(user['link'])
+        if response is None:
+            return None
+        self.log.debug(f"Succesfully connected to {user['name']}'s profile.")
+        # A profile unchanged since it was parsed earlier today is not parsed again
+        cache = self.transport.cache
+        details = cache.get_parsed(user['link'], response) if cache else None
+        if details is None:
+            with self.metrics.timed("parse", url=user['link'], page_type="profile"):
+                details = self.get_profile_details(parse_profile_page(response.content))
+            if cache:
+                cache.set_parsed(user['link'], response, details)
+        badge, trade_activity, feedback_stats, feedback_reviews, fingerprint, pk = details
+
+        # Duplicated, so the entry won't be infected with an _id from pymongo
+        return {
+            'name': user['name'],
+            'title': user['title'],
+            'number_of_posts': user['number_of_posts'],
+            'points': user['points'],
+            'registration_date': user['registration_date'],
+            'badge': badge,
+            'trade_activity': trade_activity,
+            'feedback_statistic': feedback_stats,
+            'feedback_reviews': feedback_reviews,
+            'fingerprint': fingerprint,
+            'public_key': pk,
+            'crawled_datetime': self.crawled_datetime
+        }
+
+    def retry_dead_letters(self):
+        """
+        Gives the userlist pages and profiles that failed during the crawl one more attempt.
+        A recovered userlist page is followed by its 'next' links up to the first page already crawled.
+        Whatever still fails stays pending in the CrawlState and is crawled again when the crawl is resumed.
+        """
+        dead_pages, self.dead_pages = self.dead_pages, []
+        for page in dead_pages:
+            self.log.info(f"Retrying userlist page {page}.")
+            self.current_page = page
+            while self.current_page and self.current_page not in self.visited and not self.status:
+                self.crawl_profiles()
+        self.current_page = None
+        if self.dead_profiles and not self.status:
+            self.log.info(f"Retrying {len(self.dead_profiles)} profiles that could not be retrieved.")
+            dead_profiles, self.dead_profiles = self.dead_profiles, []
+            self.dead_profiles = self.__crawl_users(dead_profiles, len(dead_profiles))
+        if self.dead_pages or self.dead_profiles:
+            self.log.error(f"{len(self.dead_pages)} userlist pages and {len(self.dead_profiles)} profiles could not be "
+                           "retrieved, they are crawled again when the crawl is resumed.")
 
     def crawl_profiles(self):
         """
         This method crawls all users on the current userlist page. It also visits each user profile to scrape the detailed information and then saves the data into a DB
+        The profiles of a page are visited concurrently by config.CRAWLER_MAX_WORKERS workers, the users are saved in page order.
         """
-        # self.log.debug(f"")
-        # self.log.info(f"")
-        # self.log.error(f"")
-        # self.log.warning(f"")
-
         # Send an HTTP GET request to the URL
         self.log.debug(f"Now connecting to {self.current_page}.")
-        response = self.get_data(self.current_page)
+        soup = self.get_soup(self.current_page)
 
         # Check if the response is successful
-        if response.status_code == 200:
-            self.log.info(f"Succesful connection! Scraping Users from {self.current_page}!")
-            if not self.current_page in self.visited:
-                
-                # Parse the HTML content using BeautifulSoup
-                soup = self.solve_captcha(self.current_page, response)
-                if self.status:
-                    return
-                # Find the <tbody> element containing user information
-                tbody = soup.find('tbody')
-
-                # Iterate through each user's <tr> element within the <tbody>
-                try:
-                    user_rows = tbody.find_all('tr')
-                except:
-                    # If we cannot find any users on the current page, we simply skip this page and hop on the new one...
-                    self.log.error(f"Can't find user list on {self.current_page}. Skipping...")
-                    user_rows = []
-                    
-                for user_row in tqdm(user_rows):
-                    # Extract user information from <td> elements within the row
-                    columns = user_row.find_all('td')
-                    name = columns[0].find('a').text.strip()
-                    profile_link = columns[0].find('a')['href']
-                    title = columns[1].text.strip()
-                    num_posts = columns[2].text.strip().split()[0]
-                    points = columns[3].text.strip().split()[0]
-                    reg_date = columns[4].text.strip()
-                    # Sometimes the users have 'Heute' or 'Gestern' as their registration date instead the actual date, so we change that into the actual date
-                    if reg_date=="Heute":
-                        reg_date = datetime.today().strftime('%Y-%m-%d')
-                    if reg_date=="Gestern":
-                        yesterday = datetime.now() - timedelta(1)
-                        reg_date = datetime.strftime(yesterday, '%Y-%m-%d')
-                    # Send an HTTP GET request to the each profile to get detailed information
-                    self.log.debug(f"Connecting to {name}'s profile on {profile_link}.")
-                    response_detailed = self.get_data(profile_link)
-                    if response_detailed.status_code == 200:
-                        self.log.debug(f"Succesfully connected to {name}'s profile.")
-                        detailed_soup = self.solve_captcha(profile_link, response_detailed)
-                        if self.status:
-                            return
-                        badge, trade_activity, feedback_stats, feedback_reviews, fingerprint, pk = self.get_profile_details(detailed_soup)
-
-                    # Duplicated, so the entry won't be infected with an _id from pymongo
-                    self.users.append({
-                        'name': name,
-                        'title': title,
-                        'number_of_posts': int(num_posts),
-                        'points': int(points),
-                        'registration_date': reg_date,
-                        'badge': badge,
-                        'trade_activity': trade_activity,
-                        'feedback_statistic': feedback_stats,
-                        'feedback_reviews': feedback_reviews,
-                        'fingerprint': fingerprint,
-                        'public_key': pk,
-                        'crawled_datetime': self.crawled_datetime
-                    })
-                    # Append user information to the list
-                    self.log.debug(f"{len(self.users)-self.sum_row}/{len(user_rows)} users crawled.")
-            else:
-                self.log.debug(f"{self.current_page} already visited! Skipping.")
-            # Finished scraping current website, add to visited and look for next one
-            self.visited.add(self.current_page)
-            # Count the users already added, for debugging purposes
-            self.sum_row += len(user_rows)
-
-            # Find the "next" link in the header
+        if soup is None:
+            # If the userlist returns an error, we continue with the next known page and retry this one at the end
+            if not self.status:
+                self.log.warning(f"Failed to retrieve the current URL: {self.current_page}! Retrying it at the end.")
+                self.dead_pages.append(self.current_page)
+                self.current_page = next_known_page(self.current_page)
+            return
+        self.log.info(f"Succesful connection! Scraping Users from {self.current_page}!")
+        users = []
+        if not self.current_page in self.visited:
+            # The userlist is parsed exactly like in the general crawl
+            users = parse_userlist_rows(soup, self.crawled_datetime)
+            if users is None:
+                # If we cannot find any users on the current page, we simply skip this page and hop on the new one...
+                self.log.error(f"Can't find user list on {self.current_page}. Skipping...")
+                users = []
+
+            # Checkpoint the page with its profiles, and skip the profiles already stored by an earlier run
             next_link = soup.find('link', rel='next')
-            if next_link:
-                self.current_page = next_link['href']  # Update the current URL
-            else:
-                self.current_page = None  # No more "next" link found, exit the loop
+            self.state.add_page(self.current_page, next_link['href'] if next_link else None,
+                                [user['link'] for user in users])
+            done_profiles = self.state.get_done_profiles(self.current_page)
+            if done_profiles:
+                self.log.info(f"Skipping {len(done_profiles)} profiles stored by an earlier run.")
+                self.user_count += len(done_profiles)
+            pending_users = [user for user in users if user['link'] not in done_profiles]
+            self.dead_profiles.extend(self.__crawl_users(pending_users, len(users)))
+            if self.status:
+                return
+        else:
+            self.log.debug(f"{self.current_page} already visited! Skipping.")
+        # Finished scraping current website, add to visited and look for next one
+        self.visited.add(self.current_page)
+        # Count the users already added, for debugging purposes
+        self.sum_row += len(users)
+
+        # Find the "next" link in the header
+        next_link = soup.find('link', rel='next')
+        if next_link:
+            self.current_page = next_link['href']  # Update the current URL
         else:
-            # If the userlist returns an error, we stop crawling and sent out a warning.
-            self.log.warning(f"Failed to retrieve the current URL: {self.current_page}!")
-            self.status = True
+            self.current_page = None  # No more "next" link found, exit the loop
+
+    def __crawl_users(self, users, page_size):
+        """
+        Visits the profiles of the given users concurrently with config.CRAWLER_MAX_WORKERS workers
+        and saves the detailed users in order.
+
+        Args:
+            users (list): The users found on a userlist page
+            page_size (int): Number of users on the page, for the debug output
+
+        Returns:
+            list: The users whose profile could not be retrieved
+        """
+        failed = []
+        with ThreadPoolExecutor(max_workers=config.CRAWLER_MAX_WORKERS) as executor:
+            for user, detailed_user in zip(users, tqdm(executor.map(self.crawl_profile, users), total=len(users))):
+                if detailed_user is None:
+                    if not self.status:
+                        failed.append(user)
+                    continue
+                self.pipeline.put(detailed_user, key=user['link'])
+                self.user_count += 1
+                self.log.debug(f"{self.user_count-self.sum_row}/{page_size} users crawled.")
+        return failed
 
 class User_Profiles():
     """
@@ -369,43 +373,91 @@ class User_Profiles():
     (NO INTERACTION needed)
 
     Difference: We expect a valid cookie to be given.
+    Userlist pages that still fail after their retries are retried once more at the end of the crawl.
     """
-    def __init__(self, start_page: int, helper: Helper, db: MySQLConnector = None):
+    def __init__(self, start_page: int, helper: Helper, db: MySQLConnector = None, transport: CircuitPool = None,
+                 parallel: bool = False, crawled_datetime=None):
         # Keep track of already visited urls
         self.log = helper.log
         self.log.info("General user_info crawl: Starting to crawl the general user information.")
         self.visited = set()
         self.current_page = config.CRAWLER_USERLIST_LINKS[start_page]
-        # Initialize an empty list to store user information
-        self.users = []
+        # Number of users crawled so far
+        self.user_count = 0
         # Determine whether to already save currently crawled data
         self.status = False
+        # Userlist pages that could not be retrieved, retried at the end of the crawl
+        self.dead_pages = []
         self.sum_row = 0
-        self.cookies = { 'PHPSESSID': config.CRAWLER_COOKIE }
+        self.transport = transport if transport else CircuitPool(helper)
+        self.transport.set_cookie(config.CRAWLER_COOKIE)
+        # Requests, parse and database time of this crawl, stored in the crawl_metrics table
+        self.metrics = CrawlMetrics(helper, "users_general")
 
-        self.crawled_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        while self.current_page and not self.status:
-            self.crawl_profiles()
-            
-        # Save the collected user information to a JSON file
+        self.crawled_datetime = crawled_datetime or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         time_now = datetime.now().strftime("%Y-%m-%d_%H-%M")
-        with open(f"./data/user_information_{time_now}.json", 'w') as json_file:
-            json.dump(self.users, json_file, indent=4)
-        self.log.info("User information saved to 'user_information.json'")
-        
-        # If a MySQLConnector Object is given and exists, load collected data into that DB
+        # Stream the collected user information to a JSONL file and, if a MySQLConnector Object is given, into that DB
+        self.pipeline = WriteThroughPipeline(
+            helper,
+            f"./data/user_information_{time_now}.jsonl",
+            load_batch=db.bulk_load_user_general if db else None
+        )
+        self.metrics.attach(self.transport)
         if db:
-            db.bulk_load_user_general(self.users)
+            db.track_metrics(self.metrics)
+
+        crashed = True
+        try:
+            # The parallel mode fetches all known pages at once, remaining pages are followed one by one
+            if parallel:
+                self.crawl_pages_parallel(start_page)
+            while self.current_page and not self.status:
+                self.crawl_profiles()
+            if not self.status:
+                self.retry_dead_letters()
+            crashed = False
+        finally:
+            self.pipeline.close()
+            self.metrics.detach(self.transport)
+            # The dashboards switch to this crawl once it went through, an aborted crawl or one with userlist pages
+            # that could not be retrieved or records that could not be stored leaves them on the previous one
+            finished = not crashed and not self.status and not self.dead_pages and not self.pipeline.failed
+            # Unfinished and crashed crawls are stored too, their crawl stage counts as an error
+            self.metrics.stop(self.user_count, error=not finished)
+            self.metrics.log_stats()
+            if db:
+                db.load_metrics(self.metrics, self.crawled_datetime)
+        self.transport.log_stats()
+        if db and finished:
+            db.finish_run("users_general", self.crawled_datetime)
 
 
     def get_data(self, link):
-        session = requests.session()
-        session.proxies = {'http':  'socks5h://localhost:9050',
-                        'https': 'socks5h://localhost:9050'}
-        if self.cookies:
-            return session.get(link, cookies=self.cookies)
-        return session.get(link)
+        """
+        Returns:
+            requests.Response: The response, None if the request still failed after its retries
+        """
+        try:
+            return self.transport.get(link)
+        except requests.RequestException as err:
+            self.metrics.record_error()
+            self.log.warning(f"Failed to retrieve {link}: {type(err).__name__}")
+            return None
+
+    def retry_dead_letters(self):
+        """
+        Gives the userlist pages that failed during the crawl one more attempt.
+        A recovered page is followed by its 'next' links up to the first page already crawled.
+        """
+        dead_pages, self.dead_pages = self.dead_pages, []
+        for page in dead_pages:
+            self.log.info(f"Retrying userlist page {page}.")
+            self.current_page = page
+            while self.current_page and self.current_page not in self.visited and not self.status:
+                self.crawl_profiles()
+        self.current_page = None
+        if self.dead_pages:
+            self.log.error(f"{len(self.dead_pages)} userlist pages could not be retrieved: {self.dead_pages}")
 
     def crawl_profiles(self):
         # Send an HTTP GET request to the URL
@@ -413,67 +465,227 @@ class User_Profiles():
         response = self.get_data(self.current_page)
 
         # Check if the response is successful
-        if response.status_code == 200:
+        if response is not None and response.status_code == 200:
             self.log.info(f"Succesful connection! Scraping Users from {self.current_page}!")
+            users = []
             if not self.current_page in self.visited:
-                
-                # Parse the HTML content using BeautifulSoup
-                soup = BeautifulSoup(response.content, features='html.parser')
-                if self.status:
+                users, next_link = self.parse_page(self.current_page, response)
+                if not users:
+                    self.log.error("Cannot find user list. Probably invalid cookie!")
+                    self.status = True
                     return
-                # Find the <tbody> element containing user information
-                tbody = soup.find('tbody')
-
-                # Iterate through each user's <tr> element within the <tbody>
-                try:
-                    user_rows = tbody.find_all('tr')
-                    if not user_rows:
-                        self.log.error("Cannot find user list. Probably invalid cookie!")
-                        self.status = True
-                        return
-                except:
-                    self.log.error(f"Can't find user list on {self.current_page}.")
-                    pass
-                
-                for user_row in tqdm(user_rows):
-                    # Extract user information from <td> elements within the row
-                    columns = user_row.find_all('td')
-                    name = columns[0].find('a').text.strip()
-                    profile_link = columns[0].find('a')['href']
-                    title = columns[1].text.strip()
-                    num_posts = columns[2].text.strip().split()[0]
-                    points = columns[3].text.strip().split()[0]
-                    reg_date = columns[4].text.strip()
-                    if reg_date=="Heute":
-                        reg_date = datetime.today().strftime('%Y-%m-%d')
-                    if reg_date=="Gestern":
-                        yesterday = datetime.now() - timedelta(1)
-                        reg_date = datetime.strftime(yesterday, '%Y-%m-%d')
-
-                    curr_user = {
-                        'name': name,
-                        'title': title,
-                        'link': profile_link,
-                        'number_of_posts': int(num_posts),
-                        'points': int(points),
-                        'registration_date': reg_date,
-                        'crawled_datetime': self.crawled_datetime
-                    }
-                    self.users.append(curr_user)
-                    # Append user information to the list
-                    self.log.debug(f"{len(self.users)-self.sum_row}/{len(user_rows)} users crawled.")
+                for user in tqdm(users):
+                    self.pipeline.put(user)
+                    self.user_count += 1
+                    self.log.debug(f"{self.user_count-self.sum_row}/{len(users)} users crawled.")
             else:
                 self.log.debug(f"{self.current_page} already visited! Skipping.")
+                next_link = None
             # Finished scarping, add to visited
             self.visited.add(self.current_page)
-            self.sum_row += len(user_rows)
-
-            # Find the "next" link in the header
-            next_link = soup.find('link', rel='next')
-            if next_link:
-                self.current_page = next_link['href']  # Update the current URL
-            else:
-                self.current_page = None  # No more "next" link found, exit the loop
+            self.sum_row += len(users)
+            # Continue with the "next" link in the header, if there is none we are done
+            self.current_page = next_link
         else:
-            self.log.warning(f"Failed to retrieve the current URL: {self.current_page}!")
-            self.status = True
+            # Continue with the next known page, this one is retried at the end
+            self.log.warning(f"Failed to retrieve the current URL: {self.current_page}! Retrying it at the end.")
+            self.dead_pages.append(self.current_page)
+            self.current_page = next_known_page(self.current_page)
+
+    def parse_page(self, link, response):
+        """
+        Parses a userlist page, unless the page is unchanged since it was parsed earlier today.
+
+        Args:
+            link (str): The userlist page
+            response (requests.Response): The response of the page
+
+        Returns:
+            tuple: The list of user dictionaries (None if the page has no user list) and the link to the next page (or None)
+        """
+        page = self.__get_cached_page(link, response)
+        if page is None:
+            with self.metrics.timed("parse", url=link, page_type="userlist"):
+                page = parse_userlist_page(response.content, self.crawled_datetime)
+            if self.transport.cache:
+                self.transport.cache.set_parsed(link, response, list(page))
+        return page
+
+    def __get_cached_page(self, link, response):
+        """
+        Returns:
+            tuple or None: The cached users and next link of an unchanged page, stamped with the current crawling date.
+        """
+        cache = self.transport.cache
+        page = cache.get_parsed(link, response) if cache else None
+        if page is None:
+            return None
+        users, next_link = page
+        for user in users or []:
+            user['crawled_datetime'] = self.crawled_datetime
+        return users, next_link
+
+    def crawl_pages_parallel(self, start_page):
+        """
+        Fetches all known userlist pages from the start page on concurrently, parses them in a process pool
+        and hands the users to the pipeline in page order.
+
+        The pages are merged up to the first page without a "next" link. If the last known page still has a
+        "next" link, the userlist has grown and the remaining pages are crawled sequentially afterwards.
+
+        Args:
+            start_page (int): Index of the first page in config.CRAWLER_USERLIST_LINKS
+        """
+        links = config.CRAWLER_USERLIST_LINKS[start_page:]
+        self.log.info(f"Fetching {len(links)} userlist pages concurrently.")
+        with ThreadPoolExecutor(max_workers=config.CRAWLER_MAX_WORKERS) as fetcher:
+            responses = list(fetcher.map(self.get_data, links))
+        contents = [response.content if response is not None and response.status_code == 200 else None
+                    for response in responses]
+        # Pages unchanged since they were parsed earlier today are taken from the cache, the others are parsed in parallel
+        cache = self.transport.cache
+        pages = [self.__get_cached_page(link, response) if content else None
+                 for link, response, content in zip(links, responses, contents)]
+        with ProcessPoolExecutor(max_workers=config.CRAWLER_PARSE_WORKERS, mp_context=PARSE_CONTEXT) as parser:
+            parsed_pages = parser.map(timed_parse_userlist_page, [content if page is None else None
+                                                                  for content, page in zip(contents, pages)],
+                                      repeat(self.crawled_datetime))
+            for idx, (parsed_page, start, seconds, pid) in enumerate(parsed_pages):
+                if pages[idx] is None:
+                    pages[idx] = parsed_page
+                    if contents[idx] is not None:
+                        self.metrics.record("parse", seconds)
+                        if profiler.tracer:
+                            profiler.tracer.add_span("parse", start, seconds, pid=pid, url=links[idx], page_type="userlist")
+                    if cache and contents[idx] is not None:
+                        cache.set_parsed(links[idx], responses[idx], list(parsed_page))
+
+        self.current_page = None
+        for link, content, (users, next_link) in zip(links, contents, pages):
+            self.visited.add(link)
+            if content is None:
+                self.log.warning(f"Failed to retrieve the current URL: {link}! Retrying it at the end.")
+                self.visited.discard(link)
+                self.dead_pages.append(link)
+                continue
+            if not users:
+                self.log.error(f"Cannot find user list on {link}. Probably invalid cookie!")
+                self.status = True
+                return
+            for user in users:
+                self.pipeline.put(user)
+            self.user_count += len(users)
+            self.sum_row += len(users)
+            self.log.debug(f"{len(users)} users crawled from {link}.")
+            self.current_page = next_link
+            if not next_link:
+                # The userlist ends here, any later page is stale
+                return
+        if self.current_page in self.visited:
+            self.current_page = None
+        elif self.current_page:
+            self.log.info("Userlist has more pages than known, following the 'next' links.")
+
+def next_known_page(link):
+    """
+    Args:
+        link (str): A userlist page
+
+    Returns:
+        str: The page following it in config.CRAWLER_USERLIST_LINKS, None if there is none
+    """
+    if link not in config.CRAWLER_USERLIST_LINKS:
+        return None
+    idx = config.CRAWLER_USERLIST_LINKS.index(link) + 1
+    return config.CRAWLER_USERLIST_LINKS[idx] if idx < len(config.CRAWLER_USERLIST_LINKS) else None
+
+def parse_userlist_page(content, crawled_datetime):
+    """
+    Parses a userlist page into general user records.
+    Defined on module level, so pages can be parsed in a process pool.
+
+    Args:
+        content (bytes): The HTML content of the userlist page, None if it could not be retrieved
+        crawled_datetime (str): The crawling date stored with every user
+
+    Returns:
+        tuple: The list of user dictionaries (None if the page has no user list) and the link to the next page (or None)
+    """
+    if content is None:
+        return None, None
+    soup = BeautifulSoup(content, features='html.parser')
+    next_link = soup.find('link', rel='next')
+    next_link = next_link['href'] if next_link else None
+    return parse_userlist_rows(soup, crawled_datetime), next_link
+
+def timed_parse_userlist_page(content, crawled_datetime):
+    """
+    Parses a userlist page like parse_userlist_page() and measures the time spent on it in the worker process.
+
+    Returns:
+        tuple: The result of parse_userlist_page(), the time.perf_counter() the parsing started at, the seconds
+        spent parsing and the ID of the worker process
+    """
+    start = time.perf_counter()
+    page = parse_userlist_page(content, crawled_datetime)
+    return page, start, time.perf_counter() - start, os.getpid()
+
+def parse_userlist_rows(soup, crawled_datetime):
+    """
+    Extracts the users listed in the table of a parsed userlist page.
+
+    Args:
+        soup (BeautifulSoup): The parsed userlist page
+        crawled_datetime (str): The crawling date stored with every user
+
+    Returns:
+        list: The user dictionaries, None if the page has no user list
+    """
+    # Find the <tbody> element containing user information
+    tbody = soup.find('tbody')
+    if not tbody:
+        return None
+
+    users = []
+    # Iterate through each user's <tr> element within the <tbody>
+    for user_row in tbody.find_all('tr'):
+        # Extract user information from <td> elements within the row
+        columns = user_row.find_all('td')
+        name = columns[0].find('a').text.strip()
+        profile_link = columns[0].find('a')['href']
+        title = columns[1].text.strip()
+        num_posts = columns[2].text.strip().split()[0]
+        points = columns[3].text.strip().split()[0]
+        reg_date = columns[4].text.strip()
+        with profiler.span("normalise", field="registration_date"):
+            if reg_date=="Heute":
+                reg_date = datetime.today().strftime('%Y-%m-%d')
+            if reg_date=="Gestern":
+                yesterday = datetime.now() - timedelta(1)
+                reg_date = datetime.strftime(yesterday, '%Y-%m-%d')
+
+        users.append({
+            'name': name,
+            'title': title,
+            'link': profile_link,
+            'number_of_posts': int(num_posts),
+            'points': int(points),
+            'registration_date': reg_date,
+            'crawled_datetime': crawled_datetime
+        })
+    return users
+
+def has_captcha(content):
+    """
+    Checks whether a page is the captcha page instead of the requested one.
+    The page is only parsed if its content mentions the captcha at all.
+
+    Args:
+        content (bytes): The HTML content of the page
+
+    Returns:
+        bool: True if the page contains the captcha iframe
+    """
+    if b"captcha" not in content:
+        return False
+    return bool(html.fromstring(content).xpath('//iframe[@name="captcha"]'))
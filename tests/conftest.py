@@ -0,0 +1,36 @@
+# Copyright (C) 2023 Martin Pretz
+
+import os
+import sys
+import pytest
+
+# The crawler modules import each other as top-level modules, like when started from the crawler directory
+CRAWLER_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "crawler")
+sys.path.insert(0, CRAWLER_PATH)
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+from helper import Helper
+
+@pytest.fixture(scope="session")
+def helper(tmp_path_factory):
+    """
+    The logger of the tests, logging to a temporary file. Created once, since every Helper adds its handlers.
+    """
+    return Helper(str(tmp_path_factory.mktemp("log") / "crawler.log"))
+
+def pytest_addoption(parser):
+    parser.addoption("--benchmarks", action="store_true", help="Also run the timing comparisons marked as benchmark")
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "benchmark: timing comparison that depends on the machine, run with --benchmarks")
+
+def pytest_collection_modifyitems(config, items):
+    """
+    Skips the timing comparisons unless --benchmarks is given, they are not stable on a busy machine.
+    """
+    if config.getoption("--benchmarks"):
+        return
+    skip = pytest.mark.skip(reason="timing comparison, run with --benchmarks")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
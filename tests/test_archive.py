@@ -0,0 +1,33 @@
+# Copyright (C) 2023 Martin Pretz
+
+import os
+from archive import PageArchive
+from transport import Transport
+
+def start_run(helper, path, keep_runs):
+    archive = PageArchive(helper, str(path), keep_runs=keep_runs)
+    archive.attach(Transport(helper, proxy=None))
+    return archive
+
+def test_only_the_most_recent_runs_are_kept(helper, tmp_path):
+    digests = []
+    for run in range(3):
+        archive = start_run(helper, tmp_path, keep_runs=2)
+        # The index page is the same in every run, the profile changes
+        archive.store("http://germania.test/", b"<html>index</html>")
+        digests.append(archive.store("http://germania.test/profile.php?id=1", "<html>run {}</html>".format(run).encode()))
+
+    assert [run_id for run_id, _, _ in archive.get_runs()] == [2, 3]
+    blobs = [name for _, _, names in os.walk(tmp_path / "blobs") for name in names]
+    assert len(blobs) == 3
+    assert not any(name.startswith(digests[0]) for name in blobs)
+    for run_id in (2, 3):
+        for _, digest in archive.get_fetches(run_id).values():
+            assert archive.load(digest).startswith(b"<html>")
+
+def test_all_runs_are_kept_without_limit(helper, tmp_path):
+    for run in range(3):
+        archive = start_run(helper, tmp_path, keep_runs=None)
+        archive.store("http://germania.test/", "<html>run {}</html>".format(run).encode())
+
+    assert [pages for _, _, pages in archive.get_runs()] == [1, 1, 1]
@@ -0,0 +1,118 @@
+# Copyright (C) 2023 Martin Pretz
+
+import re
+import pytest
+from types import SimpleNamespace
+from mysql.connector.conversion import MySQLConverter
+from mysql.connector.cursor import MySQLCursor, RE_SQL_INSERT_STMT
+from database import MySQLConnector
+from metrics import CrawlMetrics
+from benchmark_db import StandInServer, StandInCursor, make_forum_data, make_detailed_users
+
+CRAWLING_DATE = "2023-09-02 08:00:00"
+
+@pytest.fixture
+def server():
+    # No costs, only the AUTO_INCREMENT counters and the inserted rows are of interest
+    return StandInServer(round_trip=0.0, row_cost=0.0, commit_cost=0.0)
+
+# The stand-in reports innodb_autoinc_lock_mode 1, without consecutive IDs the rows are inserted one by one
+@pytest.mark.parametrize("id_step", [1, None])
+def test_load_forums_references_the_assigned_ids(helper, server, monkeypatch, id_step):
+    monkeypatch.setattr("config.MYSQL_BATCH_SIZE", 7)
+    # IDs of earlier crawls are taken
+    server.auto_increment.update({"forums": 40, "subforums": 300})
+    db = MySQLConnector(helper, server.connect())
+    assert db.id_step == 1
+    db.id_step = id_step
+    db.load_forums(make_forum_data(3, 4, 5, CRAWLING_DATE))
+
+    forums = {row["forum_id"]: row for row in server.tables["forums"]}
+    subforums = {row["subforum_id"]: row for row in server.tables["subforums"]}
+    assert sorted(forums) == list(range(41, 44))
+    assert sorted(subforums) == list(range(301, 313))
+    for subforum in subforums.values():
+        # forum0 holds subforum0_0 to subforum0_3
+        assert subforum["title"].startswith("sub" + forums[subforum["forum_id"]]["title"] + "_")
+    posts = server.tables["posts"]
+    assert len(posts) == 3 * 4 * 5
+    for post in posts:
+        assert post["title"].startswith(subforums[post["subforum_id"]]["title"].replace("subforum", "topic") + "_")
+
+@pytest.mark.parametrize("id_step", [1, None])
+def test_bulk_load_user_detailed_references_the_assigned_ids(helper, server, monkeypatch, id_step):
+    monkeypatch.setattr("config.MYSQL_BATCH_SIZE", 7)
+    monkeypatch.setattr("config.MYSQL_COMMIT_BATCH_SIZE", 10)
+    server.auto_increment["users_detailed"] = 1000
+    db = MySQLConnector(helper, server.connect())
+    db.id_step = id_step
+    db.bulk_load_user_detailed(make_detailed_users(25, 3, CRAWLING_DATE))
+
+    users = {row["user_id"]: row for row in server.tables["users_detailed"]}
+    assert sorted(users) == list(range(1001, 1026))
+    feedback = server.tables["users_feedback"]
+    assert len(feedback) == 25 * 3
+    for review in feedback:
+        assert users[review["user_id"]]["name"] == "user{}".format(review["user_id"] - 1001)
+
+def test_bulk_load_user_detailed_falls_back_to_single_users(helper, server, monkeypatch):
+    monkeypatch.setattr("config.MYSQL_COMMIT_BATCH_SIZE", 10)
+    users = make_detailed_users(25, 3, CRAWLING_DATE)
+    # Longer than the comment column, the batch of users 10 to 19 fails
+    users[12]["feedback_reviews"][1]["comment"] = "x" * 300
+    # Longer than the name column, the user cannot be stored at all
+    users[15]["name"] = "y" * 300
+    db = MySQLConnector(helper, server.connect())
+    failed = db.bulk_load_user_detailed(users)
+
+    assert failed == [users[15]]
+    names = [row["name"] for row in server.tables["users_detailed"]]
+    assert names == ["user{}".format(idx) for idx in range(25) if idx != 15]
+    feedback = server.tables["users_feedback"]
+    assert len(feedback) == 24 * 3 - 1
+    user_ids = {row["name"]: row["user_id"] for row in server.tables["users_detailed"]}
+    assert [review["comment"] for review in feedback if review["user_id"] == user_ids["user12"]] == \
+        ["great stuff 0", "great stuff 2"]
+
+@pytest.mark.parametrize("latest_run_id, refreshed", [(1, True), (2, False)])
+def test_finish_run_keeps_a_newer_snapshot(helper, server, monkeypatch, latest_run_id, refreshed):
+    db = MySQLConnector(helper, server.connect())
+    # The stand-in numbers the finished crawl as run 1
+    monkeypatch.setattr(db, "get_latest_run", lambda crawler: latest_run_id)
+    refreshes = []
+    monkeypatch.setattr(db, "refresh_latest_tables", lambda tables, run_id: refreshes.append(run_id))
+    db.finish_run("forums", CRAWLING_DATE)
+
+    assert refreshes == ([1] if refreshed else [])
+
+def test_executemany_statements_are_sent_as_multi_row_inserts(helper, server, monkeypatch):
+    # The statement rewriting of mysql.connector's executemany, which the stand-in does not do itself
+    connector_cursor = MySQLCursor()
+    connector_cursor._connection = SimpleNamespace(python_charset="utf8", sql_mode=None, converter=MySQLConverter("utf8mb4"))
+    statements = []
+    executemany = StandInCursor.executemany
+    def rewritten(cursor, query, rows):
+        assert re.match(RE_SQL_INSERT_STMT, query)
+        statements.append(connector_cursor._batch_insert(query, rows))
+        executemany(cursor, query, rows)
+    monkeypatch.setattr(StandInCursor, "executemany", rewritten)
+
+    db = MySQLConnector(helper, server.connect())
+    db.load_forums(make_forum_data(2, 2, 3, CRAWLING_DATE))
+    users = make_detailed_users(5, 2, CRAWLING_DATE)
+    assert db.bulk_load_user_general(users) == []
+    assert db.bulk_load_user_detailed(users) == []
+    messages = [{"topic_link": "http://germania.test/viewtopic.php?id=7", "position": position, "post_link": None,
+                 "author": "alice", "posted_at": None, "body": "Message", "crawling_date": CRAWLING_DATE}
+                for position in (1, 2)]
+    pages = [{"topic_link": "http://germania.test/viewtopic.php?id=7", "first_position": 1, "last_position": 2,
+              "messages": messages}]
+    assert db.bulk_load_post_messages(pages) == []
+    metrics = CrawlMetrics(helper, "topics")
+    metrics.record("fetch", 0.5)
+    metrics.stop(2)
+    db.load_metrics(metrics, CRAWLING_DATE)
+
+    # Every statement could be rewritten, none falls back to one statement per row
+    assert len(statements) == 8
+    assert None not in statements
@@ -0,0 +1,158 @@
+# Copyright (C) 2023 Martin Pretz
+
+import os
+import pytest
+from conftest import FIXTURE_PATH
+from forums import Forums
+from transport import Transport
+from replay import FixtureStore, ReplayAdapter, install
+from database import MySQLConnector
+from benchmark_db import StandInServer
+
+# The recorded forum: forums 1 and 2 list three subforums each, forums 3 and 4 list topics.
+# Every topic list has three pages, its first page holds four topics and a moved one, the others five topics each.
+BASE_LINK = "http://germania.test/"
+TOPICS_PER_LIST = 14
+
+@pytest.fixture
+def store():
+    return FixtureStore(os.path.join(FIXTURE_PATH, "forum"))
+
+def replay_forums(helper, store):
+    """
+    Returns:
+        tuple: A Forums crawler answered from the fixtures, without database, and the adapter serving them.
+    """
+    transport = Transport(helper, proxy=None)
+    adapter = ReplayAdapter(store)
+    install(transport, adapter)
+    return Forums(BASE_LINK, "cookie", helper, None, transport), adapter
+
+def test_crawl_forums_replays_the_whole_tree(helper, store):
+    scraper, adapter = replay_forums(helper, store)
+    forum_data = scraper.crawl_forums()
+
+    assert [forum["link"] for forum in forum_data] == ["http://germania.test/viewforum.php?id={}".format(idx)
+                                                       for idx in range(1, 5)]
+    for forum in forum_data[:2]:
+        assert "posts" not in forum
+        assert len(forum["subforums"]) == 3
+        for subforum in forum["subforums"]:
+            assert len(subforum["posts"]) == TOPICS_PER_LIST
+    for forum in forum_data[2:]:
+        assert "subforums" not in forum
+        assert len(forum["posts"]) == TOPICS_PER_LIST
+    # Every recorded page is fetched exactly once
+    assert adapter.request_count == len(store.urls())
+
+def test_crawl_forums_extracts_the_fields(helper, store):
+    scraper, _ = replay_forums(helper, store)
+    forum_data = scraper.crawl_forums(crawling_date="2023-09-02 08:00:00")
+
+    forum = forum_data[0]
+    assert forum["title"] == "Forum 1"
+    assert (forum["topics_count"], forum["posts_count"], forum["last_post_author"]) == ("11", "101", "auth1")
+    subforum = forum["subforums"][0]
+    assert subforum["link"] == "http://germania.test/viewforum.php?id=11"
+    assert subforum["last_post_time"] == "2023-09-01"
+    post = forum_data[2]["posts"][0]
+    assert post == {
+        "element_type": "post",
+        "crawling_date": "2023-09-02 08:00:00",
+        "title": "Topic 3011",
+        "link": "http://germania.test/viewtopic.php?id=3011",
+        "author": "author3011",
+        "replies_count": "1100",
+        "views_count": "2100",
+        "last_post_time": post["last_post_time"],
+        "last_post_author": "last3011"
+    }
+    # The topics of the later pages follow the first page's
+    assert forum_data[2]["posts"][-1]["link"] == "http://germania.test/viewtopic.php?id=3035"
+
+def test_crawl_forums_leaves_out_unavailable_forums(helper, store):
+    del store.manifest["http://germania.test/viewforum.php?id=3"]
+    scraper, _ = replay_forums(helper, store)
+    forum_data = scraper.crawl_forums()
+
+    assert [forum["link"] for forum in forum_data] == ["http://germania.test/viewforum.php?id={}".format(idx)
+                                                       for idx in (1, 2, 4)]
+
+def test_crawl_forums_fails_without_index(helper, store):
+    del store.manifest[BASE_LINK]
+    scraper, _ = replay_forums(helper, store)
+
+    assert scraper.crawl_forums() is None
+
+def test_failed_crawl_stores_its_metrics(helper, store):
+    del store.manifest[BASE_LINK]
+    scraper, _ = replay_forums(helper, store)
+    server = StandInServer(round_trip=0.0, row_cost=0.0, commit_cost=0.0)
+    scraper.db = MySQLConnector(helper, server.connect())
+
+    assert scraper.crawl_forums(auto_push_db=True) is None
+    stages = {row["stage"]: row for row in server.tables["crawl_metrics"]}
+    assert stages["crawl"]["errors"] == 1
+    assert stages["fetch"]["errors"] == 1
+    # The loaders no longer record into the metrics of the failed crawl
+    assert not scraper.db.metrics
+
+@pytest.mark.parametrize("missing_link", [None, "http://germania.test/viewforum.php?id=3",
+                                          "http://germania.test/viewforum.php?id=11",
+                                          "http://germania.test/viewforum.php?id=3&p=2"])
+def test_crawl_with_left_out_pages_is_not_finished(helper, store, monkeypatch, missing_link):
+    if missing_link:
+        del store.manifest[missing_link]
+    scraper, _ = replay_forums(helper, store)
+    server = StandInServer(round_trip=0.0, row_cost=0.0, commit_cost=0.0)
+    scraper.db = MySQLConnector(helper, server.connect())
+    finished = []
+    monkeypatch.setattr(scraper.db, "finish_run", lambda crawler, crawling_date: finished.append(crawler))
+
+    assert scraper.crawl_forums(auto_push_db=True) is not None
+    assert scraper.dropped == ([missing_link] if missing_link else [])
+    # The crawl is stored either way, but only a complete one becomes the latest snapshot
+    assert server.tables["posts"]
+    assert finished == ([] if missing_link else ["forums"])
+    stages = {row["stage"]: row for row in server.tables["crawl_metrics"]}
+    assert stages["crawl"]["errors"] == (1 if missing_link else 0)
+
+class SnapshotDB():
+    """
+    Stands in for the database of the forum crawl, only answering with a stored crawl as the latest one.
+    """
+    def __init__(self, forum_data):
+        self.forums, self.subforums, self.posts = [], [], []
+        def add_posts(topic_list, forum_id, subforum_id):
+            self.posts.extend(dict(post, forum_id=forum_id, subforum_id=subforum_id, post_id=len(self.posts) + idx + 1)
+                              for idx, post in enumerate(topic_list.get("posts", [])))
+        for forum in forum_data:
+            forum_id = len(self.forums) + 1
+            self.forums.append(dict(forum, forum_id=forum_id))
+            add_posts(forum, forum_id, None)
+            for subforum in forum.get("subforums", []):
+                subforum_id = len(self.subforums) + 1
+                self.subforums.append(dict(subforum, forum_id=forum_id, subforum_id=subforum_id))
+                add_posts(subforum, None, subforum_id)
+
+    def get_latest_forum_snapshot(self):
+        return self.forums, self.subforums, self.posts
+
+def test_crawl_forums_stops_at_known_topics(helper, store):
+    scraper, _ = replay_forums(helper, store)
+    previous_data = scraper.crawl_forums()
+
+    scraper, adapter = replay_forums(helper, store)
+    scraper.db = SnapshotDB(previous_data)
+    forum_data = scraper.crawl_forums()
+
+    # The first page of every topic list only holds known topics, none of the later pages is fetched
+    assert adapter.request_count == len(store.urls()) - 8 * 2
+    # The topics of the later pages are copied forward from the latest crawl
+    assert [post["link"] for post in forum_data[2]["posts"]] == [post["link"] for post in previous_data[2]["posts"]]
+    assert len(forum_data[0]["subforums"][0]["posts"]) == TOPICS_PER_LIST
+
+def test_empty_page_is_not_known(helper, store):
+    scraper, _ = replay_forums(helper, store)
+
+    assert not scraper._Forums__only_known_posts([], set())
@@ -0,0 +1,51 @@
+# Copyright (C) 2023 Xian Chen, Martin Pretz
+
+import os
+import threading
+import _thread
+import requests
+from conftest import FIXTURE_PATH
+from orchestrator import CrawlOrchestrator
+from transport import Transport
+from replay import FixtureStore, ReplayAdapter, install
+
+def test_interrupt_stops_and_waits_for_the_stages(helper):
+    store = FixtureStore(os.path.join(FIXTURE_PATH, "forum"))
+    transport = Transport(helper, proxy=None)
+    install(transport, ReplayAdapter(store, latency=0.02))
+    wound_down = []
+
+    def crawl():
+        # Crawls the recorded pages over and over, until a request fails
+        while True:
+            for url in store.urls():
+                try:
+                    transport.get(url)
+                except requests.RequestException:
+                    wound_down.append(url)
+                    return
+
+    orchestrator = CrawlOrchestrator(helper, progress_interval=0.05)
+    orchestrator.add_stage("forums", crawl, [transport])
+    # Like Ctrl+C in the terminal
+    threading.Timer(0.3, _thread.interrupt_main).start()
+    assert not orchestrator.run()
+
+    stage = orchestrator.stages[0]
+    assert not stage.is_running()
+    assert len(wound_down) == 1
+    assert stage.error == "interrupted"
+    assert stage.get_progress()[0] > 0
+
+def test_interrupt_skips_the_remaining_stages(helper):
+    def crawl():
+        raise KeyboardInterrupt()
+    started = []
+
+    orchestrator = CrawlOrchestrator(helper)
+    orchestrator.add_stage("forums", crawl)
+    orchestrator.add_stage("users", lambda: started.append("users"))
+    assert not orchestrator.run(concurrent=False)
+
+    assert orchestrator.stages[0].error == "interrupted"
+    assert not started
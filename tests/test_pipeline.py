@@ -0,0 +1,40 @@
+# Copyright (C) 2023 Xian Chen
+
+import json
+from pipeline import WriteThroughPipeline
+
+def test_only_stored_records_are_reported(helper, tmp_path):
+    def load_batch(records):
+        # The database rejects every record with an odd number
+        return [record for record in records if record["number"] % 2]
+
+    flushed = []
+    jsonl_path = tmp_path / "records.jsonl"
+    pipeline = WriteThroughPipeline(helper, str(jsonl_path), load_batch=load_batch, on_flush=flushed.extend,
+                                    batch_size=4, flush_interval=60)
+    for number in range(10):
+        pipeline.put({"number": number}, key="profile{}".format(number))
+    pipeline.close()
+
+    assert flushed == ["profile{}".format(number) for number in range(0, 10, 2)]
+    assert pipeline.count == 5
+    assert pipeline.failed == 5
+    # The JSONL file keeps every record, stored or not
+    assert [json.loads(line)["number"] for line in jsonl_path.read_text().splitlines()] == list(range(10))
+
+def test_failed_batch_is_not_reported(helper, tmp_path):
+    def load_batch(records):
+        if records[0]["number"] == 4:
+            raise RuntimeError("connection lost")
+        return []
+
+    flushed = []
+    pipeline = WriteThroughPipeline(helper, str(tmp_path / "records.jsonl"), load_batch=load_batch,
+                                    on_flush=flushed.extend, batch_size=4, flush_interval=60)
+    for number in range(10):
+        pipeline.put({"number": number}, key=number)
+    pipeline.close()
+
+    assert flushed == [0, 1, 2, 3, 8, 9]
+    assert pipeline.count == 6
+    assert pipeline.failed == 4
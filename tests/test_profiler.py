@@ -0,0 +1,29 @@
+# Copyright (C) 2023 Martin Pretz
+
+import multiprocessing
+import pytest
+import profiler
+from database import MySQLConnector
+from benchmark_db import StandInServer, make_detailed_users
+
+@pytest.fixture
+def tracer(helper, tmp_path):
+    tracer = profiler.enable(helper, str(tmp_path / "trace.json"))
+    yield tracer
+    profiler.disable()
+
+def records_spans():
+    return profiler.span("parse") is not profiler.NO_SPAN
+
+def test_forked_processes_do_not_record(tracer):
+    assert records_spans()
+    with multiprocessing.get_context("fork").Pool(1) as pool:
+        assert not pool.apply(records_spans)
+
+def test_commits_are_recorded(helper, tracer):
+    server = StandInServer(round_trip=0.0, row_cost=0.0, commit_cost=0.0)
+    MySQLConnector(helper, server.connect()).bulk_load_user_detailed(make_detailed_users(3, 2, "2023-09-02 08:00:00"))
+
+    stats = tracer.get_stats()
+    assert stats["insert"][0] == 2
+    assert stats["commit"][0] >= 1
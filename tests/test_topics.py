@@ -0,0 +1,102 @@
+# Copyright (C) 2023 Martin Pretz
+
+import pytest
+import config
+from topics import Topics
+from transport import Transport
+from replay import FixtureStore, ReplayAdapter, install
+
+TOPIC_LINK = "http://germania.test/viewtopic.php?id=7"
+
+def topic_page(messages, page_count):
+    """
+    Returns:
+        bytes: A topic page holding the given (number, author) messages, a message without author like a deleted one.
+    """
+    posts = "".join(
+        '<div class="post"><span class="post-num">#{0}</span>'
+        '<span class="post-link"><a href="http://germania.test/viewtopic.php?pid={0}#p{0}">2023-09-01 12:00:0{0}</a></span>'
+        '{1}<div class="entry-content"><p>Message {0}</p></div></div>'.format(
+            number, '<span class="post-byline"><strong>{}</strong></span>'.format(author) if author else "")
+        for number, author in messages)
+    return '<html><head><link rel="last" href="{}&p={}"></head><body>{}</body></html>'.format(
+        TOPIC_LINK, page_count, posts).encode("utf-8")
+
+class TopicProgressDB():
+    """
+    Stands in for the database of the topic crawl, moving the progress of a topic like UPSERT_TOPIC_PROGRESS_QUERY.
+    """
+    def __init__(self, replies_count):
+        self.replies_count = replies_count
+        self.progress = {}
+        self.messages = {}
+        self.finished = []
+        self.fail = False
+
+    def get_topics(self):
+        return [{"link": TOPIC_LINK, "replies_count": self.replies_count, "stored": self.progress.get(TOPIC_LINK, 0)}]
+
+    def bulk_load_post_messages(self, pages):
+        if self.fail:
+            return pages
+        for page in pages:
+            self.messages.update({message["position"]: message for message in page["messages"]})
+            stored = self.progress.get(page["topic_link"], 0)
+            if page["first_position"] <= stored + 1:
+                self.progress[page["topic_link"]] = max(stored, page["last_position"])
+        return []
+
+    def track_metrics(self, metrics):
+        self.metrics = metrics
+
+    def load_metrics(self, metrics, crawling_date):
+        self.loaded_metrics = metrics
+
+    def finish_run(self, crawler, crawling_date):
+        self.finished.append(crawler)
+
+@pytest.fixture
+def topics(helper, tmp_path, monkeypatch):
+    """
+    Returns:
+        tuple: A Topics crawler answered from a topic of three pages with two messages each and its database.
+        The 3rd message is deleted and left out by the page, the last page only holds the 5th message.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, "CRAWLER_TOPIC_MESSAGES_PER_PAGE", 2)
+    store = FixtureStore(str(tmp_path / "topic"))
+    store.save(TOPIC_LINK, topic_page([(1, "alice"), (2, "bob")], 3))
+    store.save(TOPIC_LINK + "&p=2", topic_page([(3, None), (4, "alice")], 3))
+    store.save(TOPIC_LINK + "&p=3", topic_page([(5, "bob")], 3))
+    transport = Transport(helper, proxy=None)
+    adapter = ReplayAdapter(store)
+    install(transport, adapter)
+    db = TopicProgressDB(replies_count=4)
+    return Topics(helper, db, transport, workers=2), db, adapter
+
+def test_left_out_message_does_not_hold_the_progress_back(topics):
+    crawler, db, adapter = topics
+
+    assert crawler.crawl_topics() == 4
+    assert sorted(db.messages) == [1, 2, 4, 5]
+    assert db.progress[TOPIC_LINK] == 5
+    assert db.finished == ["topics"]
+    # The topic is complete, the next crawl fetches nothing
+    assert crawler.crawl_topics() == 0
+    assert adapter.request_count == 3
+
+def test_unstored_pages_are_fetched_again(topics):
+    crawler, db, adapter = topics
+    db.progress[TOPIC_LINK] = 2
+    db.fail = True
+
+    assert crawler.crawl_topics() == 0
+    assert db.finished == []
+    assert db.metrics.get_stats()["crawl"]["errors"] == 1
+    # The next crawl continues after the stored messages, on the second page
+    db.fail = False
+    assert crawler.crawl_topics() == 2
+    assert sorted(db.messages) == [4, 5]
+    assert db.progress[TOPIC_LINK] == 5
+    assert db.finished == ["topics"]
+    assert adapter.request_count == 4
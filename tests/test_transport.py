@@ -0,0 +1,87 @@
+# Copyright (C) 2023 Martin Pretz
+
+import time
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import BaseAdapter
+from transport import Circuit, CircuitPool
+from retry import RetryPolicy
+from replay import install
+
+class CircuitStandIn(BaseAdapter):
+    """
+    Stands in for the Tor circuit of a session: answers every request after a delay, with a fixed status.
+    """
+    def __init__(self, latency=0.0, status=200):
+        super().__init__()
+        self.latency = latency
+        self.status = status
+        self.lock = threading.Lock()
+        self.request_count = 0
+
+    def send(self, request, **kwargs):
+        time.sleep(self.latency)
+        with self.lock:
+            self.request_count += 1
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.status_code = self.status
+        response._content = b"<html><body></body></html>"
+        return response
+
+    def close(self):
+        pass
+
+def circuit_pool(helper, stand_ins):
+    """
+    Returns:
+        CircuitPool: A pool with one circuit per stand-in, failed requests are not retried.
+    """
+    pool = CircuitPool(helper, proxies=["socks5h://127.0.0.1:9050"], circuits_per_proxy=len(stand_ins),
+                       retry=RetryPolicy(helper, retries=0))
+    for circuit, stand_in in zip(pool.circuits, stand_ins):
+        install(circuit.transport, stand_in)
+    return pool
+
+def test_circuits_are_isolated(helper):
+    pool = CircuitPool(helper, proxies=["socks5h://127.0.0.1:9050"], circuits_per_proxy=3)
+
+    assert len({circuit.name for circuit in pool.circuits}) == 3
+
+def test_slow_circuit_receives_less_work(helper):
+    fast, other_fast, slow = CircuitStandIn(0.01), CircuitStandIn(0.01), CircuitStandIn(0.1)
+    pool = circuit_pool(helper, [fast, other_fast, slow])
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        responses = list(executor.map(pool.get, ["http://germania.test/profile.php?id={}".format(idx)
+                                                 for idx in range(60)]))
+
+    assert all(response.status_code == 200 for response in responses)
+    assert fast.request_count + other_fast.request_count + slow.request_count == 60
+    assert slow.request_count < min(fast.request_count, other_fast.request_count)
+
+def test_failing_circuit_is_avoided_and_probed_again(helper):
+    failing, healthy = CircuitStandIn(status=503), CircuitStandIn(0.01)
+    pool = circuit_pool(helper, [failing, healthy])
+    for idx in range(10):
+        pool.get("http://germania.test/profile.php?id={}".format(idx))
+    assert failing.request_count == 1
+    assert healthy.request_count == 9
+
+    # The circuit recovers while it is avoided, once its statistics have faded it is probed and used again
+    failing.status = 200
+    pool.circuits[0].updated -= 20 * Circuit.HALF_LIFE
+    for idx in range(10):
+        pool.get("http://germania.test/profile.php?id={}".format(idx))
+    assert failing.request_count > 1
+
+def test_circuit_statistics_fade_while_idle():
+    circuit = Circuit("circuit", None)
+    circuit.record(1.0, True, now=0.0)
+
+    # The error penalty of 10s and an error rate of 0.3, both halved after one half-life
+    assert circuit.score(now=0.0) == 10.0 * (1 + 10 * 0.3)
+    assert abs(circuit.score(now=Circuit.HALF_LIFE) - 5.0 * (1 + 10 * 0.15)) < 1e-9
+    circuit.record(1.0, False, now=Circuit.HALF_LIFE)
+    assert circuit.latency == 5.0 + Circuit.SMOOTHING * (1.0 - 5.0)
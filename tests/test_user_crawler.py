@@ -0,0 +1,38 @@
+# Copyright (C) 2023 Xian Chen
+
+import config
+from user_crawler import User_Profiles
+from transport import Transport
+from replay import FixtureStore, ReplayAdapter, install
+
+class FinishRunDB():
+    """
+    Stands in for the database of the general user crawl, recording which crawls were finished.
+    """
+    def __init__(self):
+        self.finished = []
+
+    def bulk_load_user_general(self, users):
+        return []
+
+    def track_metrics(self, metrics):
+        pass
+
+    def load_metrics(self, metrics, crawling_date):
+        self.metrics = metrics
+
+    def finish_run(self, crawler, crawling_date):
+        self.finished.append(crawler)
+
+def test_general_crawl_with_dead_pages_is_not_finished(helper, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, "CRAWLER_USERLIST_LINKS", config.CRAWLER_USERLIST_LINKS[:2])
+    # No userlist page is recorded, every page fails
+    transport = Transport(helper, proxy=None)
+    install(transport, ReplayAdapter(FixtureStore(str(tmp_path / "userlist"))))
+    db = FinishRunDB()
+    crawler = User_Profiles(0, helper, db, transport)
+
+    assert set(crawler.dead_pages) == set(config.CRAWLER_USERLIST_LINKS)
+    assert db.finished == []
+    assert db.metrics.get_stats()["crawl"]["errors"] == 1